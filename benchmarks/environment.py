@@ -0,0 +1,37 @@
+"""isolated settings for benchmark runs
+
+Importing it makes configdb importable from src. prepare() has to run
+before configdb is imported, the application reads its settings and
+creates the database at import time.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def prepare(database=None, backend='memory'):
+    """point configdb at a fresh sqlite database in a temporary directory
+
+    Args:
+        database (str): use this sqlite file or database URI instead of a
+            temporary sqlite database, e.g. a locally started postgresql
+        backend (str): CONFIGDB_BACKEND of the run
+    """
+    directory = tempfile.mkdtemp(prefix='configdb-bench-')
+    atexit.register(shutil.rmtree, directory, True)
+    if database is None:
+        database = os.path.join(directory, 'bench.db')
+    if '://' not in database:
+        database = 'sqlite:///' + os.path.abspath(database)
+    settings = os.path.join(directory, 'bench.cfg')
+    with open(settings, 'w') as f:
+        f.write('DEBUG = False\n')
+        f.write('SQLALCHEMY_DATABASE_URI = %r\n' % database)
+        f.write('SQLALCHEMY_TRACK_MODIFICATIONS = False\n')
+        f.write('CONFIGDB_BACKEND = %r\n' % backend)
+    os.environ['CONFIGDB_SETTINGS'] = settings
+    return directory
@@ -0,0 +1,85 @@
+"""throughput of the properties loader of PUT compared to the previous one
+
+usage: python benchmarks/propertyparser.py [lines]
+"""
+import re
+import sys
+import time
+
+import environment
+environment.prepare()
+from configdb.propertyparser import PropertyParser  # noqa: E402
+from configdb.ingest import load_prop  # noqa: E402
+
+pat_legacy = re.compile(r'\s*([^#!:=]+)(?:\s*[\s=:]\s*)(.+$)')
+
+
+def legacy_load(data):
+    """the regex loader PropertyParser used before the rewrite"""
+    result = {}
+    pending = ''
+    for line in data.split('\n'):
+        if line.endswith('\\'):
+            pending += line[:-1] + ' '
+            continue
+        line = (pending + line).strip()
+        pending = ''
+        m = pat_legacy.match(line)
+        if not m:
+            continue
+        key, val = map(lambda x: x.strip(), m.groups())
+        val = PropertyParser.cast(val)
+        node = result
+        for element in key.split('.')[:-1]:
+            try:
+                assert(isinstance(node[element], dict))
+            except (KeyError, AssertionError):
+                node[element] = {}
+            node = node[element]
+        node[key.split('.')[-1]] = val
+    return legacy_makelist(result)
+
+
+def legacy_makelist(node):
+    if isinstance(node, dict) and '0' in node.keys():
+        try:
+            tmp = [(int(k), v) for k, v in node.items()]
+            return [legacy_makelist(x[1]) for x in sorted(tmp)]
+        except ValueError:
+            pass
+    if isinstance(node, dict):
+        return dict((k, legacy_makelist(v)) for k, v in node.items())
+    return node
+
+
+def generate(lines):
+    """properties text with lines keys, grouped like a dump of a real tree"""
+    result = []
+    for index in range(lines):
+        host, service, item = index // 1000, index // 20 % 50, index % 20
+        if item < 10:
+            result.append('hosts.host%d.services.svc%d.ports.%d = %d' % (host, service, item, 8000 + item))
+        else:
+            result.append('hosts.host%d.services.svc%d.option%d = "value %d"' % (host, service, item, index))
+    return '\n'.join(result)
+
+
+def measure(name, load, data, lines):
+    start = time.time()
+    load(data)
+    seconds = time.time() - start
+    print('%-8s %8.2fs %12.0f lines/s' % (name, seconds, lines / seconds))
+    return seconds
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    data = generate(lines)
+    print('%d lines, %.1f MB' % (lines, len(data) / 1e6))
+    legacy = measure('legacy', legacy_load, data, lines)
+    current = measure('current', lambda x: load_prop([x]), data, lines)
+    print('speedup  %8.2fx' % (legacy / current))
+
+
+if __name__ == '__main__':
+    main()
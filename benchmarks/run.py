@@ -0,0 +1,318 @@
+"""configdb benchmark suite
+
+Runs against a temporary sqlite database, or the one given with
+--database, through the flask test client and prints the results as JSON. Pass an earlier result file with
+--compare to list the measurements that changed.
+
+usage: python benchmarks/run.py [options] > result.json
+"""
+import argparse
+import contextlib
+import json
+import platform
+import sys
+import time
+
+import environment
+import trees
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """register a benchmark, it is called with the parsed arguments"""
+    BENCHMARKS.append(func)
+    return func
+
+
+def summary(samples):
+    """timing statistics in milliseconds"""
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'n': n,
+        'min': samples[0] * 1000,
+        'median': samples[n // 2] * 1000,
+        'mean': sum(samples) / n * 1000,
+        'p95': samples[min(n - 1, int(n * 0.95))] * 1000,
+        'max': samples[-1] * 1000,
+    }
+
+
+def timed(func, repeat, before=None):
+    """call func repeat times, before is called untimed ahead of each call"""
+    samples = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summary(samples)
+
+
+class QueryCounter(object):
+    """count the statements sent to the database"""
+    def __init__(self, engine):
+        self.count = 0
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self.executed)
+
+    def executed(self, *args):
+        self.count += 1
+
+    @contextlib.contextmanager
+    def measure(self, result):
+        """store the number of statements of the block in result['queries']"""
+        start = self.count
+        yield
+        result['queries'] = self.count - start
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError('%s: %s' % (response.status, response.get_data(as_text=True)[:200]))
+    return response
+
+
+def put(client, path, fmt, body):
+    return check(client.put(
+        '/api/v1/%s' % path, data=body, content_type=CONTENT_TYPES[fmt]))
+
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'yaml': 'application/yaml',
+    'prop': 'application/properties',
+    'msgpack': 'application/msgpack',
+}
+
+
+@benchmark
+def get_latency(args, context):
+    """GET of the whole tree per format, from the tree and from the cache"""
+    from configdb.views import publish
+    client = context['client']
+    put(client, 'bench/get', 'json', json.dumps(context['tree']))
+    result = {}
+    for fmt in ('json', 'yaml', 'prop', 'msgpack', 'html'):
+        url = '/api/v1/bench/get?format=%s' % fmt
+        size = len(check(client.get(url)).data)
+        result[fmt] = {
+            'bytes': size,
+            'uncached': timed(lambda: check(client.get(url)).data, args.repeat,
+                              before=lambda: publish('bench/get')),
+            'cached': timed(lambda: check(client.get(url)).data, args.repeat),
+        }
+    return result
+
+
+@benchmark
+def put_throughput(args, context):
+    """PUT of the whole tree per content type"""
+    from configdb.formatter import Formatter
+    client = context['client']
+    leaves = context['leaves']
+    result = {}
+    for fmt in sorted(CONTENT_TYPES):
+        body = getattr(Formatter.detached(context['tree']), fmt)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        stats = timed(lambda: put(client, 'bench/put', fmt, body), args.repeat)
+        seconds = stats['median'] / 1000
+        result[fmt] = {
+            'bytes': len(body),
+            'time': stats,
+            'leaves_per_second': leaves / seconds,
+            'bytes_per_second': len(body) / seconds,
+        }
+    return result
+
+
+@benchmark
+def path_depth(args, context):
+    """lookup of a single value at growing depth"""
+    from configdb.node import Node
+    from configdb.views import publish
+    client = context['client']
+    put(client, 'bench/chain', 'json', json.dumps(trees.chain(args.chain_depth)))
+    result = {}
+    depth = 1
+    while depth <= args.chain_depth:
+        path = 'bench/chain/%s/value' % trees.chain_path(depth)
+        url = '/api/v1/%s?format=json' % path
+        result[str(depth)] = {
+            'lookup': timed(lambda: Node.by_path(path), args.repeat),
+            'get': timed(lambda: check(client.get(url)).data, args.repeat,
+                         before=lambda: publish(path)),
+        }
+        depth *= 2
+    return result
+
+
+@benchmark
+def properties(args, context):
+    """PropertyParser dump of the tree, load into a detached tree as PUT does"""
+    from configdb.propertyparser import PropertyParser
+    from configdb.ingest import load_prop
+    text = PropertyParser(context['tree']).dump()
+    lines = text.count('\n') + 1
+    dump = timed(lambda: PropertyParser(context['tree']).dump(), args.repeat)
+    load = timed(lambda: load_prop([text]), args.repeat)
+    return {
+        'lines': lines,
+        'bytes': len(text),
+        'dump': dump,
+        'load': load,
+        'load_lines_per_second': lines / (load['median'] / 1000),
+    }
+
+
+@benchmark
+def storage(args, context):
+    """schema.Node pickle and unpickle, statements and time"""
+    from configdb.meta import db
+    from configdb.schema import Node, init
+    init()
+    counter = context['queries']
+    tree = context['tree']
+    changed = trees.TreeGenerator(args.width, args.depth, context['mix'], seed=args.seed + 1).tree()
+    result = {}
+    steps = (
+        ('insert', lambda node: node.pickle(tree)),
+        ('unchanged', lambda node: node.pickle(tree)),
+        ('update', lambda node: node.pickle(changed)),
+        ('unpickle', lambda node: node.unpickle()),
+        ('delete', lambda node: node.pickle({})),
+    )
+    for name, _ in steps:
+        result[name] = {'time': [], 'queries': 0}
+    for index in range(max(1, args.repeat // 4)):
+        node = Node.fetch_by_path('bench/storage%d' % index, create=True)
+        db.session.commit()
+        for name, step in steps:
+            entry = {}
+            with counter.measure(entry):
+                start = time.perf_counter()
+                step(node)
+                db.session.commit()
+                result[name]['time'].append(time.perf_counter() - start)
+            result[name]['queries'] = entry['queries']
+    for name, _ in steps:
+        result[name]['time'] = summary(result[name]['time'])
+    return result
+
+
+def flatten(data, prefix=''):
+    """dotted key -> number for all numbers in a nested result"""
+    result = {}
+    for key, value in data.items():
+        name = '%s.%s' % (prefix, key) if prefix else key
+        if isinstance(value, dict):
+            result.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[name] = value
+    return result
+
+
+def compare(baseline, current, threshold):
+    """print medians and query counts that differ by more than threshold
+
+    Returns:
+        number of regressions, slower medians or more statements
+    """
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        if not key.endswith(('.median', '.queries')) or not old[key]:
+            continue
+        ratio = new[key] / old[key]
+        if abs(ratio - 1) <= threshold:
+            continue
+        worse = ratio > 1
+        regressions += worse
+        sys.stderr.write('%-9s %-50s %10.3f -> %10.3f  x%.2f\n' % (
+            'SLOWER' if worse else 'faster', key, old[key], new[key], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=8, help='children per branch')
+    parser.add_argument('--depth', type=int, default=4, help='levels of branches')
+    parser.add_argument('--mix', default='str=4,int=2,float=1,bool=1',
+                        help='leaf type weights, types: %s' % ', '.join(sorted(trees.LEAVES)))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='samples per measurement')
+    parser.add_argument('--chain-depth', type=int, default=64, help='deepest path for path_depth')
+    parser.add_argument('--only', action='append', choices=[x.__name__ for x in BENCHMARKS],
+                        help='run only this benchmark, can be repeated')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--backend', default='memory', help='CONFIGDB_BACKEND of the run')
+    parser.add_argument('--database', help='sqlite file or database URI, a temporary sqlite file by default')
+    parser.add_argument('--compare', help='JSON result of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported by --compare')
+    args = parser.parse_args()
+    mix = trees.parse_mix(args.mix)
+
+    environment.prepare(args.database, args.backend)
+    # keep stdout for the result
+    with contextlib.redirect_stdout(sys.stderr):
+        import logging
+        from configdb import app
+        from configdb.meta import db
+        app.logger.setLevel(logging.WARNING)
+        generator = trees.TreeGenerator(args.width, args.depth, mix, seed=args.seed)
+        tree = generator.tree()
+        branches, leaves = trees.count(tree)
+        context = {
+            'client': app.test_client(),
+            'queries': QueryCounter(db.engine),
+            'tree': tree,
+            'mix': mix,
+            'leaves': leaves,
+        }
+        results = {}
+        for func in BENCHMARKS:
+            if args.only and func.__name__ not in args.only:
+                continue
+            sys.stderr.write('%s\n' % func.__name__)
+            results[func.__name__] = func(args, context)
+
+    output = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'width': args.width,
+            'depth': args.depth,
+            'mix': mix,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'chain_depth': args.chain_depth,
+            'backend': args.backend,
+            'branches': branches,
+            'leaves': leaves,
+        },
+        'results': results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != output['parameters']:
+            sys.stderr.write('warning: the runs used different parameters\n')
+        if compare(baseline, output, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""synthetic configuration trees"""
+import random
+import string
+
+# leaf type -> factory(rng)
+LEAVES = {
+    'str': lambda rng: ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(4, 24))),
+    'int': lambda rng: rng.randint(-100000, 100000),
+    'float': lambda rng: round(rng.uniform(-1000, 1000), 3),
+    'bool': lambda rng: rng.random() < 0.5,
+}
+
+
+def parse_mix(text):
+    """leaf type weights from 'str=4,int=2', unknown types raise ValueError"""
+    result = {}
+    for item in filter(None, text.split(',')):
+        name, _, weight = item.partition('=')
+        if name not in LEAVES:
+            raise ValueError('unknown leaf type %s, one of %s' % (name, ', '.join(sorted(LEAVES))))
+        result[name] = float(weight or 1)
+    return result
+
+
+class TreeGenerator(object):
+    """reproducible trees with a fixed fan out
+
+    Every branch has width children. On the last level all children are
+    leaves, above it every list_every-th branch is a list, the rest are
+    dictionaries.
+
+    Args:
+        width (int): children per branch
+        depth (int): levels of branches below the root
+        mix (dict): leaf type -> weight
+        seed (int): random seed, equal arguments give equal trees
+        list_every (int): every n-th branch is a list, 0 for none
+    """
+    def __init__(self, width, depth, mix, seed=0, list_every=4):
+        self.width = width
+        self.depth = depth
+        self.rng = random.Random(seed)
+        self.types = sorted(mix)
+        self.weights = [mix[x] for x in self.types]
+        self.list_every = list_every
+        self.branches = 0
+
+    def leaf(self):
+        kind = self.rng.choices(self.types, self.weights)[0]
+        return LEAVES[kind](self.rng)
+
+    def tree(self, level=0):
+        if level >= self.depth:
+            return self.leaf()
+        self.branches += 1
+        children = [self.tree(level + 1) for _ in range(self.width)]
+        if self.list_every and self.branches % self.list_every == 0 and level:
+            return children
+        return dict(('key%d' % index, child) for index, child in enumerate(children))
+
+
+def chain(depth, label='level'):
+    """a dictionary nested depth times, with a value on every level"""
+    result = {'value': depth}
+    for level in reversed(range(depth)):
+        result = {'value': level, '%s%d' % (label, level + 1): result}
+    return result
+
+
+def chain_path(depth, label='level'):
+    """path of the depth-th dictionary of chain()"""
+    return '/'.join('%s%d' % (label, level + 1) for level in range(depth))
+
+
+def count(data):
+    """number of (branches, leaves) in data"""
+    if isinstance(data, dict):
+        data = list(data.values())
+    if not isinstance(data, list):
+        return 0, 1
+    branches, leaves = 1, 0
+    for child in data:
+        b, l = count(child)
+        branches += b
+        leaves += l
+    return branches, leaves
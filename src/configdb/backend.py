@@ -0,0 +1,441 @@
+"""storage backends
+
+The server answers from the versioned in-memory tree, node.TREE. A
+backend is where the tree lives beyond the process: at start the tree is
+loaded from it, every write is stored in it before the new tree is
+published. CONFIGDB_BACKEND selects one of BACKENDS.
+
+memory keeps nothing beyond the process, its operations work on TREE.
+sqlite and postgresql store schema.Node rows with materialized paths, a
+subtree is a single range scan and every change is kept in the history.
+Reads as of a revision are answered by the backend: memory keeps the
+roots of recent revisions, the databases read their history.
+
+Several processes can share a database. Every write records its paths
+with its revision, a process stores a write only on top of the last
+stored revision and otherwise applies the writes of the others first,
+see scheduler.WriteScheduler.sync.
+"""
+from configdb.meta import app, db, read_session
+from configdb.errors import InvalidPath, InvalidRevision, StaleTree
+from configdb.node import TREE, Node
+from configdb.cache import VERSIONS, split_path
+from configdb.history import diff
+from configdb.watch import HUB
+from configdb import schema
+import abc
+import functools
+import hashlib
+import json
+import random
+import sqlalchemy
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.exc
+import time
+
+
+def publish(*paths, revision=None):
+    """announce a write to paths to the response cache and all watchers,
+    return the revision of the write
+
+    Args:
+        revision (int): the revision the backend stored the write as
+    """
+    revision = VERSIONS.touch(*paths, revision=revision)
+    HUB.publish(revision, *paths)
+    return revision
+
+
+def apply(root, items):
+    """write items to the tree below root
+
+    Args:
+        items: list of (path, data), data None removes the path
+    """
+    for path, data in items:
+        if data is not None:
+            Node.by_path(path, create=True, root=root).pickle(data)
+            continue
+        node = Node.by_path(path, root=root)
+        if node is root:
+            node.pickle({})
+        elif node is not None:
+            node.parent = None
+
+
+class Backend(abc.ABC):
+    """storage interface
+
+    Paths are slash separated, '' is the root. Data is the structure
+    unpickle returns.
+
+    Attributes:
+        durable (bool): the data outlives the process, writes to TREE are
+            stored in the backend
+    """
+    durable = True
+
+    def init(self):
+        """prepare the storage, called once at start"""
+        pass
+
+    @abc.abstractmethod
+    def get(self, path, revision=None):
+        """the structure at path, None if path does not exist
+
+        Args:
+            revision (int): read the structure as of this revision
+        Raises:
+            InvalidRevision if revision is not stored
+        """
+
+    def tree(self, path, revision):
+        """a root holding the structure at path as of revision, the
+        rest of the tree may be left out
+
+        Raises:
+            InvalidRevision if revision is not stored
+            InvalidPath if path did not exist at revision
+        """
+        data = self.get(path, revision)
+        if data is None:
+            raise InvalidPath('path %s does not exist at revision %d' % (path, revision))
+        root = Node('')
+        Node.by_path(path, create=True, root=root).pickle(data)
+        return root
+
+    @abc.abstractmethod
+    def diff(self, path, old, new):
+        """changes at and below path from revision old to revision new
+
+        Returns:
+            list of changes, see history.changes
+        Raises:
+            InvalidRevision if either revision is not stored
+        """
+
+    def check(self, revision):
+        """raise InvalidRevision unless revision is stored"""
+        if not 0 <= revision <= self.revision():
+            raise InvalidRevision('revision %d is not available' % revision)
+
+    @abc.abstractmethod
+    def store(self, items, base=None):
+        """write several paths in one transaction, return the revision
+
+        Args:
+            items: list of (path, data), data None removes the path
+            base (int): the revision the written tree is based on
+        Raises:
+            StaleTree if another write was stored after base
+        """
+
+    @abc.abstractmethod
+    def revision(self):
+        """the revision of the last write"""
+
+    @abc.abstractmethod
+    def changes(self, revision):
+        """the writes stored after revision, oldest first
+
+        Returns:
+            list of (revision, written paths)
+        """
+
+    @abc.abstractmethod
+    def search(self, search):
+        """the first page of leaves matching search
+
+        Args:
+            search: search.Search
+        Returns:
+            list of (labels, value) in the order of the materialized paths
+        """
+
+    def epoch(self):
+        """token of the stored revisions, see SubtreeVersions.epoch"""
+        return VERSIONS.epoch
+
+    def load(self):
+        """replace TREE with the stored tree, published as a write of the
+        whole tree at the revision of the last stored write"""
+        VERSIONS.epoch = self.epoch()
+        revision = self.revision()
+        data = self.get('')
+        with TREE.write() as transaction:
+            transaction.root.pickle(data if data is not None else {})
+            transaction.commit(functools.partial(publish, revision=revision), '')
+
+
+class MemoryBackend(Backend):
+    """the in-memory tree itself, lost when the process ends"""
+    durable = False
+
+    def get(self, path, revision=None):
+        root = TREE.root if revision is None else self.snapshot(revision)
+        node = Node.by_path(path, root=root)
+        return node.unpickle() if node is not None else None
+
+    def snapshot(self, revision):
+        """the kept root of revision"""
+        self.check(revision)
+        root = TREE.snapshot(revision)
+        if root is None:
+            raise InvalidRevision('revision %d is no longer kept' % revision)
+        return root
+
+    def tree(self, path, revision):
+        """the kept root itself, nothing is copied"""
+        root = self.snapshot(revision)
+        if Node.by_path(path, root=root) is None:
+            raise InvalidPath('path %s does not exist at revision %d' % (path, revision))
+        return root
+
+    def diff(self, path, old, new):
+        """compare the kept roots, subtrees shared by both are skipped"""
+        roots = [self.snapshot(x) for x in (old, new)]
+        try:
+            nodes = [Node.by_path(path, root=x) for x in roots]
+        except Exception:
+            raise InvalidPath('path %s contains a leaf' % path)
+        return diff(nodes[0], nodes[1], '/'.join(split_path(path)))
+
+    def store(self, items, base=None):
+        """nothing to store, TREE is the storage"""
+        return None
+
+    def revision(self):
+        return VERSIONS.revision
+
+    def changes(self, revision):
+        """no other process writes to TREE"""
+        return []
+
+    def search(self, search):
+        return search.walk(TREE.root)
+
+    def load(self):
+        pass
+
+
+class SqlBackend(Backend):
+    """schema.Node rows in a sqlite database
+
+    Every call is one transaction, writes are appended to the history and
+    reads as of a revision are served from it.
+    """
+    dialect = 'sqlite'
+    pickler = schema.BulkPickle
+
+    def init(self):
+        """create or upgrade the tables
+
+        Processes starting together on a new database race to create it,
+        the loser tries again at most WRITE_RETRIES times.
+        """
+        if db.engine.dialect.name != self.dialect:
+            raise Exception('backend %s needs a %s database, SQLALCHEMY_DATABASE_URI is %s' % (
+                app.config.get('CONFIGDB_BACKEND'), self.dialect, db.engine.dialect.name))
+        retries = app.config.get('WRITE_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                schema.init()
+                return
+            except sqlalchemy.exc.DatabaseError as e:
+                db.session.rollback()
+                if attempt == retries:
+                    raise
+                app.logger.warning('preparing the database failed, retrying: %s', e.orig)
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+    def get(self, path, revision=None):
+        if revision is not None:
+            self.check(revision)
+            return schema.History.unpickle_at(path, revision)
+        try:
+            node = schema.Node.fetch_by_path(path)
+            return node.unpickle() if node is not None else None
+        finally:
+            db.session.rollback()
+
+    def store(self, items, base=None):
+        """write items in one transaction
+
+        Another process writing the same paths can make the transaction
+        fail on a unique constraint, it is rolled back and repeated on the
+        rows as they are then, at most WRITE_RETRIES times. A transaction
+        finding a write newer than base is rolled back at once.
+        """
+        retries = app.config.get('WRITE_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                self.begin([x[0] for x in items], base)
+                for path, data in items:
+                    if data is None:
+                        self.remove(path)
+                    else:
+                        schema.Node.fetch_by_path(path, create=True).pickle(data, pickler=self.pickler)
+                return self.commit()
+            except sqlalchemy.exc.IntegrityError as e:
+                db.session.rollback()
+                if attempt == retries:
+                    raise
+                app.logger.warning('write conflict, retrying: %s', e.orig)
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def begin(self, paths, base):
+        """allocate the revision of the write first thing in its transaction
+
+        Inserting the revision takes the write lock of the database, so
+        revisions are numbered in the order the writes are committed.
+
+        Raises:
+            StaleTree if another write was stored after revision base
+        """
+        revision = schema.current_revision(paths)
+        if base is None:
+            return
+        query = db.session.query(sqlalchemy.func.max(schema.Revision.id))
+        last = query.filter(schema.Revision.id != revision).scalar() or 0
+        if last > base:
+            raise StaleTree('revision %d was stored by another process' % last)
+
+    def remove(self, path):
+        """delete the rows of a subtree, the root only loses its children"""
+        node = schema.Node.fetch_by_path(path)
+        if node is None:
+            return
+        if node.parent_id is None:
+            node.pickle({}, pickler=self.pickler)
+            return
+        schema.close_versions([node.path], subtree=True)
+        query = db.session.query(schema.Node).filter(schema.Node.in_subtree(node.path))
+        query.delete(synchronize_session=False)
+
+    def revision(self):
+        try:
+            return db.session.query(sqlalchemy.func.max(schema.Revision.id)).scalar() or 0
+        finally:
+            db.session.rollback()
+
+    def changes(self, revision):
+        """read from the revision table, a revision without recorded paths
+        wrote the whole tree"""
+        revisions = schema.Revision
+        with read_session() as session:
+            query = session.query(revisions.id, revisions.paths).filter(revisions.id > revision)
+            rows = query.order_by(revisions.id).all()
+        return [(x.id, json.loads(x.paths) if x.paths is not None else ['']) for x in rows]
+
+    def epoch(self):
+        """derived from the first revision, processes sharing the database
+        agree on it and a database created again starts a new one"""
+        with read_session() as session:
+            first = session.query(schema.Revision).order_by(schema.Revision.id).first()
+        if first is None:
+            return super(SqlBackend, self).epoch()
+        token = '%d %s' % (first.id, first.created.isoformat())
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()[:12]
+
+    def diff(self, path, old, new):
+        """read the versions replaced between the revisions from the history"""
+        self.check(old)
+        self.check(new)
+        return schema.History.diff(path, old, new)
+
+    def search(self, search):
+        """a single indexed query on the committed rows"""
+        node = schema.Node
+        columns = [node.path, node.nodetype] + [getattr(node, x.column) for x in schema.C_LEAVES]
+        with read_session() as session:
+            query = session.query(*columns).filter(*schema.search_clauses(search))
+            rows = query.order_by(node.path).limit(search.limit).all()
+        return [(schema.path_labels(row.path), schema.column_value(row)) for row in rows]
+
+    def commit(self):
+        """commit the running write, return its revision"""
+        revision = db.session.info.get('revision')
+        db.session.commit()
+        return revision
+
+
+class PostgresPickle(schema.BulkPickle):
+    """BulkPickle inserting with INSERT ... ON CONFLICT ... RETURNING
+
+    A level is written with one statement which also returns the ids for
+    the next level. A row another writer created at the same path in the
+    meantime is taken over instead of failing the transaction.
+    """
+    chunk = 5000
+
+    def insert_rows(self, mappings, ids):
+        table = schema.Node.__table__
+        columns = ['parent_id', 'label', 'path', 'nodetype'] + [x.column for x in schema.C_LEAVES]
+        for i in range(0, len(mappings), self.chunk):
+            part = mappings[i:i + self.chunk]
+            statement = sqlalchemy.dialects.postgresql.insert(table)
+            statement = statement.values([dict((x, mapping[x]) for x in columns) for mapping in part])
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.path],
+                set_=dict((x, statement.excluded[x]) for x in columns if x != 'path'))
+            statement = statement.returning(table.c.id, table.c.path)
+            created = dict((row.path, row.id) for row in db.session.execute(statement))
+            for mapping in part:
+                mapping['id'] = created[mapping['path']]
+
+
+class PostgresBackend(SqlBackend):
+    """schema.Node rows in a postgresql database
+
+    Subtrees are prefix matches on the materialized path, served by
+    text_pattern_ops indexes independent of the database collation.
+    Writers of all processes take turns on an advisory lock, revision ids
+    come from a sequence and would otherwise commit out of order.
+    """
+    dialect = 'postgresql'
+    pickler = PostgresPickle
+    write_lock = 0x636462  # advisory lock key of the writers
+    indexes = (
+        'CREATE INDEX IF NOT EXISTS ix_node_path_pattern ON node (path text_pattern_ops)',
+        'CREATE INDEX IF NOT EXISTS ix_history_path_pattern ON history (path text_pattern_ops, rev)',
+        'CREATE INDEX IF NOT EXISTS ix_history_until_pattern ON history (until, path text_pattern_ops, rev)',
+    )
+
+    def begin(self, paths, base):
+        db.session.execute(sqlalchemy.text('SELECT pg_advisory_xact_lock(:key)'), {'key': self.write_lock})
+        super(PostgresBackend, self).begin(paths, base)
+
+    def init(self):
+        """prepare the database, one process at a time"""
+        with db.engine.connect() as connection:
+            connection.execute(sqlalchemy.text('SELECT pg_advisory_lock(:key)'), {'key': self.write_lock})
+            try:
+                super(PostgresBackend, self).init()
+                for statement in self.indexes:
+                    db.session.execute(statement)
+                db.session.commit()
+            finally:
+                connection.execute(sqlalchemy.text('SELECT pg_advisory_unlock(:key)'), {'key': self.write_lock})
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SqlBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def create_backend(name):
+    """the initialized backend registered as name, with TREE loaded"""
+    if name not in BACKENDS:
+        raise Exception('unknown backend %s, use one of %s' % (name, ', '.join(sorted(BACKENDS))))
+    backend = BACKENDS[name]()
+    backend.init()
+    backend.load()
+    return backend
+
+
+BACKEND = create_backend(app.config.get('CONFIGDB_BACKEND', 'memory'))
@@ -0,0 +1,120 @@
+"""content addressed storage of blob leaves
+
+A blob leaf holds a Blob, a reference to a file named after the sha256 of
+the content. Neither the tree nor the database rows carry the content,
+identical blobs are stored once. Files are written to a temporary name
+and renamed when complete, so a file under its digest is always whole.
+"""
+from configdb.meta import app
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Blob(object):
+    """a leaf value stored in BLOBS
+
+    Attributes:
+        digest (str): hex sha256 of the content
+        size (int): length of the content in bytes
+    """
+    __slots__ = ('digest', 'size')
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.size = size
+
+    def __eq__(self, other):
+        return isinstance(other, Blob) and other.digest == self.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return 'Blob(%s, %d)' % (self.digest, self.size)
+
+    @property
+    def reference(self):
+        """the blob as stored in the database"""
+        return ('%s:%d' % (self.digest, self.size)).encode('ascii')
+
+    @classmethod
+    def parse(cls, reference):
+        digest, size = bytes(reference).decode('ascii').split(':')
+        return cls(digest, int(size))
+
+    def read(self):
+        """the content as bytes"""
+        return BLOBS.read(self)
+
+
+class BlobStore(object):
+    """files named by the sha256 of their content
+
+    Args:
+        directory: where the files are kept, created if missing
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.stored = 0
+        self.deduplicated = 0
+
+    def path(self, blob):
+        """file name of a blob"""
+        return os.path.join(self.directory, blob.digest[:2], blob.digest)
+
+    def put(self, data):
+        """store bytes, return the Blob"""
+        blob = Blob(hashlib.sha256(data).hexdigest(), len(data))
+        if os.path.exists(self.path(blob)):
+            self.deduplicated += 1
+            return blob
+        return self.write([data])
+
+    def write(self, chunks):
+        """store the content of an iterable of bytes, return the Blob
+
+        The content is hashed while it is written, it is never held in
+        memory as a whole.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        handle, name = tempfile.mkstemp(dir=self.directory, prefix='.incoming-')
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    output.write(chunk)
+                    size += len(chunk)
+                output.flush()
+                os.fsync(output.fileno())
+            blob = Blob(digest.hexdigest(), size)
+            target = self.path(blob)
+            if os.path.exists(target):
+                self.deduplicated += 1
+                os.unlink(name)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(name, target)
+                self.stored += 1
+            return blob
+        except BaseException:
+            if os.path.exists(name):
+                os.unlink(name)
+            raise
+
+    def read(self, blob):
+        with open(self.path(blob), 'rb') as f:
+            return f.read()
+
+    def stats(self):
+        return {'stored': self.stored, 'deduplicated': self.deduplicated}
+
+
+BLOBS = BlobStore(app.config.get('BLOB_DIR') or os.path.join(app.instance_path, 'blobs'))
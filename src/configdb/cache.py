@@ -0,0 +1,156 @@
+from configdb.meta import app
+from configdb.stream import join
+from collections import OrderedDict
+import threading
+import uuid
+
+
+def split_path(path):
+    """list of path elements, empty elements are dropped"""
+    return list(filter(None, (path or '').split('/')))
+
+
+def conflict(a, b):
+    """True if the paths given as element tuples overlap"""
+    return a[:len(b)] == b or b[:len(a)] == a
+
+
+class SubtreeVersions(object):
+    """per subtree version counters
+
+    Every write gets the next global revision. It is stored for the written
+    path and for every ancestor's subtree. The version of a path is the
+    newest revision that either wrote inside its subtree or replaced one of
+    its ancestors, so writes to siblings leave it untouched.
+
+    Attributes:
+        revision (int): the last revision handed out
+        epoch (str): token of the stored revisions, entity tags of equal
+            revisions only match within one epoch. Random for the memory
+            backend, revisions restart with every process
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revision = 0
+        self.epoch = uuid.uuid4().hex[:12]
+        self.written = {}  # path -> last revision replacing that node
+        self.subtree = {}  # path -> last revision writing in that subtree
+
+    def touch(self, *paths, revision=None):
+        """record a write to paths, return its revision
+
+        Args:
+            revision (int): the revision the backend stored the write as,
+                by default the next one
+        """
+        with self.lock:
+            if revision is None:
+                revision = self.revision + 1
+            self.revision = max(self.revision, revision)
+            for path in paths:
+                elements = split_path(path)
+                self.written['/'.join(elements)] = self.revision
+                for index in range(len(elements) + 1):
+                    self.subtree['/'.join(elements[:index])] = self.revision
+            return self.revision
+
+    def version(self, path):
+        """revision of the last write affecting path"""
+        elements = split_path(path)
+        result = self.subtree.get('/'.join(elements), 0)
+        for index in range(len(elements)):
+            result = max(result, self.written.get('/'.join(elements[:index]), 0))
+        return result
+
+    def etag(self, version, fmt):
+        """strong entity tag for a path rendered at version in format fmt"""
+        return '%s-%d-%s' % (self.epoch, version, fmt)
+
+
+class ResponseCache(object):
+    """LRU cache of serialized responses keyed by (path, format)
+
+    Every entry remembers the subtree version it was rendered at and is
+    only served while that version is current.
+
+    Args:
+        budget (int): memory budget in bytes for cached responses,
+            0 disables the cache
+        entry_limit (int): largest streamed response that is collected
+            for caching
+    """
+    def __init__(self, budget, entry_limit):
+        self.lock = threading.Lock()
+        self.budget = budget
+        self.entry_limit = min(budget, entry_limit)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, fmt, version):
+        """return the cached response or None"""
+        key = ('/'.join(split_path(path)), fmt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self.drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, path, fmt, version, data):
+        """store a response rendered at version"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if len(data) > self.budget:
+            return data
+        key = ('/'.join(split_path(path)), fmt)
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (version, data)
+            self.size += len(data)
+            while self.size > self.budget:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+        return data
+
+    def collect(self, path, fmt, version, chunks):
+        """pass a streamed response through, cache it if it is small enough"""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if parts is not None:
+                size += len(chunk)
+                if size <= self.entry_limit:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.put(path, fmt, version, join(parts))
+
+    def drop(self, key):
+        """remove an entry, the caller holds the lock"""
+        self.size -= len(self.entries.pop(key)[1])
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+VERSIONS = SubtreeVersions()
+CACHE = ResponseCache(
+    app.config.get('RESPONSE_CACHE_SIZE', 0),
+    app.config.get('RESPONSE_CACHE_ENTRY_SIZE', 0))
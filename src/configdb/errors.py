@@ -6,6 +6,11 @@ class DecodeException(Exception):
     pass
 
 
+class BodyTooLarge(Exception):
+    """a request body beyond the configured size"""
+    pass
+
+
 class InvalidPath(Exception):
     pass
 
@@ -15,6 +20,31 @@ class NotALeaf(Exception):
     pass
 
 
+class PatchConflict(Exception):
+    """a patch operation does not apply to the current document"""
+    pass
+
+
+class InheritanceCycle(Exception):
+    """a dictionary would inherit from its own result"""
+    pass
+
+
+class InvalidRevision(Exception):
+    """a revision that is not stored"""
+    pass
+
+
+class StaleTree(Exception):
+    """another process stored a write the local tree does not hold yet"""
+    pass
+
+
+class InvalidSearch(Exception):
+    """a search argument can not be parsed"""
+    pass
+
+
 class HttpException(Exception):
     def __init__(self, message, code=400, **kwargs):
         self.message = str(message)
@@ -1,55 +1,103 @@
 # from configdb.schema import Node
 from configdb.node import Node
-from configdb.errors import DecodeException, InvalidPath
-import json
-import yaml
-import re
-from configdb.propertyparser import PropertyParser
-
-pat_prop = re.compile('\s*([^#!:=]+)(?:\s*[\s=:]\s*)(.*$)')
+from configdb.errors import InvalidPath
+from configdb.blobs import Blob
+from configdb.stream import WRITERS, buffered, join
+from configdb.ingest import PARSERS, BINARY_PARSERS, decode, read
 
 
 class Formatter(object):
-    def __init__(self, path, create=False):
-        self.node = Node.by_path(path, create=create)
+    def __init__(self, path, create=False, root=None):
+        self.node = Node.by_path(path, create=create, root=root)
         if not self.node:
             raise InvalidPath("path %s does not exist" % path)
 
+    @classmethod
+    def detached(cls, data):
+        """formatter for a structure outside of the tree"""
+        result = cls.__new__(cls)
+        result.node = Node('')
+        result.node.pickle(data)
+        return result
+
+    def stream(self, fmt):
+        """generator of output chunks, None if fmt can not be streamed"""
+        if fmt not in WRITERS:
+            return None
+        return buffered(WRITERS[fmt](self.node))
+
+    @staticmethod
+    def parse(fmt, stream, limit=None):
+        """parse a binary stream into a detached node tree, chunk by chunk
+
+        Args:
+            limit (int): largest body in bytes, blobs are written to BLOBS
+                and not limited
+
+        Returns:
+            root of the tree, None if fmt can not be parsed incrementally
+        """
+        if fmt == 'blob':
+            limit = None
+        if fmt in PARSERS:
+            return PARSERS[fmt](decode(stream, limit=limit))
+        if fmt in BINARY_PARSERS:
+            return BINARY_PARSERS[fmt](read(stream, limit=limit))
+        return None
+
+    def load(self, fmt, stream):
+        """replace the node with the content of a binary stream
+
+        streamable formats are parsed chunk by chunk
+        """
+        tree = self.parse(fmt, stream)
+        if tree is not None:
+            self.node.adopt(tree)
+        else:
+            setattr(self, fmt, stream.read().decode('utf-8'))
+
     @property
     def json(self):
-        return json.dumps(self.node.unpickle(), indent=2)
+        return ''.join(WRITERS['json'](self.node))
 
     @json.setter
     def json(self, data):
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError as e:
-            raise DecodeException(e)
-        self.node.pickle(data)
+        self.node.adopt(PARSERS['json']([data]))
 
     @property
     def yaml(self):
-        return yaml.dump(self.node.unpickle())
+        return ''.join(WRITERS['yaml'](self.node))
 
     @yaml.setter
     def yaml(self, data):
-        try:
-            data = yaml.load(data)
-        except yaml.scanner.ScannerError as e:
-            raise DecodeException(e)
-        self.node.pickle(data)
+        self.node.adopt(PARSERS['yaml']([data]))
+
+    @property
+    def msgpack(self):
+        return join(list(WRITERS['msgpack'](self.node)))
+
+    @msgpack.setter
+    def msgpack(self, data):
+        self.node.adopt(BINARY_PARSERS['msgpack']([data]))
+
+    @property
+    def blob(self):
+        """content of a blob leaf, None for other nodes"""
+        if self.node.is_leave and isinstance(self.node.val, Blob):
+            return self.node.val.read()
+        return None
+
+    @blob.setter
+    def blob(self, data):
+        self.node.val = bytes(data)
 
     @property
     def prop(self):
-        p = PropertyParser(self.node.unpickle())
-        return p.dump()
+        return ''.join(WRITERS['prop'](self.node))
 
     @prop.setter
     def prop(self, data):
-        # TODO find or write a save properties parser
-        p = PropertyParser(data)
-        p.load(data)
-        self.node.pickle(p.data)
+        self.node.adopt(PARSERS['prop']([data]))
 
     @property
     def ini(self):
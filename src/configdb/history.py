@@ -0,0 +1,110 @@
+"""differences between two versions of a tree
+
+Both stores describe a version as path -> value, where a branch is
+represented by an empty dict or list. Only the entries of changed paths
+are collected, the memory tree skips subtrees it shares between the
+versions and the sql history reads the rows that were replaced between
+the two revisions, see schema.History.
+"""
+
+MISSING = object()
+
+
+def marker(node):
+    """value of a memory node, an empty container for branches"""
+    if node.is_list:
+        return []
+    if node.is_branch:
+        return {}
+    return node.val
+
+
+def join(path, label):
+    return '%s/%s' % (path, label) if path else label
+
+
+def walk(node, path, entries):
+    """add node and all its descendants to entries"""
+    entries[path] = marker(node)
+    for child in node.children:
+        walk(child, join(path, child.label), entries)
+
+
+def compare(old, new, path, before, after):
+    """add the entries of the differing parts of two memory subtrees"""
+    if old is new:
+        return
+    if old is None or new is None:
+        if old is not None:
+            walk(old, path, before)
+        if new is not None:
+            walk(new, path, after)
+        return
+    before[path] = marker(old)
+    after[path] = marker(new)
+    if not (old.children or new.children):
+        return
+    children = dict((x.label, x) for x in new.children)
+    for child in old.children:
+        compare(child, children.pop(child.label, None), join(path, child.label), before, after)
+    for label, child in children.items():
+        walk(child, join(path, label), after)
+
+
+def diff(old, new, path=''):
+    """changes between two memory nodes, either may be None
+
+    Args:
+        path (str): path of the nodes, prefixes the reported paths
+    Returns:
+        list of changes, see changes
+    """
+    before = {}
+    after = {}
+    compare(old, new, path, before, after)
+    return changes(before, after)
+
+
+def same(old, new):
+    return type(old) is type(new) and old == new
+
+
+def changes(before, after):
+    """list the differences between two versions
+
+    A branch is only reported if it is added, removed or replaced without
+    changes below it, e.g. an empty dictionary.
+
+    Args:
+        before (dict): path -> value of the older version
+        after (dict): path -> value of the newer version
+    Returns:
+        list of dicts with path, op (add, remove or replace), old and
+        new, sorted by path
+    """
+    changed = []
+    covered = set()
+    for path in set(before) | set(after):
+        old = before.get(path, MISSING)
+        new = after.get(path, MISSING)
+        if same(old, new):
+            continue
+        changed.append((path, old, new))
+        if path:
+            elements = path.split('/')
+            for index in range(len(elements)):
+                covered.add('/'.join(elements[:index]))
+    result = []
+    for path, old, new in sorted(changed):
+        if path in covered and isinstance(old, (dict, list, type(MISSING))) \
+                and isinstance(new, (dict, list, type(MISSING))):
+            continue
+        entry = {'path': path}
+        if old is MISSING:
+            entry.update(op='add', new=new)
+        elif new is MISSING:
+            entry.update(op='remove', old=old)
+        else:
+            entry.update(op='replace', old=old, new=new)
+        result.append(entry)
+    return result
@@ -0,0 +1,572 @@
+"""incremental parsers for request bodies
+
+The body is read in chunks and parsed event by event. The events are
+applied to a detached node tree right away, so the raw body, the decoded
+string and a parsed python structure are never held at the same time.
+The finished tree replaces the target node in one step, a parse error
+leaves the target untouched. The detached tree is held in memory until
+then, read() and decode() stop a body beyond its limit.
+"""
+from configdb.errors import BodyTooLarge, DecodeException
+from configdb.node import Node, NODE_LEAVES, list_index
+from configdb.blobs import BLOBS
+from configdb.propertyparser import PropertyParser
+import codecs
+import json
+import math
+import re
+import struct
+import yaml
+
+CHUNK_SIZE = 64 * 1024
+
+MAP = 'map'
+LIST = 'list'
+KEY = 'key'
+VALUE = 'value'
+END = 'end'
+ANCHOR = 'anchor'
+ALIAS = 'alias'
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DELIMITER = re.compile(r'[ \t\n\r,\]}]')
+NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+LITERALS = (
+    ('true', True),
+    ('false', False),
+    ('null', None),
+    ('NaN', math.nan),
+    ('Infinity', math.inf),
+    ('-Infinity', -math.inf),
+)
+
+
+# msgpack type byte -> value, struct format of a number, or the kind and
+# struct format of the length of str, bin, array and map
+MSGPACK_CONSTANTS = {0xc0: None, 0xc2: False, 0xc3: True}
+MSGPACK_NUMBERS = {
+    0xca: '>f', 0xcb: '>d',
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+}
+MSGPACK_SIZED = {
+    0xc4: (bytes, '>B'), 0xc5: (bytes, '>H'), 0xc6: (bytes, '>I'),
+    0xd9: (str, '>B'), 0xda: (str, '>H'), 0xdb: (str, '>I'),
+    0xdc: (LIST, '>H'), 0xdd: (LIST, '>I'),
+    0xde: (MAP, '>H'), 0xdf: (MAP, '>I'),
+}
+
+
+def read(stream, size=CHUNK_SIZE, limit=None):
+    """read a binary stream in chunks
+
+    Raises:
+        BodyTooLarge: the stream holds more than limit bytes
+    """
+    total = 0
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        total += len(data)
+        if limit is not None and total > limit:
+            raise BodyTooLarge('body larger than %d bytes' % limit)
+        yield data
+
+
+def decode(stream, size=CHUNK_SIZE, limit=None):
+    """read a binary stream in chunks and decode it as utf-8"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for data in read(stream, size, limit):
+            yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+    except UnicodeDecodeError as e:
+        raise DecodeException(e)
+
+
+def lines(chunks):
+    """split text chunks into lines"""
+    rest = ''
+    for chunk in chunks:
+        parts = (rest + chunk).split('\n')
+        rest = parts.pop()
+        for line in parts:
+            yield line
+    if rest:
+        yield rest
+
+
+class JsonParser(object):
+    """incremental json parser
+
+    Only the current token has to fit into the buffer, the document is
+    consumed chunk by chunk.
+
+    Args:
+        chunks: iterable of text chunks
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+
+    def fill(self):
+        """append the next chunk to the buffer, False at the end of input"""
+        for chunk in self.chunks:
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+            return True
+        return False
+
+    def peek(self):
+        """next non whitespace character, '' at the end of input"""
+        while True:
+            if self.pos < len(self.buffer) and self.buffer[self.pos] not in ' \t\n\r':
+                return self.buffer[self.pos]
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise DecodeException('expected one of %s, got %r' % (chars, char))
+        self.pos += 1
+        return char
+
+    def events(self):
+        for event in self.value():
+            yield event
+        if self.peek():
+            raise DecodeException('extra data after json document')
+
+    def value(self):
+        char = self.peek()
+        if char == '{':
+            self.pos += 1
+            yield MAP, None
+            if self.peek() == '}':
+                self.pos += 1
+            else:
+                while True:
+                    if self.peek() != '"':
+                        raise DecodeException('expected a property name')
+                    yield KEY, self.string()
+                    self.expect(':')
+                    for event in self.value():
+                        yield event
+                    if self.expect(',}') == '}':
+                        break
+            yield END, None
+        elif char == '[':
+            self.pos += 1
+            yield LIST, None
+            if self.peek() == ']':
+                self.pos += 1
+            else:
+                while True:
+                    for event in self.value():
+                        yield event
+                    if self.expect(',]') == ']':
+                        break
+            yield END, None
+        elif char == '"':
+            yield VALUE, self.string()
+        else:
+            yield VALUE, self.scalar()
+
+    def string(self):
+        while True:
+            try:
+                value, self.pos = json.decoder.scanstring(self.buffer, self.pos + 1)
+                return value
+            except ValueError as e:
+                if not self.fill():
+                    raise DecodeException(e)
+
+    def scalar(self):
+        # make sure the whole token is buffered
+        while not DELIMITER.search(self.buffer, self.pos) and self.fill():
+            pass
+        match = NUMBER.match(self.buffer, self.pos)
+        if match:
+            self.pos = match.end()
+            integer, fraction, exponent = match.groups()
+            if fraction or exponent:
+                return float(match.group())
+            return int(integer)
+        for name, value in LITERALS:
+            if self.buffer.startswith(name, self.pos):
+                self.pos += len(name)
+                return value
+        raise DecodeException('unexpected %r' % self.buffer[self.pos:self.pos + 20])
+
+
+class ChunkReader(object):
+    """file like object reading from text chunks, used by the yaml reader"""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+
+def yaml_events(chunks):
+    """translate the event stream of the yaml parser into tree events
+
+    Scalars are resolved and constructed with the safe loader's rules.
+    """
+    resolver = yaml.resolver.Resolver()
+    constructor = yaml.constructor.SafeConstructor()
+    stack = []  # per open container: True/False expecting a key, None in lists
+
+    def done():
+        if stack and stack[-1] is not None:
+            stack[-1] = True
+
+    try:
+        for event in yaml.parse(ChunkReader(chunks)):
+            if isinstance(event, yaml.NodeEvent) and event.anchor is not None \
+                    and not isinstance(event, yaml.AliasEvent):
+                yield ANCHOR, event.anchor
+            if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                if stack and stack[-1] is True:
+                    raise DecodeException('complex mapping keys are not supported')
+                if stack and stack[-1] is False:
+                    stack[-1] = True
+                if isinstance(event, yaml.MappingStartEvent):
+                    stack.append(True)
+                    yield MAP, None
+                else:
+                    stack.append(None)
+                    yield LIST, None
+            elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                stack.pop()
+                yield END, None
+            elif isinstance(event, yaml.AliasEvent):
+                yield ALIAS, event.anchor
+                done()
+            elif isinstance(event, yaml.ScalarEvent):
+                tag = event.tag
+                if tag is None or tag == '!':
+                    tag = resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+                construct = constructor.yaml_constructors.get(
+                    tag, yaml.constructor.SafeConstructor.construct_undefined)
+                value = construct(constructor, yaml.ScalarNode(tag, event.value, style=event.style))
+                if value is not None and not isinstance(value, NODE_LEAVES):
+                    value = str(value)
+                if stack and stack[-1] is True:
+                    stack[-1] = False
+                    yield KEY, str(value)
+                else:
+                    yield VALUE, value
+                    done()
+    except yaml.YAMLError as e:
+        raise DecodeException(e)
+
+
+class MsgpackParser(object):
+    """incremental MessagePack parser
+
+    Only the current item has to fit into the buffer. Map keys must be
+    strings or integers, extension types are not supported.
+
+    Args:
+        chunks: iterable of bytes
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.pos = 0
+
+    def take(self, size):
+        """the next size bytes"""
+        end = self.pos + size
+        if end <= len(self.buffer):
+            self.pos = end
+            return self.buffer[end - size:end]
+        parts = [self.buffer[self.pos:]]
+        length = len(parts[0])
+        while length < size:
+            chunk = next(self.chunks, b'')
+            if not chunk:
+                raise DecodeException('unexpected end of msgpack data')
+            parts.append(chunk)
+            length += len(chunk)
+        data = b''.join(parts)
+        self.buffer = data
+        self.pos = size
+        return data[:size]
+
+    def at_end(self):
+        while self.pos >= len(self.buffer):
+            chunk = next(self.chunks, b'')
+            if not chunk:
+                return True
+            self.buffer = chunk
+            self.pos = 0
+        return False
+
+    def events(self):
+        for event in self.value():
+            yield event
+        if not self.at_end():
+            raise DecodeException('extra data after msgpack document')
+
+    def value(self):
+        kind, payload = self.item()
+        if kind is VALUE:
+            yield VALUE, payload
+            return
+        yield kind, None
+        for _ in range(payload):
+            if kind is MAP:
+                label, value = self.item()
+                if label is not VALUE or isinstance(value, bool) or not isinstance(value, (str, int)):
+                    raise DecodeException('msgpack map keys must be strings')
+                yield KEY, str(value)
+            for event in self.value():
+                yield event
+        yield END, None
+
+    def item(self):
+        """MAP or LIST and the number of entries, or VALUE and the value"""
+        code = self.take(1)[0]
+        if code <= 0x7f:
+            return VALUE, code
+        if code >= 0xe0:
+            return VALUE, code - 0x100
+        if code <= 0x8f:
+            return MAP, code & 0x0f
+        if code <= 0x9f:
+            return LIST, code & 0x0f
+        if code <= 0xbf:
+            return VALUE, self.text(code & 0x1f)
+        if code in MSGPACK_CONSTANTS:
+            return VALUE, MSGPACK_CONSTANTS[code]
+        if code in MSGPACK_NUMBERS:
+            fmt = MSGPACK_NUMBERS[code]
+            return VALUE, struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+        if code in MSGPACK_SIZED:
+            kind, fmt = MSGPACK_SIZED[code]
+            size = struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+            if kind is bytes:
+                return VALUE, self.take(size)
+            if kind is str:
+                return VALUE, self.text(size)
+            return kind, size
+        raise DecodeException('unsupported msgpack type 0x%02x' % code)
+
+    def text(self, size):
+        try:
+            return self.take(size).decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise DecodeException(e)
+
+
+class TreeBuilder(object):
+    """apply tree events to a detached node tree"""
+    def __init__(self):
+        self.root = Node('')
+        self.stack = []  # (node, frame) of the open containers
+        self.label = None
+        self.anchor = None
+        self.anchors = {}
+        self.started = False
+
+    def feed(self, events):
+        """apply all events, return the root of the built tree"""
+        for kind, payload in events:
+            getattr(self, 'on_%s' % kind)(payload)
+        return self.root
+
+    def next_node(self):
+        if not self.stack:
+            if self.started:
+                raise DecodeException('more than one document')
+            self.started = True
+            node = self.root
+        else:
+            parent, frame = self.stack[-1]
+            if parent.is_list:
+                node = Node(str(frame['index']), parent=parent)
+                frame['index'] += 1
+            elif self.label in frame['seen']:
+                # duplicate key, the last one wins
+                node = parent.child(self.label)
+            else:
+                frame['seen'].add(self.label)
+                node = Node(self.label, parent=parent)
+        if self.anchor is not None:
+            self.anchors[self.anchor] = node
+            self.anchor = None
+        return node
+
+    def on_map(self, payload):
+        node = self.next_node()
+        node.pickle({})
+        self.stack.append((node, {'seen': set()}))
+
+    def on_list(self, payload):
+        node = self.next_node()
+        node.pickle([])
+        self.stack.append((node, {'index': 0}))
+
+    def on_end(self, payload):
+        self.stack.pop()
+
+    def on_key(self, label):
+        self.label = label
+
+    def on_value(self, value):
+        self.next_node().pickle(value)
+
+    def on_anchor(self, name):
+        self.anchor = name
+
+    def on_alias(self, name):
+        try:
+            data = self.anchors[name].unpickle()
+        except KeyError:
+            raise DecodeException('unknown alias %s' % name)
+        self.next_node().pickle(data)
+
+
+class PropertyBuilder(object):
+    """build a detached node tree from dotted property keys in one pass
+
+    The containers along the previous key are kept, a key sharing a
+    prefix with its predecessor only walks the part that differs. New
+    containers start as lists and become dictionaries on the first label
+    that is neither one of their indexes nor the next one, see
+    node.list_index. Only dictionaries made from a list by an index out of
+    order are looked at again, they become lists at the end if their
+    labels are indexes starting at 0.
+    """
+    def __init__(self):
+        self.root = Node('')
+        self.root.pickle([])
+        self.stack = [self.root]  # containers along the parents of the previous key
+        self.labels = []  # labels of stack[1:]
+        self.prefix = ''  # dotted parents of the previous key
+        self.unordered = []  # dictionaries made from a list by an index
+
+    def feed(self, items):
+        """set all (key, value) pairs, return the root of the built tree"""
+        for key, value in items:
+            if key.startswith(self.prefix):
+                # a sibling of the previous key, most keys in a dump
+                label = key[len(self.prefix):]
+                if '.' not in label:
+                    self.leaf(self.stack[-1], label, value)
+                    continue
+            self.set(key.split('.'), value)
+        return self.finish()
+
+    def set(self, labels, value):
+        last = len(labels) - 1
+        depth = 0
+        while depth < len(self.labels) and depth < last and self.labels[depth] == labels[depth]:
+            depth += 1
+        del self.stack[depth + 1:]
+        del self.labels[depth:]
+        for label in labels[depth:last]:
+            node = self.child(self.stack[-1], label)
+            if not node.is_list and not node.children:
+                node.pickle([])
+            self.stack.append(node)
+            self.labels.append(label)
+        self.leaf(self.stack[-1], labels[last], value)
+        self.prefix = ''.join('%s.' % x for x in self.labels)
+
+    def leaf(self, node, label, value):
+        """set the child label of the container node to value"""
+        child = node.peek(label)
+        if child is None:
+            Node(label, parent=self.container(node, label), value=value)
+        else:
+            child.pickle(value)
+
+    def child(self, node, label):
+        """the child label of the container node, created if missing"""
+        child = node.peek(label)
+        if child is None:
+            child = Node(label, parent=self.container(node, label))
+        return child
+
+    def container(self, node, label):
+        """node, a list becomes a dictionary unless label is its next index"""
+        if node.is_list and list_index(label) != len(node.children):
+            children = list(node.children)
+            node.pickle({})
+            for item in children:
+                item.parent = node
+            if list_index(label) is not None:
+                self.unordered.append(node)
+        return node
+
+    def finish(self):
+        for node in self.unordered:
+            if node.is_leave or node.is_list:
+                continue
+            items = [(list_index(x.label), x) for x in node.children]
+            if any(x[0] is None for x in items):
+                continue
+            items.sort(key=lambda x: x[0])
+            if items[0][0] != 0:
+                continue
+            node.pickle([])
+            for index, (_, child) in enumerate(items):
+                child.label = str(index)
+                child.parent = node
+        if not self.root.children:
+            self.root.pickle({})
+        return self.root
+
+
+def load_json(chunks):
+    return TreeBuilder().feed(JsonParser(chunks).events())
+
+
+def load_yaml(chunks):
+    return TreeBuilder().feed(yaml_events(chunks))
+
+
+def load_prop(chunks):
+    return PropertyBuilder().feed(PropertyParser.items(lines(chunks)))
+
+
+def load_msgpack(chunks):
+    return TreeBuilder().feed(MsgpackParser(chunks).events())
+
+
+def load_blob(chunks):
+    """a blob leaf of the raw body, written to BLOBS as it arrives"""
+    root = Node('')
+    root.val = BLOBS.write(chunks)
+    return root
+
+
+PARSERS = {
+    'json': load_json,
+    'yaml': load_yaml,
+    'prop': load_prop,
+}
+
+# parsers of binary formats, they get the undecoded chunks
+BINARY_PARSERS = {
+    'msgpack': load_msgpack,
+    'blob': load_blob,
+}
@@ -0,0 +1,436 @@
+"""inheritance between subtrees
+
+A dictionary declares the layers it inherits from in its _inherits child,
+a path or a list of paths, for example
+
+    hosts:
+      web1:
+        _inherits: [common, role/web]
+        port: 8080
+
+The effective config of web1 is common, overlaid by role/web, overlaid by
+web1 itself. Dictionaries are merged key by key, everything else is
+replaced. Layers may inherit themselves, a layer that would inherit from
+its own result is skipped. A write adding such a cycle is rejected, see
+scheduler.WriteScheduler.reject.
+
+The effective tree is materialized next to every published root and
+served like the plain tree. Nodes without inheritance at or below them
+are shared with the plain tree, the merged results are kept per declaring
+path. A write only recomputes the declaring paths it affects: those at,
+above or below a written path and, through the index of layer paths to
+their dependents, everything inheriting from them.
+
+The effective subtree at a path is versioned by the newest write to the
+plain paths it is computed from, see Inheritance.version.
+"""
+from configdb.meta import app
+from configdb.errors import InheritanceCycle
+from configdb.node import Node
+from configdb.cache import VERSIONS, conflict, split_path
+from collections import OrderedDict
+import bisect
+import threading
+
+KEY = '_inherits'
+
+
+def below(keys, elements):
+    """the entries of the sorted list keys at or below elements"""
+    size = len(elements)
+    for index in range(bisect.bisect_left(keys, elements), len(keys)):
+        if keys[index][:size] != elements:
+            break
+        yield keys[index]
+
+
+def lookup(node, elements):
+    """descendant of node without copying shared nodes, None if missing"""
+    for element in elements:
+        if node is None or not node.is_branch:
+            return None
+        node = node.peek(element)
+    return node
+
+
+def declared(node):
+    """the layers a node inherits from as element tuples, None if it
+    declares none"""
+    if node is None or not node.is_branch or node.is_list:
+        return None
+    child = node.peek(KEY)
+    if child is None:
+        return None
+    layers = child.unpickle()
+    if isinstance(layers, str):
+        layers = [layers]
+    if not isinstance(layers, list):
+        return None
+    return [tuple(split_path(x)) for x in layers if isinstance(x, str)]
+
+
+def merge(base, data):
+    """data overlaid on base, dictionaries are merged recursively"""
+    if not (isinstance(base, dict) and isinstance(data, dict)):
+        return data
+    result = dict(base)
+    for key, value in data.items():
+        result[key] = merge(result[key], value) if key in result else value
+    return result
+
+
+class Inheritance(object):
+    """the effective tree of the published roots
+
+    update is called by the writer with every new root, effective returns
+    the tree of a root. The index describes the root of the last update.
+
+    Args:
+        keep (int): number of effective trees kept, older roots are
+            computed again on request
+    """
+    def __init__(self, keep=8):
+        self.lock = threading.Lock()
+        self.keep = max(1, keep)
+        self.roots = OrderedDict()  # id of the plain root -> (plain root, effective root, skipped)
+        self.raw = None  # the root the index describes
+        self.layers = {}  # declaring path -> layer paths
+        self.dependents = {}  # layer path -> set of declaring paths
+        self.declaring = []  # sorted declaring paths
+        self.inherited = []  # sorted layer paths
+        self.skipped = {}  # declaring path -> layers skipped as cycle
+        self.created = []  # (declaring path, layer) of cycles added by the last update
+        self.merged = {}  # declaring path -> merged node
+        self.spine = {}  # ancestor of a declaring path -> (plain node, effective node)
+        self.dirty = set()
+        self.done = set()
+        self.active = set()
+        self.structures = {}
+        self.updates = 0
+        self.recomputed = 0
+        self.cycles = 0
+
+    def effective(self, raw):
+        """the effective tree of the plain root raw"""
+        with self.lock:
+            entry = self.roots.get(id(raw))
+            if entry is not None and entry[0] is raw:
+                return entry[1]
+        other = Inheritance(1)
+        root = other.update(raw, None)
+        self.remember(raw, root, other.skipped)
+        return root
+
+    def known(self, raw):
+        """the skipped layers of the plain root raw, None if it is not kept"""
+        with self.lock:
+            entry = self.roots.get(id(raw))
+            if entry is not None and entry[0] is raw:
+                return entry[2]
+        return None
+
+    def remember(self, raw, root, skipped):
+        with self.lock:
+            self.roots[id(raw)] = (raw, root, skipped)
+            while len(self.roots) > self.keep:
+                self.roots.popitem(last=False)
+
+    def update(self, raw, written, base=None):
+        """compute the effective tree of raw, return its root
+
+        Called by the writer only, one at a time. The cycles the update
+        adds to those of base are listed in created.
+
+        Args:
+            raw: the new plain root
+            written: the changed paths, None to start from scratch
+            base: the root the changes were applied to, the index is
+                rebuilt if it describes another one
+        """
+        if written is None or self.raw is None or base is not self.raw:
+            previous = self.known(base) if base is not None else None
+            with self.lock:
+                self.reset()
+                self.scan(raw, ())
+            self.skipped = {}
+            self.dirty = set(self.layers)
+        else:
+            previous = self.skipped
+            self.skipped = dict(previous)
+            written = [tuple(split_path(x)) for x in written]
+            with self.lock:
+                for elements in written:
+                    self.rescan(raw, elements)
+            self.dirty = self.affected(written)
+        self.raw = raw
+        self.done = set()
+        self.active = set()
+        self.structures = {}
+        dirty = sorted(self.dirty)
+        for elements in dirty:
+            self.resolve(elements)
+        root = self.build(raw, (), dirty)
+        self.created = []
+        if previous is not None:
+            for elements in dirty:
+                for layer in self.skipped.get(elements, ()):
+                    if layer not in previous.get(elements, ()):
+                        self.created.append((elements, layer))
+        self.dirty = set()
+        self.structures = {}
+        self.updates += 1
+        self.recomputed += len(dirty)
+        self.remember(raw, root, self.skipped)
+        return root
+
+    def reset(self):
+        self.layers = {}
+        self.dependents = {}
+        self.declaring = []
+        self.inherited = []
+        self.merged = {}
+        self.spine = {}
+
+    def declare(self, elements, layers):
+        self.layers[elements] = layers
+        bisect.insort(self.declaring, elements)
+        for layer in layers:
+            if layer not in self.dependents:
+                self.dependents[layer] = set()
+                bisect.insort(self.inherited, layer)
+            self.dependents[layer].add(elements)
+
+    def forget(self, elements):
+        for layer in self.layers.pop(elements):
+            users = self.dependents[layer]
+            users.discard(elements)
+            if not users:
+                del self.dependents[layer]
+                self.inherited.remove(layer)
+        self.declaring.remove(elements)
+        self.merged.pop(elements, None)
+        self.skipped.pop(elements, None)
+
+    def scan(self, node, elements):
+        """index the declarations of a subtree"""
+        layers = declared(node)
+        if layers is not None:
+            self.declare(elements, layers)
+        for child in node.children:
+            if child.is_branch:
+                self.scan(child, elements + (child.label,))
+
+    def rescan(self, raw, elements):
+        """index the declarations after a write to elements"""
+        for old in list(below(self.declaring, elements)):
+            self.forget(old)
+        for key in list(self.spine):
+            if key[:len(elements)] == elements:
+                del self.spine[key]
+        node = lookup(raw, elements)
+        if node is not None:
+            self.scan(node, elements)
+        # the write may have changed the declaration of an ancestor
+        for index in range(len(elements)):
+            ancestor = elements[:index]
+            layers = declared(lookup(raw, ancestor))
+            if layers != self.layers.get(ancestor):
+                if ancestor in self.layers:
+                    self.forget(ancestor)
+                if layers is not None:
+                    self.declare(ancestor, layers)
+
+    def affected(self, written):
+        """the declaring paths whose result a write to written changes"""
+        result = set()
+        queue = list(written)
+        while queue:
+            elements = queue.pop()
+            found = set()
+            for index in range(len(elements) + 1):
+                prefix = elements[:index]
+                if prefix in self.layers:
+                    found.add(prefix)
+                found.update(self.dependents.get(prefix, ()))
+            found.update(below(self.declaring, elements))
+            for layer in below(self.inherited, elements):
+                found.update(self.dependents[layer])
+            for key in found - result:
+                result.add(key)
+                queue.append(key)
+        return result
+
+    def sources(self, layer):
+        """the declaring paths the effective structure of layer is taken from"""
+        for index in range(len(layer), -1, -1):
+            if layer[:index] in self.layers:
+                return [layer[:index]]
+        return list(below(self.declaring, layer))
+
+    def requires(self, elements):
+        """the declaring paths the result of a declaring path is computed from"""
+        result = list(below(self.declaring, elements))[1:]
+        for layer in self.layers[elements]:
+            if not conflict(layer, elements):
+                result.extend(self.sources(layer))
+        return result
+
+    def cyclic(self, elements, layer):
+        """True if layer is computed from the result of elements
+
+        The answer only depends on the declarations, so the results do
+        not depend on the order they are computed in.
+        """
+        if conflict(layer, elements):
+            return True
+        seen = set()
+        stack = self.sources(layer)
+        while stack:
+            key = stack.pop()
+            if key == elements:
+                return True
+            if key not in seen:
+                seen.add(key)
+                stack.extend(self.requires(key))
+        return False
+
+    def resolve(self, elements):
+        """the merged node of a declaring path, computed if it is dirty"""
+        if elements not in self.dirty or elements in self.done:
+            return self.merged.get(elements)
+        if elements in self.active:
+            raise InheritanceCycle('inheritance cycle at %s' % '/'.join(elements))
+        self.active.add(elements)
+        try:
+            data = {}
+            skipped = []
+            for layer in self.layers[elements]:
+                if self.cyclic(elements, layer):
+                    self.cycles += 1
+                    app.logger.warning('%s can not inherit from %s, a cycle', '/'.join(elements), '/'.join(layer))
+                    skipped.append(layer)
+                    continue
+                value = self.data(layer)
+                if value is not None:
+                    data = merge(data, value)
+            data = merge(data, self.overlay(lookup(self.raw, elements), elements))
+            node = Node(elements[-1] if elements else '')
+            node._owner = None  # never written, like a published node
+            node.pickle(data)
+            self.merged[elements] = node
+            if skipped:
+                self.skipped[elements] = skipped
+            else:
+                self.skipped.pop(elements, None)
+            self.done.add(elements)
+            return node
+        finally:
+            self.active.discard(elements)
+
+    def data(self, elements):
+        """the effective structure at a path, None if it does not exist
+
+        Layers are read once per update, merge does not modify them.
+        """
+        if elements in self.structures:
+            return self.structures[elements]
+        result = self.structures[elements] = self.structure(elements)
+        return result
+
+    def structure(self, elements):
+        for index in range(len(elements), -1, -1):
+            prefix = elements[:index]
+            if prefix in self.layers:
+                node = lookup(self.resolve(prefix), elements[index:])
+                return node.unpickle() if node is not None else None
+        node = lookup(self.raw, elements)
+        return self.overlay(node, elements) if node is not None else None
+
+    def overlay(self, node, elements):
+        """structure of a plain subtree with the declaring paths below it
+        replaced by their result and the declarations removed"""
+        if not node.is_branch:
+            return node.val
+        inner = False
+        for key in below(self.declaring, elements):
+            if key != elements:
+                inner = True
+                break
+        if not inner:
+            data = node.unpickle()
+            if not node.is_list:
+                data.pop(KEY, None)
+            return data
+        result = []
+        for child in node.children:
+            path = elements + (child.label,)
+            if path in self.layers:
+                merged = self.resolve(path)
+                value = merged.unpickle() if merged is not None else {}
+            else:
+                value = self.overlay(child, path)
+            result.append((child.label, value))
+        if node.is_list:
+            return [value for _, value in result]
+        return dict((label, value) for label, value in result if label != KEY)
+
+    def build(self, node, elements, dirty):
+        """the effective node of a plain node
+
+        Subtrees without declarations are the plain nodes themselves, the
+        nodes above declaring paths are reused while neither the plain
+        node nor a result below them changed.
+        """
+        if elements in self.layers:
+            return self.merged[elements]
+        if next(below(self.declaring, elements), None) is None:
+            return node
+        previous = self.spine.get(elements)
+        if previous is not None and previous[0] is node and next(below(dirty, elements), None) is None:
+            return previous[1]
+        result = Node.__new__(Node)
+        result._label = node.label
+        result._parent = None
+        result._pathgen = -1
+        result._owner = None
+        children = [self.build(x, elements + (x.label,), dirty) for x in node.children]
+        if node.is_list:
+            result._val = children
+        else:
+            result._val = dict((x.label, x) for x in children if x.label != KEY)
+        self.spine[elements] = (node, result)
+        return result
+
+    def version(self, path):
+        """the revision of the last write changing the effective subtree
+        at path
+
+        That is the newest write to the plain subtree, or to a layer of a
+        declaring path at, above or below it, or to their layers in turn.
+        """
+        paths = set()
+        with self.lock:
+            stack = [tuple(split_path(path))]
+            while stack:
+                elements = stack.pop()
+                if elements in paths:
+                    continue
+                paths.add(elements)
+                for index in range(len(elements)):
+                    stack.extend(self.layers.get(elements[:index], ()))
+                for key in below(self.declaring, elements):
+                    stack.extend(self.layers[key])
+        return max(VERSIONS.version('/'.join(x)) for x in paths)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'declaring': len(self.layers),
+                'layers': len(self.dependents),
+                'updates': self.updates,
+                'recomputed': self.recomputed,
+                'cycles': self.cycles,
+            }
+
+
+INHERITANCE = Inheritance(app.config.get('INHERITANCE_KEEP', 8))
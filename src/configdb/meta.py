@@ -1,18 +1,100 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+import contextlib
 import os
+import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.pool
 
 app = Flask(__name__)
 app.config.from_pyfile('base.cfg')
 if 'CONFIGDB_SETTINGS' in os.environ:
     app.config.from_envvar('CONFIGDB_SETTINGS')
 
+# sqlite pragma -> config key, in the order they are set
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+)
+
+
+def in_memory(url):
+    """True for sqlite databases that only exist in one connection"""
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url, configured, pool_size):
+    """create_engine arguments for a pool of pool_size connections
+
+    sqlite defaults to a connection per checkout, file databases get a
+    real pool instead. An in memory database keeps its single connection.
+
+    Args:
+        configured (dict): SQLALCHEMY_ENGINE_OPTIONS of the configuration,
+            they take precedence
+    """
+    options = dict(configured)
+    if in_memory(url):
+        return options
+    if url.get_backend_name() == 'sqlite':
+        options.setdefault('poolclass', sqlalchemy.pool.QueuePool)
+        # pooled connections move between threads, one at a time
+        options['connect_args'] = dict(options.get('connect_args', {}))
+        options['connect_args'].setdefault('check_same_thread', False)
+    options.setdefault('pool_size', pool_size)
+    options.setdefault('max_overflow', app.config.get('DATABASE_MAX_OVERFLOW', 10))
+    options.setdefault('pool_timeout', app.config.get('DATABASE_POOL_TIMEOUT', 30))
+    return options
+
+
+def sqlite_pragmas(readonly):
+    """connect listener applying the configured pragmas"""
+    pragmas = [('foreign_keys', 'ON')]
+    for name, key in SQLITE_PRAGMAS:
+        if app.config.get(key) is not None:
+            pragmas.append((name, app.config[key]))
+    if readonly:
+        pragmas.append(('query_only', 'ON'))
+
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
+    return connect
+
+
+url = sqlalchemy.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+configured = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url, configured, app.config.get('DATABASE_POOL_SIZE', 5))
 db = SQLAlchemy(app)
 
+# reads of committed data use their own pool, in WAL mode they neither
+# wait for writers nor hold connections writers need
+if in_memory(url):
+    read_engine = db.engine
+else:
+    read_engine = sqlalchemy.create_engine(
+        db.engine.url, **engine_options(url, configured, app.config.get('DATABASE_READ_POOL_SIZE', 10)))
+if url.get_backend_name() == 'sqlite':
+    db.event.listen(db.engine, 'connect', sqlite_pragmas(False))
+    if read_engine is not db.engine:
+        db.event.listen(read_engine, 'connect', sqlite_pragmas(True))
+ReadSession = sqlalchemy.orm.sessionmaker(bind=read_engine)
+
+
+@contextlib.contextmanager
+def read_session():
+    """a session on the read only engine, closed after the block
 
-@db.event.listens_for(db.engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    print("activating foreign keys")
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+    Only sees committed data, changes of the running db.session are not
+    visible.
+    """
+    session = ReadSession()
+    try:
+        yield session
+    finally:
+        session.close()
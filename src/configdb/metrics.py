@@ -0,0 +1,265 @@
+"""per request timing and SQL instrumentation
+
+Every request gets a RequestTimer. Code wraps its phases in
+``with phase('name'):`` and the engine listeners below add each SQL
+statement to the timer of the running request. Finished requests are
+summed up in METRICS, which renders the Prometheus text format for
+/metrics, and reported to the client in a Server-Timing header.
+
+Streamed responses are produced after the view returned. Their header
+covers the phases up to the first byte, the time spent producing the body
+is recorded as the stream phase once the last chunk was sent.
+"""
+from configdb.meta import app, db, read_engine
+from collections import OrderedDict
+from flask import request
+import contextlib
+import threading
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CURRENT = threading.local()
+
+
+class RequestTimer(object):
+    """phase durations and SQL statements of one request"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = OrderedDict()  # name -> seconds
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def merge(self, other):
+        """add the phases and statements of other, work done for several
+        requests at once is charged to each of them"""
+        for name, seconds in other.phases.items():
+            self.add(name, seconds)
+        self.statements += other.statements
+        self.sql_seconds += other.sql_seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds"""
+        result = ['%s;dur=%.3f' % (name, seconds * 1000) for name, seconds in self.phases.items()]
+        result.append('sql;desc="%d statements";dur=%.3f' % (self.statements, self.sql_seconds * 1000))
+        result.append('total;dur=%.3f' % (self.elapsed() * 1000))
+        return ', '.join(result)
+
+
+def current():
+    """timer of the running request, None outside of requests"""
+    return getattr(CURRENT, 'timer', None)
+
+
+@contextlib.contextmanager
+def charged(timer):
+    """record the phases and statements of the block on timer
+
+    Lets a thread work on behalf of another request, e.g. the leader of a
+    group commit running the operations of the other writers.
+    """
+    previous = current()
+    CURRENT.timer = timer
+    try:
+        yield
+    finally:
+        CURRENT.timer = previous
+
+
+@contextlib.contextmanager
+def phase(name):
+    """add the time spent in the block to the phase name of the request"""
+    timer = current()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**kwargs):
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in sorted(kwargs.items()))
+
+
+class Metrics(object):
+    """process wide request counters
+
+    Args:
+        buckets (tuple): upper bounds in seconds of the request duration
+            histogram
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.requests = {}  # (method, endpoint, status) -> count
+        self.durations = {}  # (method, endpoint) -> [bucket counts..., sum, count]
+        self.phases = {}  # name -> [seconds, count]
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.slow = 0
+
+    def observe(self, timer, method, endpoint, status, slow=False):
+        """add a finished request"""
+        elapsed = timer.elapsed()
+        with self.lock:
+            key = (method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.get((method, endpoint))
+            if histogram is None:
+                histogram = self.durations[(method, endpoint)] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    histogram[index] += 1
+            histogram[-2] += elapsed
+            histogram[-1] += 1
+            for name, seconds in timer.phases.items():
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[0] += seconds
+                entry[1] += 1
+            self.statements += timer.statements
+            self.sql_seconds += timer.sql_seconds
+            self.slow += slow
+
+    def render(self, **sections):
+        """Prometheus text format
+
+        Args:
+            sections: name -> dict of numbers, exported as untyped
+                configdb_<name>_<key> samples
+        """
+        lines = []
+
+        def metric(name, kind, text):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        with self.lock:
+            metric('configdb_requests_total', 'counter', 'finished requests')
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append('configdb_requests_total%s %d' % (
+                    labels(method=method, endpoint=endpoint, status=status), count))
+            metric('configdb_request_duration_seconds', 'histogram', 'request duration including streaming')
+            for (method, endpoint), histogram in sorted(self.durations.items()):
+                for index, bound in enumerate(self.buckets):
+                    lines.append('configdb_request_duration_seconds_bucket%s %d' % (
+                        labels(method=method, endpoint=endpoint, le=bound), histogram[index]))
+                lines.append('configdb_request_duration_seconds_bucket%s %d' % (
+                    labels(method=method, endpoint=endpoint, le='+Inf'), histogram[-1]))
+                lines.append('configdb_request_duration_seconds_sum%s %f' % (
+                    labels(method=method, endpoint=endpoint), histogram[-2]))
+                lines.append('configdb_request_duration_seconds_count%s %d' % (
+                    labels(method=method, endpoint=endpoint), histogram[-1]))
+            metric('configdb_phase_seconds_total', 'counter', 'time spent per request phase')
+            for name, (seconds, count) in sorted(self.phases.items()):
+                lines.append('configdb_phase_seconds_total%s %f' % (labels(phase=name), seconds))
+            metric('configdb_phase_total', 'counter', 'requests that went through a phase')
+            for name, (seconds, count) in sorted(self.phases.items()):
+                lines.append('configdb_phase_total%s %d' % (labels(phase=name), count))
+            metric('configdb_sql_statements_total', 'counter', 'SQL statements executed by requests')
+            lines.append('configdb_sql_statements_total %d' % self.statements)
+            metric('configdb_sql_seconds_total', 'counter', 'time spent executing SQL in requests')
+            lines.append('configdb_sql_seconds_total %f' % self.sql_seconds)
+            metric('configdb_slow_requests_total', 'counter', 'requests above SLOW_REQUEST_SECONDS')
+            lines.append('configdb_slow_requests_total %d' % self.slow)
+        for section, values in sorted(sections.items()):
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = 'configdb_%s_%s' % (section, key)
+                metric(name, 'untyped', '%s %s' % (section, key))
+                lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def finish(timer, method, endpoint, status, path):
+    """account a finished request, log it if it was slow"""
+    limit = app.config.get('SLOW_REQUEST_SECONDS')
+    elapsed = timer.elapsed()
+    slow = limit is not None and elapsed >= limit
+    if slow:
+        app.logger.warning(
+            'slow request %s %s: %.3fs, %d statements in %.3fs, %s', method, path,
+            elapsed, timer.statements, timer.sql_seconds,
+            ' '.join('%s=%.3fs' % x for x in timer.phases.items()) or 'no phases')
+    METRICS.observe(timer, method, endpoint, status, slow)
+
+
+def streamed(timer, chunks, *args):
+    """pass a response body through, timing it as the stream phase"""
+    CURRENT.timer = timer
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        timer.add('stream', time.perf_counter() - start)
+        CURRENT.timer = None
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        finish(timer, *args)
+
+
+@app.before_request
+def start_timer():
+    CURRENT.timer = RequestTimer()
+
+
+@app.after_request
+def report_timer(response):
+    timer = current()
+    if timer is None:
+        return response
+    if app.config.get('SERVER_TIMING', True):
+        response.headers['Server-Timing'] = timer.header()
+    args = (request.method, request.endpoint or 'none', response.status_code, request.full_path.rstrip('?'))
+    if response.is_streamed:
+        response.response = streamed(timer, response.response, *args)
+    else:
+        finish(timer, *args)
+    return response
+
+
+@app.teardown_request
+def clear_timer(exc):
+    CURRENT.timer = None
+
+
+def sql_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('configdb_sql_start', []).append(time.perf_counter())
+
+
+def sql_end(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['configdb_sql_start'].pop()
+    timer = current()
+    if timer is not None:
+        timer.statements += 1
+        timer.sql_seconds += time.perf_counter() - start
+
+
+def sql_error(context):
+    # after_cursor_execute is skipped for failed statements
+    stack = context.connection.info.get('configdb_sql_start') if context.connection else None
+    if stack:
+        stack.pop()
+
+
+for engine in set((db.engine, read_engine)):
+    db.event.listen(engine, 'before_cursor_execute', sql_start)
+    db.event.listen(engine, 'after_cursor_execute', sql_end)
+    db.event.listen(engine, 'handle_error', sql_error)
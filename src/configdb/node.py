@@ -1,19 +1,95 @@
-from configdb.errors import NotALeaf
+from configdb.meta import app
+from configdb.errors import InvalidPath, NotALeaf
+from configdb.blobs import Blob, BLOBS
+from collections import OrderedDict
+import bisect
+import contextlib
+import threading
 
-NODE_LEAVES = (bool, int, float, str)
+NODE_LEAVES = (bool, int, float, str, bytes, Blob)
 NODE_BRANCHES = (dict, list)
 
 
+def list_index(label):
+    """the list index named by label, None if label is not one"""
+    if label.isdigit() and (label == '0' or label[0] != '0'):
+        return int(label)
+    return None
+
+
+class Generation(object):
+    """a counter bumped on every change of one kind"""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def bump(self):
+        self.value += 1
+
+
+class WriteOwner(threading.local):
+    """number of the write transaction running in this thread, None while
+    the thread does not write
+
+    Nodes created by other threads, for example while a request parses
+    its body next to a running write, belong to no transaction.
+    """
+    value = None
+
+
+# existing nodes changed their chain of parents or labels
+MOVES = Generation()
+WRITING = WriteOwner()
+
+
+class PathIndex(object):
+    """resolved paths of the current tree
+
+    Published roots never change, so the entries stay valid until another
+    root is published. They are kept together with their root and dropped
+    when a lookup for a newer root comes in.
+    """
+    max_entries = 65536
+
+    def __init__(self):
+        self.entries = (None, {})  # root, path as requested -> node
+
+    def get(self, path, root):
+        entries = self.entries
+        if entries[0] is not root:
+            return None
+        return entries[1].get(path)
+
+    def put(self, path, node, root):
+        entries = self.entries
+        if entries[0] is not root or len(entries[1]) >= self.max_entries:
+            entries = self.entries = (root, {})
+        entries[1][path] = node
+
+
 class Node(object):
     """A Configuration entry. Can be a leaf or a branch.
 
-    leaves store basic values. These are boolean int, float, str
+    leaves store basic values. These are boolean int, float, str and
+    blobs. Assigned bytes are stored in BLOBS, the leaf keeps the Blob.
     branches can store dictionaries or lists.
 
     A leave value is accessed via tha val property.
 
     On assigning a basic value to a branch node, all children are lost.
 
+    Dictionary children are indexed by label, list children are kept in
+    a list and labelled with their index, so lookups by label are O(1)
+    for both. The path of a node is cached until a node above it moves.
+
+    Nodes are copied on write, see Tree. A node belongs to the write
+    transaction that created it and is only modified by that one; child()
+    in a transaction returns a private copy of a shared child. Unchanged
+    subtrees are shared between versions, their parent references point
+    to the version that created them, so path and xpath are only exact
+    for nodes of a running write or of a tree built without one.
+
     Attributes:
         label: name of the node
         parent: reference to the parent node or None
@@ -23,17 +99,20 @@ class Node(object):
             assigning stores a value and cleans up children.
 
     """
+    __slots__ = ('_label', '_parent', '_val', '_path', '_pathgen', '_owner')
+
     def __init__(self, label, parent=None, value=None):
-        self._val = {}
+        self._label = label
         self._parent = None
-        self.label = label
-        self.parent = parent
+        self._val = {}
+        self._pathgen = -1
+        self._owner = WRITING.value
         self.val = value
-        self.children = []
+        self.parent = parent
 
     @property
     def is_leave(self):
-        return isinstance(self._val, NODE_LEAVES)
+        return not isinstance(self._val, NODE_BRANCHES)
 
     @property
     def is_branch(self):
@@ -43,6 +122,18 @@ class Node(object):
     def is_list(self):
         return isinstance(self._val, list)
 
+    @property
+    def children(self):
+        """the child nodes in order, read only
+
+        dictionaries keep the insertion order, lists the index order
+        """
+        if isinstance(self._val, dict):
+            return self._val.values()
+        if isinstance(self._val, list):
+            return self._val
+        return ()
+
     @property
     def val(self):
         if self.is_leave:
@@ -52,49 +143,166 @@ class Node(object):
 
     @val.setter
     def val(self, data):
-        self.children = []
+        self.drop_children()
         if data is None:
             self._val = {}
             return
+        if isinstance(data, bytes):
+            data = BLOBS.put(data)
         if isinstance(data, NODE_LEAVES):
             self._val = data
         else:
             raise NotALeaf()
 
+    @property
+    def label(self):
+        return self._label
+
+    @label.setter
+    def label(self, data):
+        if data == self._label:
+            return
+        MOVES.bump()
+        parent = self._parent
+        if parent is None:
+            self._label = data
+            return
+        self.parent = None
+        self._label = data
+        self.parent = parent
+
     @property
     def parent(self):
         return self._parent
 
     @parent.setter
     def parent(self, data):
-        if self._parent and self in self._parent.children:
-            # remove from old parent
-            self._parent.children.remove(self)
+        if self._parent is not None or self.children:
+            MOVES.bump()
+        if self._parent is not None:
+            self._parent.detach(self)
         if data is not None:
-            # add to new parent
-            data.children.append(self)
+            data.attach(self)
         self._parent = data
 
+    def attach(self, child):
+        """add child to the index of self
+
+        In a dictionary a child with the same label is replaced. In a list
+        the child is inserted at the index given by its label, the
+        following children move up. A label past the end appends.
+        """
+        if isinstance(self._val, dict):
+            other = self._val.get(child._label)
+            if other is not None and other is not child and other._owner == self._owner:
+                other._parent = None
+            self._val[child._label] = child
+        elif isinstance(self._val, list):
+            index = list_index(child._label)
+            if index is None or index >= len(self._val):
+                child._label = str(len(self._val))
+                self._val.append(child)
+                return
+            self._val.insert(index, child)
+            self.relabel(index + 1)
+        else:
+            raise NotALeaf()
+
+    def detach(self, child):
+        """remove child from the index of self, following list entries move down"""
+        if isinstance(self._val, dict):
+            if self._val.get(child._label) is child:
+                del self._val[child._label]
+        elif isinstance(self._val, list):
+            index = list_index(child._label)
+            if index is not None and index < len(self._val) and self._val[index] is child:
+                del self._val[index]
+                self.relabel(index)
+
+    def relabel(self, start):
+        """fix the labels of the list children from index start"""
+        children = self._val
+        if start < len(children):
+            MOVES.bump()
+        for index in range(start, len(children)):
+            if children[index]._owner != self._owner:
+                children[index] = children[index].copy(self)
+            children[index]._label = str(index)
+
+    def drop_children(self):
+        """detach all children"""
+        if not self.children:
+            return
+        MOVES.bump()
+        for child in self.children:
+            if child._owner == self._owner:
+                child._parent = None
+        self._val = {}
+
+    def copy(self, parent):
+        """a copy of self for the running write, sharing the children
+
+        Args:
+            parent: the parent of the copy
+        """
+        result = Node.__new__(Node)
+        result._label = self._label
+        result._parent = parent
+        result._pathgen = -1
+        result._owner = WRITING.value
+        if isinstance(self._val, dict):
+            result._val = dict(self._val)
+        elif isinstance(self._val, list):
+            result._val = list(self._val)
+        else:
+            result._val = self._val
+        return result
+
+    def adopt(self, other):
+        """take over value and children of the detached node other
+
+        other keeps its value, a write applied again after a conflict,
+        see scheduler.WriteScheduler.commit, adopts it once more.
+        """
+        MOVES.bump()
+        self._val = other._val
+        for child in self.children:
+            child._parent = self
+
     def pickle(self, data):
         """recursively store given data structure starting with self
 
         Args:
             data: data structure { "key": "value", "nested: { "key": "value" } }
         """
-        try:
-            self.val = data
-            return
-        except NotALeaf:
-            pass
-        if isinstance(data, list):
-            self._val = []  # remember type
-            data = zip(range(len(data)), data)
         if isinstance(data, dict):
-            self._val = {}  # remember type
-            data = data.items()
-        for index, value in data:
-            n = Node(str(index), parent=self)
-            n.pickle(value)
+            self.drop_children()
+            children = {}
+            for label, value in data.items():
+                child = Node.__new__(Node)
+                child._label = str(label)
+                child._parent = self
+                child._val = {}
+                child._pathgen = -1
+                child._owner = self._owner
+                child.pickle(value)
+                children[child._label] = child
+            self._val = children
+        elif isinstance(data, (list, tuple)):
+            self.drop_children()
+            children = []
+            for index, value in enumerate(data):
+                child = Node.__new__(Node)
+                child._label = str(index)
+                child._parent = self
+                child._val = {}
+                child._pathgen = -1
+                child._owner = self._owner
+                child.pickle(value)
+                children.append(child)
+            self._val = children
+        else:
+            self.val = data
 
     def unpickle(self, limit=None):
         """recursively retrieve data from self
@@ -104,55 +312,103 @@ class Node(object):
         Returns:
             data structure, { "key": "value", "nested: { "key": "value" } }
         """
-        try:
-            return self.val
-        except NotALeaf:
-            pass
-        result = {}
-        for child in self.children:
-            result[child.label] = child.unpickle()
-        if self.is_list:
-            result = [result[i] for i in sorted(result)]
-        return result
+        data = self._val
+        if isinstance(data, dict):
+            return dict((label, child.unpickle()) for label, child in data.items())
+        if isinstance(data, list):
+            return [child.unpickle() for child in data]
+        return data
+
+    def peek(self, label):
+        """return child by label for reading, shared children are not copied"""
+        if isinstance(self._val, dict):
+            return self._val.get(label)
+        if isinstance(self._val, list):
+            index = list_index(label)
+            if index is not None and index < len(self._val):
+                return self._val[index]
+        return None
 
     def child(self, label, create=False):
         """return child by label
 
+        In a write transaction a child shared with the published tree is
+        replaced by a private copy first.
+
         Args:
-            create (bool): autocreate child
+            create (bool): autocreate child, in a list only the next
+                index can be created
         """
-        for child in self.children:
-            if child.label == label:
-                return child
-        if create:
-            child = Node(label, parent=self)
+        if isinstance(self._val, dict):
+            child = self._val.get(label)
+            if child is None:
+                return Node(label, parent=self) if create else None
+            if child._owner != self._owner and self._owner == WRITING.value is not None:
+                child = self._val[label] = child.copy(self)
             return child
+        if isinstance(self._val, list):
+            index = list_index(label)
+            if index is not None and index < len(self._val):
+                child = self._val[index]
+                if child._owner != self._owner and self._owner == WRITING.value is not None:
+                    child = self._val[index] = child.copy(self)
+                return child
+            if create and index == len(self._val):
+                return Node(label, parent=self)
         return None
 
     @classmethod
-    def by_path(cls, path, create=False):
+    def by_path(cls, path, create=False, root=None):
         """retrieve Node by path
 
+        Lookups in the current tree are remembered in PATHS, a repeated
+        lookup is a single dictionary access.
+
         Args:
             path (str): slash seperated path to node
             create (bool): automaticly create any missing node
+            root: tree to search, the current TREE.root by default
+
+        Raises:
+            InvalidPath: an element of path is a leaf
         """
-        parent = ROOT
+        if root is None:
+            root = TREE.root
         if not path:
-            return parent
-        for element in filter(None, path.split('/')):
-            if not parent.is_branch:
-                raise Exception("path %s contains leaf element %s" % (path, parent.label))
-            node = parent.child(element, create=create)
+            return root
+        cached = root is TREE.root
+        if cached:
+            node = PATHS.get(path, root)
+            if node is not None:
+                return node
+        node = root
+        for element in path.split('/'):
+            if not element:
+                continue
+            if not node.is_branch:
+                raise InvalidPath("path %s contains leaf element %s" % (path, node.label))
+            node = node.child(element, create=create)
             if not node:
                 return None
-            parent = node
-        return parent
+        if cached:
+            PATHS.put(path, node, root)
+        return node
 
     @property
     def path(self):
-        """the node path as a string"""
-        return '/'.join(filter(None, map(lambda x: x.label, self.xpath)))
+        """the node path as a string, cached until a node above self moves"""
+        if self._pathgen == MOVES.value:
+            return self._path
+        generation = MOVES.value
+        parent = self._parent
+        base = parent.path if parent is not None else ''
+        if base and self._label:
+            path = base + '/' + self._label
+        else:
+            path = base or self._label
+        self._path = path
+        self._pathgen = generation
+        return path
 
     @property
     def xpath(self):
@@ -166,4 +422,105 @@ class Node(object):
         return result
 
 
-ROOT = Node('')
+class Transaction(object):
+    """a write on a private copy of the tree, see Tree.write
+
+    Attributes:
+        base: the published root the transaction started from
+        root: the root to modify
+    """
+    def __init__(self, tree, root):
+        self.tree = tree
+        self.base = root
+        self.root = root.copy(None)
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        """undo the changes of the block if it raises
+
+        The block writes with an owner of its own, nodes changed earlier in
+        the transaction are copied like the ones of the published tree.
+        """
+        root = self.root
+        self.tree.transactions += 1
+        WRITING.value = self.tree.transactions
+        self.root = root.copy(None)
+        try:
+            yield
+        except BaseException:
+            self.root = root
+            raise
+
+    def commit(self, publish, *paths):
+        """make root the current tree, then announce the write
+
+        Readers see the new tree before the announcement, so nothing
+        rendered from the old tree is cached under the new revision.
+
+        Args:
+            publish: called with paths, returns the revision of the write
+        Returns:
+            the revision
+        """
+        # nodes of a published tree are read only, even for this writer
+        WRITING.value = None
+        self.tree.root = self.root
+        revision = publish(*paths)
+        self.tree.keep(revision, self.root)
+        return revision
+
+
+class Tree(object):
+    """the versioned in-memory tree
+
+    Published trees are never modified. Readers take root once and use it
+    for the whole request without locking, writers build the next version
+    from copies of the nodes they change and publish it by replacing root.
+    The roots of the last history revisions stay readable with snapshot.
+
+    Args:
+        history (int): number of revisions to keep, at least the
+            current one is kept
+    """
+    def __init__(self, history):
+        self.lock = threading.Lock()  # serializes writers
+        self.history_lock = threading.Lock()
+        self.root = Node('')
+        self.history = history
+        self.snapshots = OrderedDict([(0, self.root)])  # revision -> root
+        self.transactions = 0
+
+    @contextlib.contextmanager
+    def write(self):
+        """a Transaction on a copy of the current root
+
+        Writers run one at a time. Without a commit the changes are
+        dropped.
+        """
+        with self.lock:
+            self.transactions += 1
+            WRITING.value = self.transactions
+            try:
+                yield Transaction(self, self.root)
+            finally:
+                WRITING.value = None
+
+    def keep(self, revision, root):
+        """remember root as the tree of revision"""
+        with self.history_lock:
+            self.snapshots[revision] = root
+            while len(self.snapshots) > max(1, self.history):
+                self.snapshots.popitem(last=False)
+
+    def snapshot(self, revision):
+        """the root as of revision, None if that revision is not kept"""
+        with self.history_lock:
+            revisions = list(self.snapshots)
+            index = bisect.bisect_right(revisions, revision) - 1
+            if index < 0:
+                return None
+            return self.snapshots[revisions[index]]
+
+
+TREE = Tree(app.config.get('SNAPSHOT_HISTORY', 100))
+PATHS = PathIndex()
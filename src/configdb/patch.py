@@ -0,0 +1,213 @@
+from configdb.errors import DecodeException, PatchConflict
+from configdb.node import Node
+
+
+def addressable(node):
+    """node or its closest ancestor a path can name
+
+    A path reads a label containing a slash as nested labels, the written
+    path of a node below such a label is the one of its parent.
+    """
+    for ancestor in node.xpath:
+        if '/' in ancestor.label:
+            return ancestor.parent
+    return node
+
+
+def without_nulls(value):
+    """value with the null members of its objects removed"""
+    if isinstance(value, dict):
+        return dict((k, without_nulls(v)) for k, v in value.items() if v is not None)
+    if isinstance(value, list):
+        return [without_nulls(x) for x in value]
+    return value
+
+
+def merge_patch(node, patch):
+    """apply a JSON merge patch (RFC 7386) to node
+
+    Only the members named in the patch are touched. A null member removes
+    the member, also in objects that do not exist yet or are values of
+    arrays.
+
+    Returns:
+        list of paths of the written nodes
+    """
+    if not isinstance(patch, dict):
+        node.pickle(without_nulls(patch))
+        return [addressable(node).path]
+    touched = []
+    if not node.is_branch or node.is_list:
+        node.pickle({})
+        touched.append(addressable(node).path)
+    for label, value in patch.items():
+        child = node.child(label)
+        if value is None:
+            if child is not None:
+                touched.append(addressable(child).path)
+                child.parent = None
+        elif isinstance(value, dict):
+            if child is None:
+                # a new empty object, the patch is merged into it
+                child = node.child(label, create=True)
+                touched.append(addressable(child).path)
+            touched.extend(merge_patch(child, value))
+        else:
+            child = node.child(label, create=True)
+            child.pickle(without_nulls(value))
+            touched.append(addressable(child).path)
+    return touched
+
+
+class JsonPatch(object):
+    """apply a JSON patch (RFC 6902) to a node
+
+    The operations are applied in order. Every node is backed up before its
+    first modification, if an operation fails all backups are restored so
+    the patch is applied completely or not at all.
+
+    Args:
+        node: the target document
+    """
+    def __init__(self, node):
+        self.node = node
+        self.touched = []
+        self.backups = []
+
+    def apply(self, operations):
+        """apply the list of operations, return the touched paths"""
+        if not isinstance(operations, list):
+            raise DecodeException('a json patch must be a list of operations')
+        try:
+            for operation in operations:
+                try:
+                    op = operation['op']
+                    method = getattr(self, 'op_%s' % op)
+                    method(operation)
+                except (KeyError, TypeError, AttributeError) as e:
+                    raise DecodeException('invalid operation %s: %s' % (operation, e))
+        except Exception:
+            self.rollback()
+            raise
+        return self.touched
+
+    @staticmethod
+    def pointer(value):
+        """split a json pointer into unescaped labels"""
+        if value == '':
+            return []
+        if not value.startswith('/'):
+            raise DecodeException('invalid json pointer %s' % value)
+        return [x.replace('~1', '/').replace('~0', '~') for x in value[1:].split('/')]
+
+    def resolve(self, labels):
+        node = self.node
+        for label in labels:
+            if not node.is_branch:
+                node = None
+            else:
+                node = node.child(label)
+            if node is None:
+                raise PatchConflict('path /%s does not exist' % '/'.join(labels))
+        return node
+
+    def backup(self, node, created=False):
+        """remember the state of node before its first modification
+
+        Args:
+            created (bool): node did not exist before, rolling back removes it
+        """
+        known = addressable(node)
+        if known is not node:
+            node, created = known, False
+        path = node.path
+        for known, parent, label, data in self.backups:
+            if path == known or not known or path.startswith(known + '/'):
+                break
+        else:
+            data = None if created else node.unpickle()
+            self.backups.append((path, node.parent, node.label, data))
+        if path not in self.touched:
+            self.touched.append(path)
+
+    def rollback(self):
+        for path, parent, label, data in reversed(self.backups):
+            if parent is None:
+                self.node.pickle(data)
+            elif data is None:
+                parent.child(label).parent = None
+            else:
+                parent.child(label, create=True).pickle(data)
+
+    def index(self, node, label, append=False):
+        """list index for label, '-' means the end of the list"""
+        size = len(node.children)
+        if append and label == '-':
+            return size
+        try:
+            index = int(label)
+        except ValueError:
+            raise PatchConflict('invalid list index %s' % label)
+        if index < 0 or index > size or (index == size and not append):
+            raise PatchConflict('list index %s out of range' % label)
+        return index
+
+    def add(self, labels, value):
+        if not labels:
+            self.backup(self.node)
+            self.node.pickle(value)
+            return
+        parent = self.resolve(labels[:-1])
+        if parent.is_list:
+            index = self.index(parent, labels[-1], append=True)
+            self.backup(parent)
+            # inserting moves the following elements up
+            Node(str(index), parent=parent).pickle(value)
+        elif parent.is_branch:
+            child = parent.child(labels[-1])
+            if child is None:
+                child = parent.child(labels[-1], create=True)
+                self.backup(child, created=True)
+            else:
+                self.backup(child)
+            child.pickle(value)
+        else:
+            raise PatchConflict('/%s is not a container' % '/'.join(labels[:-1]))
+
+    def remove(self, labels):
+        if not labels:
+            raise PatchConflict('the document root can not be removed')
+        node = self.resolve(labels)
+        parent = node.parent
+        self.backup(parent if parent.is_list else node)
+        # in a list the following elements move down
+        node.parent = None
+
+    def op_add(self, operation):
+        self.add(self.pointer(operation['path']), operation['value'])
+
+    def op_remove(self, operation):
+        self.remove(self.pointer(operation['path']))
+
+    def op_replace(self, operation):
+        node = self.resolve(self.pointer(operation['path']))
+        self.backup(node)
+        node.pickle(operation['value'])
+
+    def op_move(self, operation):
+        source = self.pointer(operation['from'])
+        target = self.pointer(operation['path'])
+        if target[:len(source)] == source and target != source:
+            raise PatchConflict('can not move a node into its own subtree')
+        value = self.resolve(source).unpickle()
+        self.remove(source)
+        self.add(target, value)
+
+    def op_copy(self, operation):
+        value = self.resolve(self.pointer(operation['from'])).unpickle()
+        self.add(self.pointer(operation['path']), value)
+
+    def op_test(self, operation):
+        node = self.resolve(self.pointer(operation['path']))
+        if node.unpickle() != operation['value']:
+            raise PatchConflict('test failed for %s' % operation['path'])
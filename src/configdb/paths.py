@@ -0,0 +1,53 @@
+"""materialized paths of the database rows
+
+A materialized path holds the escaped labels from the root to a node,
+each followed by a slash, the root is '/'. Sorted materialized paths list
+a subtree in one contiguous range, before the next sibling.
+"""
+import re
+
+
+def escape_label(label):
+    """label as element of a materialized path, without slashes
+
+    % and / are written as %25 and %2F, so labels holding a slash do not
+    collide with nested labels.
+    """
+    return label.replace('%', '%25').replace('/', '%2F')
+
+
+def unescape_label(element):
+    """the label of an element escaped by escape_label"""
+    return re.sub('%(25|2F)', lambda x: chr(int(x.group(1), 16)), element)
+
+
+def make_path(elements):
+    """materialized path for a list of labels, the root is '/'
+
+    Every path ends with a slash, so all descendants of a node share its
+    path as prefix and a subtree is one contiguous range of the index.
+    Labels are escaped, see escape_label.
+    """
+    return '/' + ''.join('%s/' % escape_label(x) for x in elements)
+
+
+def child_path(path, label):
+    """materialized path of the child label of path"""
+    return '%s%s/' % (path, escape_label(label))
+
+
+def parent_path(path):
+    """materialized path of the parent, None for the root"""
+    if path == '/':
+        return None
+    return path[:path.rstrip('/').rfind('/') + 1]
+
+
+def path_labels(path):
+    """labels of a materialized path, '/a/b%2Fc/' as ['a', 'b/c']"""
+    return [unescape_label(x) for x in path.split('/') if x]
+
+
+def plain_path(path):
+    """'/a/b/' as 'a/b'"""
+    return '/'.join(path_labels(path))
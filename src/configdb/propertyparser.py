@@ -1,53 +1,106 @@
 import re
 
-pat_prop = re.compile('\s*([^#!:=]+)(?:\s*[\s=:]\s*)(.+$)')
+# key: escaped or plain characters up to whitespace, ':' or '='
+# separator: optional whitespace, at most one ':' or '=', optional whitespace
+pat_prop = re.compile(r'([^\\\s:=]*(?:\\.[^\\\s:=]*)*)[ \t\f]*[:=]?[ \t\f]*(.*)$', re.S)
+pat_plain = re.compile(r'([^\s:=]*)[ \t\f]*[:=]?[ \t\f]*(.*)$', re.S)
+pat_escape = re.compile(r'\\(u[0-9a-fA-F]{4}|.?)', re.S)
+pat_trailing = re.compile(r'\\*$')
+
+ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'f': '\f'}
+TRUE = frozenset(('T', 't', 'Y', 'y', 'True', 'true', 'Yes', 'yes'))
+FALSE = frozenset(('F', 'f', 'N', 'n', 'False', 'false', 'No', 'no'))
+
+
+def unescape(text):
+    """resolve java properties escapes, \\uXXXX included"""
+    if '\\' not in text:
+        return text
+
+    def replace(m):
+        code = m.group(1)
+        if len(code) == 5:
+            return chr(int(code[1:], 16))
+        return ESCAPES.get(code, code)
+    return pat_escape.sub(replace, text)
+
+
+def escape(text, key=False):
+    """escape text for a properties file"""
+    text = text.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+    text = text.replace('\t', '\\t').replace('\f', '\\f')
+    if key:
+        text = text.replace(' ', '\\ ').replace(':', '\\:').replace('=', '\\=')
+        if text[:1] in ('#', '!'):
+            text = '\\' + text
+    return text
 
 
 class PropertyParser(object):
+    """java properties reader and writer
+
+    Dotted keys are stored as nested dictionaries. A container whose keys
+    are list indexes including 0 becomes a list, see
+    ingest.PropertyBuilder.
+    """
     def __init__(self, data=None):
         self.data = data
 
     def load(self, data):
-        """load data from string"""
-        self.data = None
-        # TODO find or write a save properties parser
-        self.data = {}
-        # replace escaped newlines
-        data = data.replace('\\\n', ' ')
-        for line in data.split('\n'):
-            line = line.strip()
-            m = pat_prop.match(line)
-            if m:
-                key, val = map(lambda x: x.strip(), m.groups())
-                val = self.cast(val)
-                node = self.data
-                for element in key.split('.')[:-1]:
-                    try:
-                        assert(isinstance(node[element], dict))
-                    except (KeyError, AssertionError):
-                        node[element] = {}
-                    node = node[element]
-                node[key.split('.')[-1]] = val
-        # recreate lists
-        self.data = self._makelist(self.data)
+        """load data from string, through the builder of PUT bodies"""
+        from configdb.ingest import load_prop
+        self.data = load_prop([data]).unpickle()
 
     @classmethod
-    def _makelist(cls, node):
-        """recursively convert nodes to arrays.
-
-        a node is considered an array if it is a dictionary, contains the key '0'
-        and all keys are numeric"""
-        if isinstance(node, dict) and '0' in node.keys():
-            try:
-                tmp = map(lambda x: (int(x[0]), x[1]), node.items())
-                return [cls._makelist(x[1]) for x in sorted(tmp)]
-            except ValueError:
-                pass
-        if isinstance(node, list):
-            return map(cls._makelist, node)
-        if isinstance(node, dict):
-            return dict(map(lambda x: (x[0], cls._makelist(x[1])), node.items()))
-        return node
+    def items(cls, lines):
+        """parse (key, value) pairs from an iterable of lines
+
+        Follows the java properties rules: '#' and '!' start comments, a
+        line ending with an odd number of backslashes continues on the next
+        line with its leading whitespace removed, keys end at an unescaped
+        whitespace, ':' or '=' and escapes are resolved in keys and values.
+        Values are typecast with cast.
+        """
+        cast = cls.cast
+        logical = None
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if logical is None:
+                line = line.lstrip(' \t\f')
+                if not line or line[0] in '#!':
+                    continue
+                logical = line
+            else:
+                logical += line.lstrip(' \t\f')
+            if '\\' in logical:
+                if logical[-1] == '\\' and len(pat_trailing.search(logical).group()) % 2:
+                    logical = logical[:-1]
+                    continue
+                item = cls.split(logical)
+                logical = None
+                if item:
+                    yield item
+                continue
+            # inlined split for the common line without escapes
+            key, value = pat_plain.match(logical).groups()
+            logical = None
+            if key:
+                yield key, cast(value)
+        if logical is not None:
+            item = cls.split(logical)
+            if item:
+                yield item
+
+    @classmethod
+    def split(cls, line):
+        """split a logical line into key and typecast value"""
+        if '\\' not in line:
+            key, value = pat_plain.match(line).groups()
+            return (key, cls.cast(value)) if key else None
+        key, value = pat_prop.match(line).groups()
+        if not key:
+            return None
+        return unescape(key), cls.cast(unescape(value))
 
     def dump(self):
         """dump data as properties"""
@@ -63,23 +116,32 @@ class PropertyParser(object):
             elif isinstance(data, (list, set)):
                 for index in range(len(data)):
                     visit(pjoin(prefix, str(index)), data[index])
-            elif isinstance(data, (bool)):
-                result.append('%s = %s' % (prefix, 'true' if data else 'false'))
-            elif isinstance(data, (int, float)):
-                result.append('%s = %s' % (prefix, data))
             else:
-                result.append('%s = "%s"' % (prefix, data))
+                result.append(self.format_line(prefix, data))
 
         visit('', self.data)
         return '\n'.join(result)
 
+    @classmethod
+    def format_line(cls, key, value):
+        """format a single key value line"""
+        key = escape(key, key=True)
+        if isinstance(value, (bool)):
+            return '%s = %s' % (key, 'true' if value else 'false')
+        if isinstance(value, (int, float)):
+            return '%s = %s' % (key, value)
+        return '%s = "%s"' % (key, escape(value))
+
     @classmethod
     def cast(cls, value):
         """try to typecase a value"""
         value = value.strip()
-        if value in ('T', 't', 'Y', 'y', 'True', 'true', 'Yes', 'yes'):
+        if value[:1] in ('\'', '"'):
+            # quoted strings never parse as numbers
+            return value[1:-1] if value[0] == value[-1] else value
+        if value in TRUE:
             return True
-        if value in ('F', 'f', 'N', 'n', 'False', 'false', 'No', 'no'):
+        if value in FALSE:
             return False
         try:
             return int(value)
@@ -89,10 +151,4 @@ class PropertyParser(object):
             return float(value)
         except ValueError:
             pass
-        # remove leading and tailing quotes for strings
-        try:
-            if value[0] in ('\'', '"') and value[0] == value[-1]:
-                return value[1:-1]
-        except IndexError:
-            pass
         return value
@@ -0,0 +1,109 @@
+from configdb.meta import app
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import socket
+import threading
+import time
+
+
+class HostResolver(object):
+    """reverse DNS lookups with caching
+
+    Successful lookups are cached for ttl seconds, failures for
+    negative_ttl seconds. Concurrent lookups of the same address share one
+    query. Lookups run on a small thread pool so a slow resolver blocks a
+    request for at most timeout seconds; a lookup that times out keeps
+    running and fills the cache for the next request.
+
+    Args:
+        ttl (float): seconds to cache a resolved name
+        negative_ttl (float): seconds to cache a failed lookup
+        timeout (float): seconds to wait for a lookup
+        hosts_file (str): optional file with "address name" lines, these
+            names override DNS
+        workers (int): number of concurrent lookups
+    """
+    max_entries = 65536
+
+    def __init__(self, ttl, negative_ttl, timeout, hosts_file=None, workers=4):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.static = self.load(hosts_file) if hosts_file else {}
+        self.cache = {}  # address -> (expires, name or None)
+        self.pending = {}  # address -> Future
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.counters = dict.fromkeys(
+            ('static', 'hits', 'misses', 'failures', 'timeouts', 'lookups'), 0)
+        self.lookup_seconds = 0.0
+
+    @staticmethod
+    def load(filename):
+        """read a hosts(5) like file, the first name of a line is used"""
+        result = {}
+        with open(filename) as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) >= 2:
+                    result[fields[0]] = fields[1]
+        return result
+
+    def resolve(self, address):
+        """return the host name for address, None if it does not resolve"""
+        with self.lock:
+            if address in self.static:
+                self.counters['static'] += 1
+                return self.static[address]
+            entry = self.cache.get(address)
+            if entry is not None and entry[0] > time.time():
+                self.counters['hits'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+            future = self.pending.get(address)
+            if future is None:
+                future = self.executor.submit(self.lookup, address)
+                self.pending[address] = future
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self.lock:
+                self.counters['timeouts'] += 1
+            return None
+
+    def lookup(self, address):
+        """query DNS and cache the result"""
+        start = time.time()
+        try:
+            name = socket.gethostbyaddr(address)[0]
+            ttl = self.ttl
+        except (socket.herror, socket.gaierror, OSError):
+            name = None
+            ttl = self.negative_ttl
+        now = time.time()
+        with self.lock:
+            if name is None:
+                self.counters['failures'] += 1
+            self.counters['lookups'] += 1
+            self.lookup_seconds += now - start
+            if len(self.cache) >= self.max_entries:
+                self.cache = dict(x for x in self.cache.items() if x[1][0] > now)
+            self.cache[address] = (now + ttl, name)
+            del self.pending[address]
+        return name
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+            result['lookup_seconds'] = self.lookup_seconds
+            result['entries'] = len(self.cache)
+        requests = result['hits'] + result['misses']
+        result['hit_rate'] = float(result['hits']) / requests if requests else 0.0
+        return result
+
+
+RESOLVER = HostResolver(
+    app.config.get('RESOLVER_TTL', 300),
+    app.config.get('RESOLVER_NEGATIVE_TTL', 30),
+    app.config.get('RESOLVER_TIMEOUT', 2.0),
+    app.config.get('RESOLVER_HOSTS_FILE'),
+)
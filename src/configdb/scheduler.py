@@ -0,0 +1,376 @@
+"""write scheduling
+
+Writes are submitted as operations on the root of a write transaction.
+The request holds a lock on its path from the submit until its write is
+published: writes to disjoint subtrees run side by side, a write to an
+ancestor or descendant of a pending path waits for it, so overlapping
+writes are applied in the order they arrived and never share a batch.
+
+Queued writes are applied in group commits. One of the waiting requests
+leads: it applies all queued operations to one tree transaction, stores
+the changed paths in the backend in one database transaction and
+publishes a single revision. Writes arriving meanwhile queue up for the
+next batch. Once its own write is done the leader hands over to the
+oldest waiting request. The effective tree of the batch, see inherit, is
+computed before anything is stored.
+
+Other processes sharing the database are caught up with by the leader,
+see WriteScheduler.sync: when a batch finds a newer stored revision, and
+every SYNC_INTERVAL seconds when a request finds one.
+"""
+from configdb.meta import app
+from configdb.node import TREE, Node
+from configdb.cache import VERSIONS, conflict, split_path
+from configdb.errors import InheritanceCycle, StaleTree
+from configdb.backend import BACKEND, publish, apply
+from configdb.inherit import INHERITANCE
+from configdb.metrics import RequestTimer, charged, current, phase
+from collections import deque
+import contextlib
+import functools
+import threading
+import time
+
+
+class PathLocks(object):
+    """hierarchical locks on paths
+
+    A path conflicts with itself, its ancestors and its descendants.
+    Locks on disjoint subtrees are held at the same time, conflicting
+    requests are granted in arrival order.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.entries = []  # element tuples of held and waiting locks, oldest first
+
+    @contextlib.contextmanager
+    def lock(self, path):
+        entry = (tuple(split_path(path)),)  # unique even for equal paths
+        with self.condition:
+            self.entries.append(entry)
+            while self.blocked(entry):
+                self.condition.wait()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.entries.remove(entry)
+                self.condition.notify_all()
+
+    def blocked(self, entry):
+        for other in self.entries:
+            if other is entry:
+                return False
+            if conflict(other[0], entry[0]):
+                return True
+        return False
+
+    def stats(self):
+        with self.condition:
+            return {'locks': len(self.entries)}
+
+
+class Rejected(Exception):
+    """writes of a batch failed a check, it is applied again without them"""
+    pass
+
+
+class Write(object):
+    """a queued write
+
+    Attributes:
+        operation: called with the root of the write transaction, returns
+            the list of written paths
+        revision: revision of the published write, None if it changed
+            nothing
+        error: exception of the operation or of its batch
+        rejected (bool): the write failed a check of its batch and is left
+            out when the batch is applied again
+        timer: RequestTimer of the submitting request, the operation and
+            the work shared by its batch are recorded on it
+    """
+    def __init__(self, operation):
+        self.operation = operation
+        self.timer = current()
+        self.event = threading.Event()
+        self.leader = False
+        self.done = False
+        self.revision = None
+        self.error = None
+        self.rejected = False
+
+
+class WriteScheduler(object):
+    """group commit of queued writes
+
+    Args:
+        batch_size (int): most writes applied in one transaction
+        delay (float): seconds a leader waits for more writes before it
+            commits a batch
+        interval (float): seconds between two checks for writes of other
+            processes, None only checks when storing
+        retries (int): times a batch is applied again after another
+            process stored a write first
+    """
+    def __init__(self, batch_size, delay, interval=None, retries=3):
+        self.batch_size = max(1, batch_size)
+        self.delay = delay
+        self.interval = interval
+        self.retries = retries
+        self.checked = 0.0
+        self.behind = False
+        self.locks = PathLocks()
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.leading = False
+        self.writes = 0
+        self.batches = 0
+        self.largest = 0
+
+    def submit(self, path, operation):
+        """apply operation with the next batch and wait until it is published
+
+        Args:
+            path: the operation only writes at or below path
+            operation: called with the root of the write transaction,
+                returns the list of written paths
+        Returns:
+            the revision, None if nothing was written
+        Raises:
+            the exception raised by operation or while storing its batch
+        """
+        write = Write(operation)
+        with self.locks.lock(path):
+            self.wait(write)
+        if write.error is not None:
+            raise write.error
+        return write.revision
+
+    def wait(self, write):
+        """queue write and wait until its batch is done"""
+        with self.lock:
+            self.pending.append(write)
+            if not self.leading:
+                self.leading = write.leader = True
+        while not write.done:
+            if write.leader:
+                self.lead(write)
+            else:
+                write.event.wait()
+                write.event.clear()
+
+    def refresh(self):
+        """catch up with the writes of other processes
+
+        The stored revision is checked at most every interval seconds, if
+        it is newer an empty write makes the next batch apply the missing
+        writes, see sync.
+        """
+        if not BACKEND.durable or self.interval is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked < self.interval:
+                return
+            self.checked = now
+        with phase('sync'):
+            if BACKEND.revision() <= VERSIONS.revision:
+                return
+        self.behind = True
+        self.wait(Write(lambda root: []))
+
+    def lead(self, write):
+        """commit batches until write is done, then hand over"""
+        while not write.done:
+            if self.delay:
+                time.sleep(self.delay)
+            with self.lock:
+                count = min(len(self.pending), self.batch_size)
+                batch = [self.pending.popleft() for _ in range(count)]
+            self.commit(batch)
+        with self.lock:
+            if self.pending:
+                successor = self.pending[0]
+                successor.leader = True
+                successor.event.set()
+            else:
+                self.leading = False
+
+    def commit(self, batch):
+        """apply, store and publish a batch, then wake its writers
+
+        A batch another process stored a write before is applied again on
+        top of it, at most retries times. The phases of the batch are
+        charged to every request in it.
+        """
+        shared = RequestTimer()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    self.apply(batch, shared)
+                    break
+                except Rejected:
+                    continue
+                except StaleTree as e:
+                    if attempt == self.retries:
+                        raise
+                    attempt += 1
+                    app.logger.info('%s, applying %d writes again', e, len(batch))
+                    self.behind = True
+        except Exception as e:
+            app.logger.exception('storing a batch of %d writes failed', len(batch))
+            for write in batch:
+                if write.error is None:
+                    write.error = e
+        with self.lock:
+            self.writes += len(batch)
+            self.batches += 1
+            self.largest = max(self.largest, len(batch))
+        for write in batch:
+            if write.timer is not None:
+                write.timer.merge(shared)
+            write.done = True
+            write.event.set()
+
+    def apply(self, batch, shared):
+        """run the operations of batch on one transaction, store and
+        publish it
+
+        Every operation runs charged to the timer of its request, the
+        rest of the batch to shared.
+
+        Raises:
+            StaleTree if another process stored a write first, nothing is
+            published then
+            Rejected if writes of the batch were rejected, see reject
+        """
+        with TREE.write() as transaction:
+            base, paths = VERSIONS.revision, []
+            if self.behind:
+                with charged(shared):
+                    base, paths = self.sync(transaction)
+            written = []
+            for write in batch:
+                if write.rejected:
+                    continue
+                write.error = None
+                try:
+                    with charged(write.timer), transaction.savepoint():
+                        touched = write.operation(transaction.root)
+                except Exception as e:
+                    write.error = e
+                    continue
+                written.append((write, touched))
+            local = [x for _, touched in written for x in touched]
+            paths.extend(local)
+            if paths:
+                with charged(shared):
+                    with phase('inherit'):
+                        INHERITANCE.update(transaction.root, paths, base=transaction.base)
+                    self.reject(written, INHERITANCE.created)
+                    stored = self.store(transaction, local, base) if local else base
+                    revision = transaction.commit(functools.partial(publish, revision=stored), *paths)
+                for write, touched in written:
+                    if touched:
+                        write.revision = revision
+            self.behind = False
+
+    def reject(self, written, cycles):
+        """fail the writes adding an inheritance cycle
+
+        A write at or around the declaring path of a new cycle declared
+        it, its error is InheritanceCycle.
+
+        Args:
+            written: list of (write, touched paths)
+            cycles: list of (declaring path, layer) as element tuples
+        Raises:
+            Rejected if a write was rejected
+        """
+        rejected = False
+        for write, touched in written:
+            touched = [tuple(split_path(x)) for x in touched]
+            for elements, layer in cycles:
+                if any(conflict(x, elements) for x in touched):
+                    write.error = InheritanceCycle('inheritance cycle, %s can not inherit from %s' % (
+                        '/'.join(elements), '/'.join(layer)))
+                    write.rejected = rejected = True
+                    break
+        if rejected:
+            raise Rejected()
+
+    def sync(self, transaction):
+        """apply the writes other processes stored after the published
+        revision to transaction
+
+        The paths of the missing revisions are read as they are now, until
+        no write was stored meanwhile. The tree then is the one of the
+        last stored revision.
+
+        Returns:
+            tuple (revision, paths), the last stored revision and the
+            paths written since the published one
+        """
+        revision, paths = VERSIONS.revision, []
+        with phase('sync'):
+            changes = BACKEND.changes(revision)
+            while changes:
+                revision = changes[-1][0]
+                written = set(tuple(split_path(x)) for _, stored in changes for x in stored)
+                items = []
+                for elements in sorted(written):
+                    if items and conflict(items[-1], elements):
+                        continue
+                    items.append(elements)
+                apply(transaction.root, [('/'.join(x), BACKEND.get('/'.join(x))) for x in items])
+                paths.extend('/'.join(x) for x in items)
+                changes = BACKEND.changes(revision)
+        return revision, paths
+
+    def store(self, transaction, paths, base):
+        """store the written paths in the backend, in one transaction
+
+        A path below another written path is stored with it.
+
+        Args:
+            base (int): the stored revision transaction is based on
+        Returns:
+            the revision the backend stored the batch as, None for the
+            memory backend
+        Raises:
+            StaleTree if another process stored a write after base
+        """
+        if not BACKEND.durable:
+            return None
+        items = []
+        for elements in sorted(tuple(split_path(x)) for x in paths):
+            if items and conflict(items[-1][0], elements):
+                continue
+            node = Node.by_path('/'.join(elements), root=transaction.root)
+            items.append((elements, node.unpickle() if node is not None else None))
+        with phase('store'):
+            return BACKEND.store([('/'.join(x), data) for x, data in items], base=base)
+
+    def stats(self):
+        with self.lock:
+            result = {
+                'writes': self.writes,
+                'batches': self.batches,
+                'largest_batch': self.largest,
+                'queued': len(self.pending),
+            }
+        result.update(self.locks.stats())
+        return result
+
+
+SCHEDULER = WriteScheduler(
+    app.config.get('WRITE_BATCH_SIZE', 256),
+    app.config.get('WRITE_BATCH_DELAY', 0),
+    app.config.get('SYNC_INTERVAL', 1.0),
+    app.config.get('WRITE_RETRIES', 3))
+
+
+@app.before_request
+def refresh():
+    SCHEDULER.refresh()
@@ -1,10 +1,18 @@
 import sqlalchemy
-from configdb.meta import db
+from configdb.meta import app, db, read_session
 from collections import namedtuple
 from configdb.errors import NotALeaf
+from configdb.history import changes
+from configdb.blobs import Blob, BLOBS
+from configdb.search import leaf_type
+from configdb.paths import make_path, child_path, parent_path, path_labels, plain_path
+import datetime
+import json
+import re
 
 
 DbType = namedtuple('DbType', ('id', 'column', 'types'))
+PickleStats = namedtuple('PickleStats', ('inserted', 'updated', 'deleted', 'unchanged'))
 
 C_DICT = DbType(0, None, (dict, ))
 C_LIST = DbType(1, None, (list, tuple,))
@@ -12,10 +20,71 @@ C_BOOL = DbType(2, 'boolval', (bool, ))
 C_INT = DbType(3, 'intval', (int, ))
 C_FLOAT = DbType(4, 'floatval', (float, ))
 C_STRING = DbType(5, 'stringval', (str, ))
-C_BLOB = DbType(6, 'blobval', (type(None), ))
+C_BLOB = DbType(6, 'blobval', (Blob, bytes, type(None)))
 
 C_LEAVES = (C_BOOL, C_INT, C_FLOAT, C_STRING, C_BLOB)
 C_BRANCHES = (C_DICT, C_LIST)
+# value column by nodetype, for leaves only
+C_COLUMNS = dict((leaf.id, leaf.column) for leaf in C_LEAVES)
+
+
+def column_value(row):
+    """leaf value of a row, blob columns hold the reference of a Blob"""
+    value = getattr(row, C_COLUMNS[row.nodetype])
+    if row.nodetype == C_BLOB.id and value is not None:
+        return Blob.parse(value)
+    return value
+
+
+# a blob column holding a Blob.reference, anything else is raw content
+BLOB_REFERENCE = re.compile(br'^[0-9a-f]{64}:[0-9]+$')
+
+
+def column_data(data):
+    """column content of a leaf value, bytes are moved to BLOBS"""
+    if isinstance(data, bytes):
+        data = BLOBS.put(data)
+    if isinstance(data, Blob):
+        return data.reference
+    return data
+
+
+def path_range(path):
+    """lower and upper bound covering path and all its descendants"""
+    return path, path[:-1] + chr(ord('/') + 1)
+
+
+def in_subtree(column, path):
+    """filter clause matching path and all its descendants
+
+    A range on the path index. postgresql compares with the collation of
+    the database, there a prefix LIKE uses the text_pattern_ops index the
+    postgresql backend creates.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return column.startswith(path, autoescape=True)
+    lower, upper = path_range(path)
+    return sqlalchemy.and_(column >= lower, column < upper)
+
+
+def has_prefix(column, path):
+    """filter clause matching path and all its descendants without a
+    range on column, for queries served by an index on another column"""
+    return sqlalchemy.func.substr(column, 1, len(path)) == path
+
+
+def label_clause(column, glob):
+    """filter clause for a label glob, see search.glob_pattern
+
+    Labels without wildcards are compared for equality. sqlite matches
+    with GLOB, postgresql with LIKE, both case sensitive.
+    """
+    if '*' not in glob and '?' not in glob:
+        return column == glob
+    if db.engine.dialect.name == 'sqlite':
+        return column.op('GLOB')(glob.replace('[', '[[]'))
+    pattern = glob.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.like(pattern.replace('*', '%').replace('?', '_'), escape='\\')
 
 
 class Node(db.Model):
@@ -27,6 +96,8 @@ class Node(db.Model):
         backref=db.backref('parent', remote_side=[id]),
         cascade="all, delete-orphan, delete",
     )
+    # materialized path, maintained by repath
+    path = db.Column(db.String, index=True, unique=True)
     nodetype = db.Column(db.Integer)
     # store all variants in columns
     # alternative would be polymorphic node
@@ -37,19 +108,40 @@ class Node(db.Model):
     blobval = db.Column(db.LargeBinary)
     __table_args__ = (
         db.UniqueConstraint('parent_id', 'label', name='_parent_label_uc'),
+        # value searches, see search_clauses
+        db.Index('ix_node_type_string', 'nodetype', 'stringval'),
+        db.Index('ix_node_type_int', 'nodetype', 'intval'),
+        db.Index('ix_node_type_float', 'nodetype', 'floatval'),
     )
 
     def __init__(self, label, parent=None):
         self.label = label
         self.parent = parent
-        self.nodetype = 'dict'
+        self.nodetype = C_DICT.id
+
+    def repath(self, parent, label):
+        """recalculate the materialized path for a new parent or label
+
+        Descendants of a persistent node are moved with a single UPDATE
+        after the next flush, see update_descendant_paths.
+        """
+        old = self.path
+        if parent is None:
+            # only a new node becomes the root, a detached one has no path
+            self.path = make_path([]) if label == 'root' and self.id is None else None
+        elif parent.path is None:
+            self.path = None
+        else:
+            self.path = child_path(parent.path, label)
+        if old and self.id is not None and old != self.path:
+            moved = db.session.info.setdefault('moved_paths', [])
+            moved.append((old, self.path))
 
     @property
     def val(self):
         """get node value as leaf"""
-        for leaf in C_LEAVES:
-            if self.nodetype == leaf.id:
-                return getattr(self, leaf.column)
+        if self.nodetype in C_COLUMNS:
+            return column_value(self)
         raise NotALeaf()
 
     @val.setter
@@ -68,50 +160,80 @@ class Node(db.Model):
                 query.delete(synchronize_session='fetch')
                 # remember type and store value
                 self.nodetype = leaf.id
-                setattr(self, leaf.column, data)
+                setattr(self, leaf.column, column_data(data))
                 return
         raise NotALeaf()
 
-    def pickle(self, data):
-        """recursively retrieve node data"""
-        try:
-            self.val = data
-            return
-        except NotALeaf:
-            pass
-        # not a leaf, a list or tuple?
-        if isinstance(data, C_LIST.types):
-            # make it a numbered dictionary
-            self.nodetype = C_LIST.id
-            data = dict(zip(range(len(data)), data))
-        if isinstance(data, C_DICT.types):
-            # wipe any child not being updated
-            query = db.session.query(Node)
-            query = query.filter(Node.parent == self)
-            if data.keys():
-                query = query.filter(sqlalchemy.not_(Node.label.in_(data.keys())))
-            query.delete(synchronize_session='fetch')
-            # store children
-            for k, v in data.items():
-                # fetch or create child and set it's value
-                self.child(k, create=True).pickle(v)
-            return
-        raise Exception('unable to store type %s (%s)' % (type(data), data))
+    def pickle(self, data, pickler=None):
+        """store a structure below self, replacing the existing subtree
+
+        The existing subtree is loaded once and diffed against data, the
+        difference is written with bulk statements in the current
+        transaction. The caller commits.
+
+        Args:
+            pickler: BulkPickle or a subclass writing the difference
+        Returns:
+            PickleStats with the number of inserted, updated, deleted
+            and unchanged rows
+        """
+        db.session.flush()
+        rows = self.subtree_rows()
+        engine = (pickler or BulkPickle)(rows)
+        top = [row for row in rows if row.id == self.id][0]
+        engine.store(top, data)
+        stats = engine.execute()
+        db.session.expire_all()
+        return stats
 
     def unpickle(self):
-        """set node value recursively from a structure"""
+        """retrieve node data recursively as a structure.
+
+        The whole subtree is loaded with a single query, see subtree_rows.
+        """
         try:
             return self.val
         except NotALeaf:
             pass
-        # structure
-        result = {}
-        for child in self.children:
-            result[child.label] = child.unpickle()
-        if self.nodetype == C_LIST.id:
-            # flatten lists
-            result = [result[i] for i in sorted(result)]
-        return result
+        rows = self.subtree_rows()
+        children = {}
+        for row in rows:
+            children.setdefault(row.parent_id, []).append(row)
+        top = [row for row in rows if row.id == self.id][0]
+        return self.assemble(top, children)
+
+    def subtree_rows(self):
+        """fetch self and all descendants with one range scan on path
+
+        Returns:
+            list of rows with the columns id, parent_id, label, path,
+            nodetype and all value columns. No Node objects are created.
+        """
+        columns = [Node.id, Node.parent_id, Node.label, Node.path, Node.nodetype]
+        columns.extend(getattr(Node, leaf.column) for leaf in C_LEAVES)
+        query = db.session.query(*columns)
+        return query.filter(Node.in_subtree(self.path)).all()
+
+    @classmethod
+    def in_subtree(cls, path):
+        """filter clause matching path and all its descendants"""
+        return in_subtree(cls.path, path)
+
+    @classmethod
+    def assemble(cls, row, children):
+        """build the structure below row from preloaded rows
+
+        Args:
+            row: row as returned by subtree_rows
+            children (dict): parent_id -> list of child rows
+        """
+        if row.nodetype in C_COLUMNS:
+            return column_value(row)
+        rows = children.get(row.id, [])
+        if row.nodetype == C_LIST.id:
+            rows = sorted(rows, key=lambda x: int(x.label))
+            return [cls.assemble(x, children) for x in rows]
+        return dict((x.label, cls.assemble(x, children)) for x in rows)
 
     def child(self, label, create=False):
         """fetch or chreate child by name"""
@@ -132,19 +254,28 @@ class Node(db.Model):
 
     @classmethod
     def fetch_by_path(cls, path, create=False):
-        parent = cls.root()
-        if not path:
-            return parent
-        for element in filter(None, path.split('/')):
-            if parent.nodetype not in map(lambda x: x.id, C_BRANCHES):
-                raise Exception("path %s contains leaf element %s" % (path, parent.label))
-            node = cls.query.filter_by(label=element, parent=parent).first()
-            if not node:
-                if create:
-                    node = Node(element, parent=parent)
-                    db.session.add(node)
-                else:
-                    return None
+        """fetch a node with a single indexed lookup on path
+
+        Args:
+            path (str): slash seperated path to node
+            create (bool): create any missing node, all existing
+                ancestors are loaded with one query
+        """
+        elements = list(filter(None, (path or '').split('/')))
+        result = cls.query.filter_by(path=make_path(elements)).first()
+        if result or not create:
+            return result
+        prefixes = [make_path(elements[:i]) for i in range(len(elements) + 1)]
+        existing = cls.query.filter(cls.path.in_(prefixes))
+        existing = dict((node.path, node) for node in existing)
+        parent = None
+        for index, prefix in enumerate(prefixes):
+            node = existing.get(prefix)
+            if node is None:
+                node = Node(elements[index - 1], parent=parent)
+                db.session.add(node)
+            elif node.nodetype not in [x.id for x in C_BRANCHES]:
+                raise Exception("path %s contains leaf element %s" % (path, node.label))
             parent = node
         return parent
 
@@ -163,10 +294,577 @@ class Node(db.Model):
         return '<Node %s: %s>' % (self.id, self.label)
 
 
-db.create_all()
-# create root Node
-root = Node.query.filter_by(label='root', parent_id=None).first()
-if not root:
-    root = Node('root')
-    db.session.add(root)
+class Revision(db.Model):
+    """a write transaction, numbered in the order of their first change
+
+    paths holds the written paths as json list, other processes read them
+    to update their tree. NULL for revisions written before it was added,
+    they stand for the whole tree.
+    """
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    created = db.Column(db.DateTime, nullable=False)
+    paths = db.Column(db.Text, nullable=True)
+
+
+# search type names -> DbType
+SEARCH_TYPES = {
+    'bool': C_BOOL,
+    'int': C_INT,
+    'float': C_FLOAT,
+    'str': C_STRING,
+    'blob': C_BLOB,
+}
+
+
+def search_clauses(search):
+    """filter clauses on Node for a search.Search
+
+    Value filters are (nodetype, value column) pairs, each served by one
+    of the ix_node_type indexes.
+    """
+    clauses = []
+    types = [SEARCH_TYPES[x] for x in sorted(search.types)]
+    if search.candidates is not None:
+        clauses.append(sqlalchemy.or_(sqlalchemy.false(), *[sqlalchemy.and_(
+            Node.nodetype == SEARCH_TYPES[leaf_type(x)].id,
+            getattr(Node, SEARCH_TYPES[leaf_type(x)].column) == x) for x in search.candidates]))
+    if search.low is not None or search.high is not None:
+        ranges = []
+        for leaf in types:
+            column = getattr(Node, leaf.column)
+            bounds = [Node.nodetype == leaf.id]
+            if search.low is not None:
+                bounds.append(column >= search.low)
+            if search.high is not None:
+                bounds.append(column <= search.high)
+            ranges.append(sqlalchemy.and_(*bounds))
+        clauses.append(sqlalchemy.or_(sqlalchemy.false(), *ranges))
+    if search.candidates is None and search.low is None and search.high is None:
+        clauses.append(Node.nodetype.in_([x.id for x in types]))
+        if C_BLOB in types:
+            # None is stored as a blob without content
+            clauses.append(sqlalchemy.or_(Node.nodetype != C_BLOB.id, Node.blobval.isnot(None)))
+    if search.label is not None:
+        clauses.append(label_clause(Node.label, search.label))
+    if search.elements:
+        clauses.append(Node.in_subtree(make_path(search.elements)))
+    if search.after is not None:
+        clauses.append(Node.path > search.after)
+    return clauses
+
+
+class History(db.Model):
+    """append only log of node versions
+
+    Every change of a node adds a row with the new type and value, valid
+    from revision rev on. The row it replaces ends at that revision, its
+    until is set, so the old value of a change is the row of the same path
+    ending at the revision of the change. Rows without until describe the
+    current tree. Moving a node copies the rows of its subtree.
+
+    A subtree as of a revision is read in two index ranges: the current
+    rows of the subtree on (until, path) and the rows replaced since the
+    revision on until. The changes between two revisions are the rows
+    replaced between them on until and the rows added between them on
+    rev. No query walks every version of a path, and none replays the
+    revisions in between. The subtree is only a filter on the ranges of
+    until and rev, see has_prefix.
+    """
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    parent = db.Column(db.String)
+    label = db.Column(db.String)
+    rev = db.Column(db.Integer, db.ForeignKey('revision.id'), nullable=False)
+    until = db.Column(db.Integer)
+    nodetype = db.Column(db.Integer)
+    boolval = db.Column(db.Boolean)
+    intval = db.Column(db.Integer)
+    floatval = db.Column(db.Float)
+    stringval = db.Column(db.String)
+    blobval = db.Column(db.LargeBinary)
+    __table_args__ = (
+        db.Index('ix_history_path_rev', 'path', 'rev'),
+        db.Index('ix_history_path_until', 'path', 'until'),
+        db.Index('ix_history_until_path', 'until', 'path', 'rev'),
+        db.Index('ix_history_rev_path', 'rev', 'path'),
+    )
+
+    @classmethod
+    def in_subtree(cls, path):
+        """filter clause matching path and all its descendants"""
+        return in_subtree(cls.path, path)
+
+    @staticmethod
+    def value(row):
+        """leaf value of a row, an empty container for branches"""
+        if row.nodetype in C_COLUMNS:
+            return column_value(row)
+        return [] if row.nodetype == C_LIST.id else {}
+
+    @classmethod
+    def unpickle_at(cls, path, revision):
+        """retrieve the structure at path as of revision, from the
+        committed history
+
+        Returns:
+            the structure, None if path did not exist at revision
+        """
+        top = make_path(list(filter(None, (path or '').split('/'))))
+        columns = [cls.path.label('id'), cls.parent.label('parent_id'), cls.label, cls.path, cls.rev, cls.nodetype]
+        columns.extend(getattr(cls, leaf.column) for leaf in C_LEAVES)
+        children = {}
+        result = None
+        with read_session() as session:
+            # the versions added after revision are skipped here, a range
+            # on rev would take the place of the range on until
+            live = session.query(*columns).filter(cls.until.is_(None), cls.in_subtree(top))
+            replaced = session.query(*columns).filter(cls.until > revision, has_prefix(cls.path, top))
+            for row in live.union_all(replaced):
+                if row.rev > revision:
+                    continue
+                children.setdefault(row.parent_id, []).append(row)
+                if row.path == top:
+                    result = row
+        if result is None:
+            return None
+        # rows are keyed by path, assemble only needs id and parent_id
+        return Node.assemble(result, children)
+
+    @classmethod
+    def diff(cls, path, old, new):
+        """changes at and below path from revision old to revision new
+
+        Only the committed versions valid at one of the revisions and
+        replaced before the other one are read.
+
+        Returns:
+            list of changes, see history.changes
+        """
+        top = make_path(list(filter(None, (path or '').split('/'))))
+        low, high = min(old, new), max(old, new)
+        columns = [cls.path, cls.rev, cls.nodetype]
+        columns.extend(getattr(cls, leaf.column) for leaf in C_LEAVES)
+        versions = ({}, {})  # at low, at high
+        with read_session() as session:
+            replaced = session.query(*columns).filter(cls.until > low, cls.until <= high, cls.rev <= low)
+            added = session.query(*columns).filter(cls.rev > low, cls.rev <= high)
+            added = added.filter(sqlalchemy.or_(cls.until.is_(None), cls.until > high))
+            query = replaced.filter(has_prefix(cls.path, top)).union_all(added.filter(has_prefix(cls.path, top)))
+            for row in query:
+                versions[row.rev > low][plain_path(row.path)] = cls.value(row)
+        if old > new:
+            return changes(versions[1], versions[0])
+        return changes(versions[0], versions[1])
+
+
+def current_revision(paths=None):
+    """revision of the running transaction, allocated on its first change
+
+    Args:
+        paths (list): the written paths, recorded with a new revision
+    """
+    info = db.session.info
+    if 'revision' not in info:
+        statement = Revision.__table__.insert().values(
+            created=datetime.datetime.utcnow(), paths=json.dumps(paths) if paths is not None else None)
+        result = db.session.connection().execute(statement)
+        info['revision'] = result.inserted_primary_key[0]
+    return info['revision']
+
+
+def record_versions(mappings):
+    """append new versions to the history
+
+    Args:
+        mappings: dicts with path, label, nodetype and the value columns
+    """
+    if not mappings:
+        return
+    revision = current_revision()
+    rows = []
+    for mapping in mappings:
+        row = dict((leaf.column, mapping.get(leaf.column)) for leaf in C_LEAVES)
+        row.update(
+            path=mapping['path'], parent=parent_path(mapping['path']), label=mapping['label'],
+            nodetype=mapping['nodetype'], rev=revision, until=None)
+        rows.append(row)
+    db.session.connection().execute(History.__table__.insert(), rows)
+
+
+def close_versions(paths, subtree=False):
+    """end the current versions of paths
+
+    Args:
+        subtree (bool): also end the versions of all descendants
+    """
+    if not paths:
+        return
+    revision = current_revision()
+    table = History.__table__
+    statement = table.update().where(table.c.until.is_(None)).values(until=revision)
+    connection = db.session.connection()
+    if subtree:
+        for path in paths:
+            connection.execute(statement.where(in_subtree(table.c.path, path)))
+        return
+    for i in range(0, len(paths), BulkPickle.chunk):
+        connection.execute(statement.where(table.c.path.in_(paths[i:i + BulkPickle.chunk])))
+
+
+def move_versions(old, new):
+    """continue the history of the subtree at path old at path new"""
+    if new is not None:
+        table = History.__table__
+        labels = path_labels(new)
+        label = labels[-1] if labels else 'root'
+        select = sqlalchemy.select([
+            sqlalchemy.literal(new) + sqlalchemy.func.substr(table.c.path, len(old) + 1),
+            sqlalchemy.case(
+                (table.c.path == old, sqlalchemy.literal(parent_path(new))),
+                else_=sqlalchemy.literal(new) + sqlalchemy.func.substr(table.c.parent, len(old) + 1)),
+            sqlalchemy.case((table.c.path == old, sqlalchemy.literal(label)), else_=table.c.label),
+            sqlalchemy.literal(current_revision()),
+            table.c.nodetype,
+        ] + [table.c[leaf.column] for leaf in C_LEAVES])
+        select = select.where(in_subtree(table.c.path, old)).where(table.c.until.is_(None))
+        names = ['path', 'parent', 'label', 'rev', 'nodetype'] + [leaf.column for leaf in C_LEAVES]
+        db.session.connection().execute(table.insert().from_select(names, select))
+    close_versions([old], subtree=True)
+
+
+def classify(data):
+    """determine nodetype and value columns for data
+
+    Returns:
+        tuple (nodetype, dict of all value columns)
+    """
+    values = dict((leaf.column, None) for leaf in C_LEAVES)
+    for leaf in C_LEAVES:
+        if isinstance(data, leaf.types):
+            values[leaf.column] = column_data(data)
+            return leaf.id, values
+    for branch in C_BRANCHES:
+        if isinstance(data, branch.types):
+            return branch.id, values
+    raise Exception('unable to store type %s (%s)' % (type(data), data))
+
+
+class BulkPickle(object):
+    """diff a structure against a preloaded subtree and write the
+    difference with bulk statements.
+
+    Rows are never loaded as Node objects. New nodes are inserted level by
+    level with executemany, the ids of one level are fetched with a single
+    query so the next level can reference its parents. The changed nodes
+    are appended to the History.
+    """
+    chunk = 500  # stay below the sqlite host parameter limit
+
+    def __init__(self, rows):
+        self.children = {}
+        for row in rows:
+            self.children.setdefault(row.parent_id, {})[row.label] = row
+        self.inserts = []  # per level list of (mapping, parent)
+        self.updates = []
+        self.deletes = []
+        self.unchanged = 0
+        self.closed = []  # paths whose current version ends
+        self.versions = []  # new versions for the history
+
+    @staticmethod
+    def items(data):
+        if isinstance(data, C_LIST.types):
+            return [(str(k), v) for k, v in enumerate(data)]
+        return [(str(k), v) for k, v in data.items()]
+
+    def store(self, row, data):
+        """diff data against an existing row"""
+        nodetype, values = classify(data)
+        if nodetype in C_COLUMNS:
+            column = C_COLUMNS[nodetype]
+            if row.nodetype == nodetype and getattr(row, column) == values[column]:
+                self.unchanged += 1
+            else:
+                self.update(row, nodetype, values)
+            for child in self.children.get(row.id, {}).values():
+                self.delete(child)
+            return
+        if row.nodetype == nodetype:
+            self.unchanged += 1
+        else:
+            self.update(row, nodetype, values)
+        existing = dict(self.children.get(row.id, {}))
+        for label, value in self.items(data):
+            child = existing.pop(label, None)
+            if child is None:
+                self.insert(row.id, row.path, label, value, 0)
+            else:
+                self.store(child, value)
+        for child in existing.values():
+            self.delete(child)
+
+    def update(self, row, nodetype, values):
+        mapping = dict(values)
+        mapping.update(id=row.id, nodetype=nodetype)
+        self.updates.append(mapping)
+        self.closed.append(row.path)
+        self.versions.append(dict(mapping, path=row.path, label=row.label))
+
+    def delete(self, row):
+        self.deletes.append(row.id)
+        self.closed.append(row.path)
+        for child in self.children.get(row.id, {}).values():
+            self.delete(child)
+
+    def insert(self, parent, prefix, label, data, level):
+        """queue a new node, parent is an id or the mapping of a queued node"""
+        nodetype, values = classify(data)
+        mapping = dict(values)
+        mapping.update(label=label, nodetype=nodetype, path=child_path(prefix, label))
+        if len(self.inserts) <= level:
+            self.inserts.append([])
+        self.inserts[level].append((mapping, parent))
+        self.versions.append(mapping)
+        if nodetype not in C_COLUMNS:
+            for k, v in self.items(data):
+                self.insert(mapping, mapping['path'], k, v, level + 1)
+
+    def execute(self):
+        """send the queued statements, return PickleStats"""
+        for i in range(0, len(self.deletes), self.chunk):
+            query = db.session.query(Node)
+            query = query.filter(Node.id.in_(self.deletes[i:i + self.chunk]))
+            query.delete(synchronize_session=False)
+        if self.updates:
+            db.session.bulk_update_mappings(Node, self.updates)
+        inserted = 0
+        for index, level in enumerate(self.inserts):
+            for mapping, parent in level:
+                if isinstance(parent, dict):
+                    parent = parent['id']
+                mapping['parent_id'] = parent
+            self.insert_rows([x[0] for x in level], index + 1 < len(self.inserts))
+            inserted += len(level)
+        close_versions(self.closed)
+        record_versions(self.versions)
+        return PickleStats(inserted, len(self.updates), len(self.deletes), self.unchanged)
+
+    def insert_rows(self, mappings, ids):
+        """insert the mappings of one level
+
+        Args:
+            ids (bool): set the id of the mappings, the next level
+                references them
+        """
+        db.session.bulk_insert_mappings(Node, mappings, render_nulls=True)
+        if ids:
+            self.fetch_ids(mappings)
+
+    def fetch_ids(self, mappings):
+        """set the id of freshly inserted mappings"""
+        parents = list(set(x['parent_id'] for x in mappings))
+        ids = {}
+        for i in range(0, len(parents), self.chunk):
+            query = db.session.query(Node.id, Node.parent_id, Node.label)
+            query = query.filter(Node.parent_id.in_(parents[i:i + self.chunk]))
+            for row in query:
+                ids[(row.parent_id, row.label)] = row.id
+        for mapping in mappings:
+            mapping['id'] = ids[(mapping['parent_id'], mapping['label'])]
+
+
+# the parent backref only exists once mappers are configured
+db.configure_mappers()
+
+
+@db.event.listens_for(Node.label, 'set')
+def node_label_set(target, value, oldvalue, initiator):
+    target.repath(target.parent, value)
+
+
+@db.event.listens_for(Node.parent, 'set')
+def node_parent_set(target, value, oldvalue, initiator):
+    target.repath(value, target.label)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def record_node_history(session, flush_context):
+    """append the nodes changed through the ORM to the History
+
+    Runs ahead of update_descendant_paths, which consumes the moves.
+    """
+    for node in session.deleted:
+        if isinstance(node, Node):
+            path = sqlalchemy.inspect(node).dict.get('path')
+            if path is not None:
+                close_versions([path], subtree=True)
+    for old, new in session.info.get('moved_paths', []):
+        move_versions(old, new)
+    columns = ['nodetype'] + [leaf.column for leaf in C_LEAVES]
+    versions = []
+    for node in session.dirty:
+        if not isinstance(node, Node) or node.path is None:
+            continue
+        attrs = sqlalchemy.inspect(node).attrs
+        if any(attrs[x].history.has_changes() for x in columns):
+            close_versions([node.path], subtree=node.nodetype in C_COLUMNS)
+            versions.append(node)
+    versions.extend(x for x in session.new if isinstance(x, Node) and x.path is not None)
+    record_versions([dict(
+        [(x, getattr(node, x)) for x in columns], path=node.path, label=node.label) for node in versions])
+
+
+@db.event.listens_for(db.session, 'after_commit')
+@db.event.listens_for(db.session, 'after_rollback')
+def end_revision(session):
+    session.info.pop('revision', None)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def update_descendant_paths(session, flush_context):
+    """rewrite the paths below moved nodes"""
+    moved = session.info.pop('moved_paths', [])
+    for old, new in moved:
+        table = Node.__table__
+        statement = table.update()
+        statement = statement.where(in_subtree(table.c.path, old)).where(table.c.path != old)
+        if new is None:
+            statement = statement.values(path=None)
+        else:
+            suffix = sqlalchemy.func.substr(table.c.path, len(old) + 1)
+            statement = statement.values(path=sqlalchemy.literal(new) + suffix)
+        session.connection().execute(statement)
+    if moved:
+        for node in list(session.identity_map.values()):
+            if isinstance(node, Node) and node not in session.dirty:
+                session.expire(node, ['path'])
+
+
+def escape_history(stale):
+    """move the history of nodes whose paths were stored unescaped
+
+    The deepest nodes are moved first, their rows then no longer match the
+    unescaped paths of their ancestors. Unescaped paths of labels holding a
+    slash are ambiguous, their history is left alone.
+
+    Args:
+        stale: rows with id, label and the unescaped path
+    """
+    table = History.__table__
+    paths = dict(db.session.query(Node.id, Node.path).filter(Node.id.in_([x.id for x in stale])))
+    for row in sorted(stale, key=lambda x: -x.path.count('/')):
+        old, new = row.path, paths.get(row.id)
+        if new is None or '/' in row.label:
+            continue
+        statement = table.update().where(in_subtree(table.c.path, old)).values(
+            path=sqlalchemy.literal(new) + sqlalchemy.func.substr(table.c.path, len(old) + 1),
+            parent=sqlalchemy.case(
+                (table.c.path == old, sqlalchemy.literal(parent_path(new))),
+                else_=sqlalchemy.literal(new) + sqlalchemy.func.substr(table.c.parent, len(old) + 1)))
+        db.session.execute(statement)
+
+
+def store_raw_blobs():
+    """move blob columns holding the content itself to BLOBS
+
+    Blob leaves used to keep their bytes in the row. Nodes and History
+    are rewritten to hold the reference of the stored Blob, content
+    found again is stored once.
+    """
+    for model in (Node, History):
+        query = db.session.query(model.id, model.blobval)
+        query = query.filter(model.nodetype == C_BLOB.id, model.blobval.isnot(None))
+        raw = [x.id for x in query if not BLOB_REFERENCE.match(bytes(x.blobval))]
+        if raw:
+            app.logger.info('moving %d blobs of %s to %s', len(raw), model.__table__.name, BLOBS.directory)
+        # the content is read again in chunks, not held as a whole
+        for start in range(0, len(raw), 100):
+            rows = db.session.query(model.id, model.blobval).filter(model.id.in_(raw[start:start + 100]))
+            db.session.bulk_update_mappings(
+                model, [{'id': x.id, 'blobval': BLOBS.put(bytes(x.blobval)).reference} for x in rows.all()])
+
+
+def upgrade():
+    """bring an existing database up to date
+
+    adds missing columns and indexes, backfills the materialized path
+    level by level, escapes paths stored before labels were escaped,
+    moves blob content out of the rows and records the tree as first
+    revision of an empty History.
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in (Node.__table__, History.__table__, Revision.__table__):
+        existing = [x['name'] for x in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name not in existing:
+                app.logger.info('adding column %s.%s', table.name, column.name)
+                db.session.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name, column.type.compile(db.engine.dialect)))
+        db.session.commit()
+        existing = [x['name'] for x in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name not in existing:
+                app.logger.info('adding index %s', index.name)
+                index.create(db.engine)
+    # paths stored before labels were escaped are built again
+    query = db.session.query(Node.id, Node.label, Node.path).filter(Node.path.isnot(None))
+    query = query.filter(sqlalchemy.or_(Node.label.contains('%', autoescape=True), Node.label.contains('/')))
+    stale = [x for x in query if not x.path.endswith(child_path('/', x.label))]
+    for row in stale:
+        app.logger.info('escaping the paths below %s', row.path)
+        query = db.session.query(Node).filter(Node.in_subtree(row.path))
+        query.update({'path': None}, synchronize_session=False)
+    # backfill paths, one statement per tree level
+    query = Node.query.filter_by(label='root', parent_id=None, path=None)
+    query.update({'path': make_path([])}, synchronize_session=False)
+    parent = db.aliased(Node)
+    while True:
+        query = db.session.query(Node.id, Node.label, parent.path)
+        query = query.join(parent, Node.parent_id == parent.id)
+        query = query.filter(Node.path.is_(None), parent.path.isnot(None))
+        rows = query.all()
+        if not rows:
+            break
+        app.logger.info('backfilling %d paths', len(rows))
+        db.session.bulk_update_mappings(
+            Node, [{'id': x.id, 'path': child_path(x.path, x.label)} for x in rows])
+    escape_history(stale)
+    store_raw_blobs()
     db.session.commit()
+    record_tree()
+
+
+def record_tree():
+    """start an empty history with the current tree as first revision"""
+    if db.session.query(History.id).first() is None and db.session.query(Node.id).first() is not None:
+        app.logger.info('recording the current tree as first revision')
+        node = Node.__table__
+        parent = node.alias('parent')
+        select = sqlalchemy.select([
+            node.c.path, parent.c.path, node.c.label, sqlalchemy.literal(current_revision()),
+            node.c.nodetype,
+        ] + [node.c[leaf.column] for leaf in C_LEAVES])
+        select = select.select_from(node.outerjoin(parent, node.c.parent_id == parent.c.id))
+        select = select.where(node.c.path.isnot(None))
+        names = ['path', 'parent', 'label', 'rev', 'nodetype'] + [leaf.column for leaf in C_LEAVES]
+        db.session.execute(History.__table__.insert().from_select(names, select))
+        db.session.commit()
+
+
+def init():
+    """create the tables, upgrade them and add the root node
+
+    A new database starts with the empty root as first revision.
+    """
+    db.create_all()
+    upgrade()
+    if not Node.root():
+        db.session.add(Node('root'))
+        db.session.commit()
+        record_tree()
+
+
+@app.cli.command('upgrade-db')
+def upgrade_command():
+    """create or upgrade the tables, backfill paths and history"""
+    init()
@@ -0,0 +1,202 @@
+"""search for leaves by label, value and type
+
+A Search selects leaves below a path. Results are ordered by their
+materialized path and come in pages, the materialized path of the last
+result is the cursor of the next page. The backend answers a search, see
+Backend.search: the sql backends use indexes on (nodetype, value) and on
+label, the memory backend walks the subtree in path order.
+"""
+from configdb.errors import InvalidSearch
+from configdb.cache import split_path
+from configdb.paths import escape_label, make_path
+from configdb.blobs import Blob
+import math
+import re
+
+# type argument -> python types of matching leaves
+TYPES = {
+    'bool': (bool, ),
+    'int': (int, ),
+    'float': (float, ),
+    'str': (str, ),
+    'blob': (Blob, ),
+}
+
+
+def leaf_type(value):
+    """name of the type of a leaf value"""
+    for name, types in TYPES.items():
+        if isinstance(value, types):
+            return name
+    return None
+
+
+def glob_pattern(glob):
+    """regular expression for a label glob, * matches any text, ? one
+    character"""
+    parts = []
+    for char in glob:
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return re.compile('(?s)%s\\Z' % ''.join(parts))
+
+
+def candidates(text, types):
+    """the typed values a value argument stands for
+
+    '30' matches the int 30, the float 30.0 and the string '30'.
+    """
+    result = []
+    if 'bool' in types and text in ('true', 'false'):
+        result.append(text == 'true')
+    if 'int' in types:
+        try:
+            result.append(int(text))
+        except ValueError:
+            pass
+    if 'float' in types:
+        try:
+            value = float(text)
+            if not math.isnan(value):
+                result.append(value)
+        except ValueError:
+            pass
+    if 'str' in types:
+        result.append(text)
+    return result
+
+
+def number(args, name):
+    if name not in args:
+        return None
+    try:
+        value = float(args[name])
+    except ValueError:
+        raise InvalidSearch('%s must be a number' % name)
+    if math.isnan(value):
+        raise InvalidSearch('%s must be a number' % name)
+    return value
+
+
+class Search(object):
+    """a query for leaves
+
+    Args:
+        path: only leaves below path
+        label: glob the label must match, None for any
+        value: the leaf must equal one of its candidates, None for any
+        low, high: bounds of numeric leaves, None for open ends
+        types: names of the leaf types to consider, keys of TYPES
+        after: only paths after this one, the cursor of a page, labels
+            escaped like in materialized paths
+        limit: most results
+    """
+    def __init__(self, path='', label=None, value=None, low=None, high=None, types=None,
+                 after=None, limit=100):
+        self.elements = tuple(split_path(path))
+        self.label = label
+        self.pattern = glob_pattern(label) if label is not None else None
+        self.value = value
+        self.low = low
+        self.high = high
+        self.types = set(types or TYPES)
+        if low is not None or high is not None:
+            self.types &= set(('int', 'float'))
+        self.candidates = candidates(value, self.types) if value is not None else None
+        self.after = '/' + ''.join('%s/' % x for x in split_path(after)) if after else None
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, path, args, limit):
+        """Search from request arguments label, value, min, max, type,
+        after and limit
+
+        Args:
+            limit (int): the largest limit accepted
+        Raises:
+            InvalidSearch if an argument can not be parsed
+        """
+        types = None
+        if 'type' in args:
+            types = args['type'].split(',')
+            unknown = [x for x in types if x not in TYPES]
+            if unknown:
+                raise InvalidSearch('unknown type %s, use one of %s' % (
+                    ', '.join(unknown), ', '.join(sorted(TYPES))))
+        try:
+            count = int(args.get('limit', min(100, limit)))
+        except ValueError:
+            raise InvalidSearch('limit must be a number')
+        if not 0 < count <= limit:
+            raise InvalidSearch('limit must be between 1 and %d' % limit)
+        return cls(path, label=args.get('label'), value=args.get('value'),
+                   low=number(args, 'min'), high=number(args, 'max'), types=types,
+                   after=args.get('after'), limit=count)
+
+    def matches(self, label, value):
+        """True if a leaf with label and value is a result"""
+        name = leaf_type(value)
+        if name not in self.types:
+            return False
+        if self.pattern is not None and not self.pattern.match(label):
+            return False
+        if self.candidates is not None:
+            if not any(leaf_type(x) == name and x == value for x in self.candidates):
+                return False
+        if self.low is not None and value < self.low:
+            return False
+        if self.high is not None and value > self.high:
+            return False
+        return True
+
+    def walk(self, root):
+        """the results below root, a memory tree, as (labels, value)
+
+        Children are visited in the order of their materialized paths,
+        subtrees before the cursor are skipped.
+        """
+        node = root
+        for element in self.elements:
+            node = node.peek(element) if node.is_branch else None
+            if node is None:
+                return []
+        results = []
+        self.visit(node, self.elements, results)
+        return results
+
+    def visit(self, node, elements, results):
+        if node.is_leave:
+            if elements and (self.after is None or make_path(elements) > self.after) \
+                    and self.matches(elements[-1], node.val):
+                results.append((elements, node.val))
+            return len(results) < self.limit
+        for child in sorted(node.children, key=lambda x: escape_label(x.label) + '/'):
+            path = elements + (child.label,)
+            if self.after is not None:
+                prefix = make_path(path)
+                if prefix < self.after and not self.after.startswith(prefix):
+                    continue  # the whole subtree is before the cursor
+            if not self.visit(child, path, results):
+                return False
+        return True
+
+    def page(self, results):
+        """response data of a page of results"""
+        cursor = None
+        if len(results) >= self.limit:
+            cursor = '/'.join(escape_label(x) for x in results[-1][0])
+        return {
+            'results': [{'path': '/'.join(labels), 'value': plain(value)} for labels, value in results],
+            'next': cursor,
+        }
+
+
+def plain(value):
+    """json compatible value, blobs are described by digest and size"""
+    if isinstance(value, Blob):
+        return {'blob': value.digest, 'size': value.size}
+    return value
@@ -0,0 +1,210 @@
+"""generator based serializers for node trees
+
+The writers walk the tree and yield the output piece by piece, so neither
+the complete python structure nor the complete output string has to be
+built before the first byte is sent. Text formats yield strings, binary
+formats bytes.
+"""
+from configdb.propertyparser import PropertyParser
+from configdb.blobs import Blob
+import base64
+import io
+import json
+import struct
+import yaml
+
+CHUNK_SIZE = 64 * 1024
+
+
+def join(parts):
+    """concatenate string or bytes chunks"""
+    if parts and isinstance(parts[0], bytes):
+        return b''.join(parts)
+    return ''.join(parts)
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    """join small chunks into pieces of roughly size characters"""
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield join(parts)
+
+
+def children(node, sort=False):
+    """a stable copy of the children of node in output order"""
+    result = list(node.children)
+    if sort and not node.is_list:
+        result.sort(key=lambda x: x.label)
+    return result
+
+
+def text(value):
+    """blobs as base64 strings for formats without binary values"""
+    if isinstance(value, Blob):
+        return base64.b64encode(value.read()).decode('ascii')
+    return value
+
+
+def json_chunks(node, indent=2, level=0):
+    """json output, identical to json.dumps(node.unpickle(), indent=indent)"""
+    if node.is_leave:
+        yield json.dumps(text(node.val))
+        return
+    items = children(node)
+    opening, closing = ('[', ']') if node.is_list else ('{', '}')
+    if not items:
+        yield opening + closing
+        return
+    inner = '\n' + ' ' * (indent * (level + 1))
+    yield opening
+    for index, child in enumerate(items):
+        yield inner if index == 0 else ',' + inner
+        if not node.is_list:
+            yield json.dumps(child.label) + ': '
+        for chunk in json_chunks(child, indent, level + 1):
+            yield chunk
+    yield '\n' + ' ' * (indent * level) + closing
+
+
+def yaml_scalar(value, representer, resolver):
+    """scalar event for value, quoted where a plain scalar would change type"""
+    scalar = representer.represent_data(value)
+    implicit = (
+        scalar.tag == resolver.resolve(yaml.ScalarNode, scalar.value, (True, False)),
+        scalar.tag == resolver.resolve(yaml.ScalarNode, scalar.value, (False, True)))
+    return yaml.ScalarEvent(None, scalar.tag, implicit, scalar.value, style=scalar.style)
+
+
+def yaml_events(node, representer, resolver):
+    """yaml events for node, the same ones yaml.dump would emit"""
+    if node.is_leave:
+        value = node.val
+        yield yaml_scalar(value.read() if isinstance(value, Blob) else value, representer, resolver)
+        return
+    if node.is_list:
+        yield yaml.SequenceStartEvent(None, None, True, flow_style=False)
+        for child in children(node):
+            for event in yaml_events(child, representer, resolver):
+                yield event
+        yield yaml.SequenceEndEvent()
+        return
+    yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+    for child in children(node, sort=True):
+        yield yaml_scalar(child.label, representer, resolver)
+        for event in yaml_events(child, representer, resolver):
+            yield event
+    yield yaml.MappingEndEvent()
+
+
+def yaml_chunks(node):
+    """yaml output, identical to yaml.dump(node.unpickle())"""
+    output = io.StringIO()
+    emitter = yaml.emitter.Emitter(output)
+    representer = yaml.representer.Representer()
+    resolver = yaml.resolver.Resolver()
+    emitter.emit(yaml.StreamStartEvent())
+    emitter.emit(yaml.DocumentStartEvent())
+    for event in yaml_events(node, representer, resolver):
+        emitter.emit(event)
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    emitter.emit(yaml.DocumentEndEvent())
+    emitter.emit(yaml.StreamEndEvent())
+    yield output.getvalue()
+
+
+def prop_chunks(node, prefix=''):
+    """properties output, identical to PropertyParser(node.unpickle()).dump()"""
+    first = True
+    for line in prop_lines(node, prefix):
+        yield line if first else '\n' + line
+        first = False
+
+
+def prop_lines(node, prefix):
+    if node.is_leave:
+        yield PropertyParser.format_line(prefix, text(node.val))
+        return
+    for child in children(node, sort=True):
+        for line in prop_lines(child, '.'.join(filter(None, (prefix, child.label)))):
+            yield line
+
+
+def msgpack_header(size, fixed, sizes):
+    """header of a str, bin, array or map of size entries
+
+    Args:
+        fixed: type byte of the fix variant, None if there is none
+        sizes: type bytes for 8, 16 and 32 bit lengths, None if missing
+    """
+    if fixed is not None and size < (32 if fixed == 0xa0 else 16):
+        return struct.pack('>B', fixed | size)
+    for code, fmt, limit in zip(sizes, ('>BB', '>BH', '>BI'), (0xff, 0xffff, 0xffffffff)):
+        if code is not None and size <= limit:
+            return struct.pack(fmt, code, size)
+    raise ValueError('%d entries do not fit into msgpack' % size)
+
+
+def msgpack_value(value):
+    """MessagePack encoding of a leaf value"""
+    if value is None:
+        return b'\xc0'
+    if value is True:
+        return b'\xc3'
+    if value is False:
+        return b'\xc2'
+    if isinstance(value, int):
+        if -32 <= value <= 0x7f:
+            return struct.pack('>b', value)
+        if value >= 0:
+            for code, fmt, limit in ((0xcc, '>BB', 0xff), (0xcd, '>BH', 0xffff),
+                                     (0xce, '>BI', 0xffffffff), (0xcf, '>BQ', 0xffffffffffffffff)):
+                if value <= limit:
+                    return struct.pack(fmt, code, value)
+        else:
+            for code, fmt, limit in ((0xd0, '>Bb', 0x80), (0xd1, '>Bh', 0x8000),
+                                     (0xd2, '>Bi', 0x80000000), (0xd3, '>Bq', 0x8000000000000000)):
+                if -value <= limit:
+                    return struct.pack(fmt, code, value)
+        raise ValueError('integer %d does not fit into msgpack' % value)
+    if isinstance(value, float):
+        return struct.pack('>Bd', 0xcb, value)
+    if isinstance(value, Blob):
+        return msgpack_header(value.size, None, (0xc4, 0xc5, 0xc6)) + value.read()
+    data = value.encode('utf-8')
+    return msgpack_header(len(data), 0xa0, (0xd9, 0xda, 0xdb)) + data
+
+
+def msgpack_chunks(node):
+    """MessagePack output, leaves keep their type and blobs are bin"""
+    if node.is_leave:
+        yield msgpack_value(node.val)
+        return
+    items = children(node)
+    if node.is_list:
+        yield msgpack_header(len(items), 0x90, (None, 0xdc, 0xdd))
+    else:
+        yield msgpack_header(len(items), 0x80, (None, 0xde, 0xdf))
+    for child in items:
+        if not node.is_list:
+            yield msgpack_value(child.label)
+        for chunk in msgpack_chunks(child):
+            yield chunk
+
+
+WRITERS = {
+    'json': json_chunks,
+    'yaml': yaml_chunks,
+    'prop': prop_chunks,
+    'msgpack': msgpack_chunks,
+}
@@ -1,10 +1,22 @@
 from configdb.meta import app
-from configdb.meta import db
-from configdb.errors import HttpException, DecodeException, InvalidPath
+from configdb.errors import HttpException, BodyTooLarge, DecodeException, InheritanceCycle, InvalidPath, \
+    InvalidRevision, InvalidSearch, PatchConflict
 from configdb.formatter import Formatter
-from flask import request, Response, render_template
+from configdb.node import TREE
+from configdb.patch import merge_patch, JsonPatch
+from configdb.cache import CACHE, VERSIONS
+from configdb.backend import BACKEND
+from configdb.search import Search
+from configdb.scheduler import SCHEDULER
+from configdb.inherit import INHERITANCE
+from configdb.blobs import Blob, BLOBS
+from configdb.watch import HUB
+from configdb.resolver import RESOLVER
+from configdb.metrics import METRICS, phase
+from flask import request, Response, render_template, jsonify, make_response, send_file, g
 from flask.views import MethodView
-import socket
+import io
+import json
 
 
 mimes = {
@@ -14,6 +26,25 @@ mimes = {
     'text/html': 'html',
     'application/properties': 'prop',
     'application/yaml': 'yaml',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/octet-stream': 'blob',
+}
+
+# response mime type of binary formats, text is sent as text/plain
+binary_mimes = {
+    'msgpack': 'application/msgpack',
+    'blob': 'application/octet-stream',
+}
+
+
+def response_mimetype(response_format):
+    return binary_mimes.get(response_format, 'text/plain')
+
+patch_types = {
+    'application/json': 'merge',
+    'application/merge-patch+json': 'merge',
+    'application/json-patch+json': 'json',
 }
 
 
@@ -22,6 +53,19 @@ def index():
     return 'Hello World'
 
 
+@app.route('/stats')
+def stats():
+    return jsonify(cache=CACHE.stats(), watch=HUB.stats(), resolver=RESOLVER.stats(), writes=SCHEDULER.stats(),
+                   inheritance=INHERITANCE.stats(), blobs=BLOBS.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    data = METRICS.render(cache=CACHE.stats(), watch=HUB.stats(), resolver=RESOLVER.stats(),
+                          writes=SCHEDULER.stats(), inheritance=INHERITANCE.stats(), blobs=BLOBS.stats())
+    return Response(data, mimetype='text/plain; version=0.0.4')
+
+
 def get_response_format():
     """determine the reponse format the client requires.
     One of yaml, json, xml, value, properties ...
@@ -53,24 +97,184 @@ def decode_put():
     return result
 
 
+def body_limit():
+    """MAX_BODY_SIZE, 413 for a request announcing a larger body"""
+    limit = app.config.get('MAX_BODY_SIZE')
+    if limit is not None and (request.content_length or 0) > limit:
+        raise HttpException('body larger than %d bytes' % limit, code=413)
+    return limit
+
+
+def read_body():
+    """the whole request body, at most MAX_BODY_SIZE bytes"""
+    limit = body_limit()
+    if limit is None:
+        return request.get_data()
+    body = request.stream.read(limit + 1)
+    if len(body) > limit:
+        raise HttpException('body larger than %d bytes' % limit, code=413)
+    return body
+
+
 class NodeAPIv1(MethodView):
     def path_replacer(self, path):
         path = path.replace('HOSTADDR', request.remote_addr)
         if 'HOSTNAME' in path:
-            try:
-                name = socket.gethostbyaddr(request.remote_addr)[0]
-            except socket.herror:
-                raise HttpException('failed to translate HOSTNAME, address %s non resolvable' % request.remote_addr)
-            path = path.replace('HOSTNAME', name)
+            path = path.replace('HOSTNAME', self.hostname())
         return path
 
+    def hostname(self):
+        """name of the client address, resolved once per request"""
+        if 'hostname' not in g:
+            with phase('resolve'):
+                g.hostname = RESOLVER.resolve(request.remote_addr)
+        if g.hostname is None:
+            raise HttpException('failed to translate HOSTNAME, address %s non resolvable' % request.remote_addr)
+        return g.hostname
+
     def get(self, path):
         path = self.path_replacer(path)
+        if 'watch' in request.args:
+            return self.watch(path)
+        response_format = get_response_format()
+        view = request.args.get('view', 'plain')
+        if view not in ('plain', 'effective'):
+            raise HttpException('unknown view: %s' % view)
+        if response_format == 'blob':
+            return self.blob(path, view)
+        if 'rev' in request.args:
+            return self.snapshot(path, response_format, view)
+        if view == 'effective':
+            return self.effective(path, response_format)
+        version = VERSIONS.version(path)
+        etag = VERSIONS.etag(version, response_format)
+        if request.if_none_match.contains(etag):
+            # unchanged since the client's copy, no need to touch the tree
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        response = self.render(path, response_format, version)
+        response.set_etag(etag)
+        return response
+
+    def submit(self, path, operation):
+        """apply a write, see WriteScheduler.submit
+
+        Raises:
+            HttpException 409 if the write adds an inheritance cycle
+        """
+        try:
+            return SCHEDULER.submit(path, operation)
+        except InheritanceCycle as e:
+            raise HttpException(e, code=409)
+
+    def watch(self, path):
+        """long poll until something at or below path changes
+
+        Waits for a revision newer than the since argument, by default the
+        current one. Returns the new revision and the changed paths.
+        """
+        limit = app.config.get('WATCH_TIMEOUT', 60)
         try:
-            formatter = Formatter(path)
+            since = int(request.args.get('since', VERSIONS.version(path)))
+            timeout = min(float(request.args.get('timeout', limit)), limit)
+        except ValueError:
+            raise HttpException('since and timeout must be numbers')
+        revision = HUB.wait(path, since, timeout)
+        changed = HUB.changes(path, since) if revision > since else []
+        return jsonify(revision=revision, changed=changed)
+
+    def snapshot(self, path, response_format, view):
+        """render path as it was at the revision in the rev argument"""
+        root = self.revision_root(path, view)
+        return self.render(path, response_format, None, root=root)
+
+    def blob(self, path, view):
+        """send the content of a blob leaf from its file
+
+        The digest is the entity tag. Conditional and range requests are
+        answered by send_file, the server may hand the file to sendfile.
+        """
+        if 'rev' in request.args:
+            root = self.revision_root(path, view)
+        elif view == 'effective':
+            root = INHERITANCE.effective(TREE.root)
+        else:
+            root = TREE.root
+        try:
+            with phase('lookup'):
+                node = Formatter(path, root=root).node
+        except InvalidPath as e:
+            raise HttpException(e, code=404)
+        value = node.val if node.is_leave else None
+        if not isinstance(value, Blob):
+            raise HttpException('%s is not a blob' % path, code=406)
+        try:
+            return send_file(BLOBS.path(value), mimetype='application/octet-stream',
+                             etag=value.digest, conditional=True)
+        except FileNotFoundError:
+            raise HttpException('content of blob %s is missing' % value.digest, code=404)
+
+    def effective(self, path, response_format):
+        """render path in the effective tree, see inherit
+
+        The effective tree is materialized with every write, rendering it
+        costs the same as the plain tree. Responses are cached and tagged
+        with the last write to the path or the layers it inherits from,
+        see Inheritance.version.
+        """
+        fmt = 'effective-%s' % response_format
+        version = INHERITANCE.version(path)
+        etag = VERSIONS.etag(version, fmt)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        root = INHERITANCE.effective(TREE.root)
+        response = self.render(path, response_format, version, root=root, key=fmt)
+        response.set_etag(etag)
+        return response
+
+    def revision_arg(self, name, default=None):
+        """the revision in the argument name"""
+        try:
+            return int(request.args.get(name, default))
+        except (TypeError, ValueError):
+            raise HttpException('%s must be a number' % name)
+
+    def revision_root(self, path, view):
+        """a tree holding path as of the revision in the rev argument
+
+        The backend reads it from its history, see Backend.tree. The
+        effective view needs the whole tree.
+        """
+        revision = self.revision_arg('rev')
+        try:
+            with phase('history'):
+                if view == 'effective':
+                    return INHERITANCE.effective(BACKEND.tree('', revision))
+                return BACKEND.tree(path, revision)
+        except (InvalidRevision, InvalidPath) as e:
+            raise HttpException(e, code=404)
+
+    def render(self, path, response_format, version, root=None, key=None):
+        """render path in the current tree, or in root without caching
+
+        Args:
+            key: cache responses rendered from root under this format name
+        """
+        cached = root is None or key is not None
+        key = key or response_format
+        if cached and response_format != 'html':
+            with phase('cache'):
+                data = CACHE.get(path, key, version)
+            if data is not None:
+                return Response(data, mimetype=response_mimetype(response_format))
+        try:
+            with phase('lookup'):
+                formatter = Formatter(path, root=root)
         except InvalidPath as e:
             raise HttpException(e, code=404)
-        response_format = get_response_format()
 
         if response_format == 'html':
             # handle html in view
@@ -78,45 +282,224 @@ class NodeAPIv1(MethodView):
                 path = '/'
             if path and path[-1] != '/':
                 path = path + '/'
-            return render_template('node.html', node=formatter.node, path=path, params=request.args)
+            with phase('render'):
+                return make_response(render_template('node.html', node=formatter.node, path=path, params=request.args))
         # everything else must be handled by the formatter
+        chunks = formatter.stream(response_format)
+        if chunks is not None:
+            if cached:
+                chunks = CACHE.collect(path, key, version, chunks)
+            return Response(chunks, mimetype=response_mimetype(response_format))
         try:
-            data = getattr(formatter, response_format)
+            with phase('render'):
+                data = getattr(formatter, response_format)
         except AttributeError:
             raise HttpException('unknown format: %s' % response_format)
-        return Response(data, mimetype='text/plain')
+        if data is not None and cached:
+            data = CACHE.put(path, key, version, data)
+        return Response(data, mimetype=response_mimetype(response_format))
 
     def delete(self, path):
         path = self.path_replacer(path)
-        try:
-            formatter = Formatter(path)
-        except InvalidPath as e:
-            raise HttpException(e, code=404)
-        formatter.node.parent = None
+
+        def operation(root):
+            try:
+                with phase('lookup'):
+                    formatter = Formatter(path, root=root)
+            except InvalidPath as e:
+                raise HttpException(e, code=404)
+            formatter.node.parent = None
+            return [path]
+        self.submit(path, operation)
         return 'ok'
 
     def put(self, path):
+        """parse the body into a detached tree, the write only swaps it in"""
         path = self.path_replacer(path)
         put_format = decode_put()
-        data = request.data.decode('utf-8')  # check if this works in python2
         if not hasattr(Formatter, put_format):
             raise HttpException('unable to handle content-type %s' % put_format)
-        formatter = Formatter(path, create=True)
+        limit = None if put_format == 'blob' else body_limit()
         try:
-            setattr(formatter, put_format, data)
+            with phase('parse'):
+                tree = Formatter.parse(put_format, request.stream, limit)
         except DecodeException as e:
             raise HttpException('unable to decode: %s' % e)
-        db.session.commit()  # possible race condition on multithread
+        except BodyTooLarge as e:
+            raise HttpException(e, code=413)
+        body = read_body() if tree is None else None
+
+        def operation(root):
+            try:
+                with phase('lookup'):
+                    formatter = Formatter(path, create=True, root=root)
+            except InvalidPath as e:
+                # below a leaf, or a list label that is not its next index
+                raise HttpException(e, code=409)
+            if tree is not None:
+                formatter.node.adopt(tree)
+            else:
+                formatter.load(put_format, io.BytesIO(body))
+            return [path]
+        self.submit(path, operation)
         return 'done'
 
+    def patch(self, path):
+        """apply a JSON merge patch or a JSON patch, only the nodes named
+        in the patch are written. Returns the new revision."""
+        path = self.path_replacer(path)
+        content_type = request.mimetype
+        if content_type not in patch_types:
+            raise HttpException('unable to patch with content-type %s' % content_type, code=415)
+        try:
+            with phase('parse'):
+                document = json.loads(read_body().decode('utf-8'))
+        except ValueError as e:
+            raise HttpException('unable to decode: %s' % e)
+
+        def operation(root):
+            touched = []
+            try:
+                with phase('lookup'):
+                    formatter = Formatter(path, root=root)
+            except InvalidPath as e:
+                if patch_types[content_type] != 'merge':
+                    raise HttpException(e, code=404)
+                try:
+                    formatter = Formatter(path, create=True, root=root)
+                except InvalidPath as e:
+                    raise HttpException(e, code=409)
+                touched.append(path)
+            try:
+                with phase('patch'):
+                    if patch_types[content_type] == 'merge':
+                        touched.extend(merge_patch(formatter.node, document))
+                    else:
+                        touched.extend(JsonPatch(formatter.node).apply(document))
+            except DecodeException as e:
+                raise HttpException('unable to decode: %s' % e)
+            except PatchConflict as e:
+                raise HttpException(e, code=409)
+            return touched
+        revision = self.submit(path, operation)
+        if revision is None:
+            revision = VERSIONS.version(path)
+        return jsonify(revision=revision)
+
+
+class BatchAPIv1(NodeAPIv1):
+    """fetch several paths in one request
+
+    GET takes repeated path arguments, POST a json list of paths. The
+    response maps every requested path to its data in the requested
+    format, paths that do not exist are left out. All paths are looked up
+    in the same version of the in-memory tree, HOSTNAME is resolved once.
+    """
+    def get(self):
+        return self.batch(request.args.getlist('path'))
+
+    def post(self):
+        paths = request.get_json(force=True, silent=True)
+        if not isinstance(paths, list) or not all(isinstance(x, str) for x in paths):
+            raise HttpException('expected a json list of paths')
+        return self.batch(paths)
+
+    def batch(self, paths):
+        response_format = get_response_format()
+        if response_format == 'html':
+            raise HttpException('a batch is not available as html', code=406)
+        result = {}
+        root = TREE.root  # all paths from the same version
+        for path in paths:
+            # resolve is a phase of its own, keep it out of the lookup
+            replaced = self.path_replacer(path)
+            try:
+                with phase('lookup'):
+                    result[path] = Formatter(replaced, root=root).node.unpickle()
+            except InvalidPath:
+                pass
+        formatter = Formatter.detached(result)
+        try:
+            with phase('render'):
+                data = getattr(formatter, response_format)
+        except AttributeError:
+            raise HttpException('unknown format: %s' % response_format)
+        return Response(data, mimetype=response_mimetype(response_format))
+
+
+class DiffAPIv1(NodeAPIv1):
+    """changes at and below a path between two revisions
+
+    Takes the revisions as from and to arguments, to defaults to the
+    current revision. The backend compares the two versions, see
+    Backend.diff.
+    """
+    def get(self, path):
+        path = self.path_replacer(path)
+        old = self.revision_arg('from')
+        new = self.revision_arg('to', VERSIONS.revision)
+        try:
+            with phase('history'):
+                changes = BACKEND.diff(path, old, new)
+        except InvalidRevision as e:
+            raise HttpException(e, code=404)
+        except InvalidPath as e:
+            raise HttpException(e)
+        with phase('render'):
+            return jsonify(changes=changes)
+
+
+class SearchAPIv1(NodeAPIv1):
+    """leaves below a path by label glob, value, numeric range and type
+
+    Returns a page of paths and values in path order, next is the cursor
+    for the after argument of the following page, null on the last one.
+    """
+    def get(self, path):
+        path = self.path_replacer(path)
+        try:
+            search = Search.from_args(path, request.args, app.config.get('SEARCH_LIMIT', 1000))
+        except InvalidSearch as e:
+            raise HttpException(e)
+        with phase('search'):
+            results = BACKEND.search(search)
+        return jsonify(**search.page(results))
+
+
+app.add_url_rule(
+    '/batch/v1/',
+    view_func=BatchAPIv1.as_view('batch_v1'),
+    methods=['GET', 'POST'])
 
 api_view = NodeAPIv1.as_view('api_v1')
 app.add_url_rule(
     '/api/v1/',
     defaults={'path': ''},
     view_func=api_view,
-    methods=['GET', 'POST', 'PUT', 'DELETE'])
+    methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
 app.add_url_rule(
     '/api/v1/<path:path>',
     view_func=api_view,
-    methods=['GET', 'POST', 'PUT', 'DELETE'])
+    methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+
+diff_view = DiffAPIv1.as_view('diff_v1')
+app.add_url_rule(
+    '/diff/v1/',
+    defaults={'path': ''},
+    view_func=diff_view,
+    methods=['GET'])
+app.add_url_rule(
+    '/diff/v1/<path:path>',
+    view_func=diff_view,
+    methods=['GET'])
+
+search_view = SearchAPIv1.as_view('search_v1')
+app.add_url_rule(
+    '/search/v1/',
+    defaults={'path': ''},
+    view_func=search_view,
+    methods=['GET'])
+app.add_url_rule(
+    '/search/v1/<path:path>',
+    view_func=search_view,
+    methods=['GET'])
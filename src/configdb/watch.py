@@ -0,0 +1,90 @@
+from configdb.meta import app
+from configdb.cache import split_path, VERSIONS
+from collections import deque
+import threading
+
+
+def related(watched, written):
+    """True if a write to written changes the subtree at watched"""
+    if watched == written or not watched or not written:
+        return True
+    return watched.startswith(written + '/') or written.startswith(watched + '/')
+
+
+class ChangeHub(object):
+    """in-process fan out of change events to idle watchers
+
+    Waiters are registered by path and only the ones related to a change
+    are woken. Waiting uses threading.Event, which becomes a cooperative
+    greenlet wait when running under gevent, so thousands of idle watchers
+    do not hold a thread each. Without gevent every waiter is a thread.
+
+    Args:
+        history (int): number of change events kept to answer since queries
+    """
+    def __init__(self, history):
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=history)  # (revision, path)
+        self.waiters = {}  # path -> set of threading.Event
+
+    def publish(self, revision, *paths):
+        """record a write and wake everybody watching a related path"""
+        paths = ['/'.join(split_path(x)) for x in paths]
+        with self.lock:
+            for path in paths:
+                self.events.append((revision, path))
+            wake = [x for key, x in self.waiters.items()
+                    if any(related(key, path) for path in paths)]
+        for waiters in wake:
+            for event in list(waiters):
+                event.set()
+
+    def changes(self, path, since):
+        """paths written after revision since that affect path
+
+        If the history does not reach back to since, path itself is
+        reported as changed.
+        """
+        path = '/'.join(split_path(path))
+        with self.lock:
+            events = list(self.events)
+        if not events or events[0][0] > since + 1:
+            return [path]
+        result = []
+        for revision, written in events:
+            if revision > since and related(path, written) and written not in result:
+                result.append(written)
+        return result
+
+    def wait(self, path, since, timeout):
+        """block until path changed after revision since or timeout expired
+
+        Returns:
+            the current version of path
+        """
+        path = '/'.join(split_path(path))
+        event = threading.Event()
+        with self.lock:
+            self.waiters.setdefault(path, set()).add(event)
+        try:
+            # registered before checking, a concurrent publish is not lost
+            version = VERSIONS.version(path)
+            if version <= since:
+                event.wait(timeout)
+                version = VERSIONS.version(path)
+            return version
+        finally:
+            with self.lock:
+                self.waiters[path].discard(event)
+                if not self.waiters[path]:
+                    del self.waiters[path]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'watchers': sum(len(x) for x in self.waiters.values()),
+                'history': len(self.events),
+            }
+
+
+HUB = ChangeHub(app.config.get('WATCH_HISTORY', 10000))
@@ -1,7 +1,18 @@
 #!/usr/bin/python
+try:
+    # with gevent idle watch requests are greenlets instead of threads,
+    # without it every open watch holds a thread of the werkzeug server
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pywsgi import WSGIServer
+except ImportError:
+    WSGIServer = None
 import logging
 from configdb import app
 
 log_werkzeug = logging.getLogger('werkzeug')
 log_werkzeug.setLevel(logging.WARNING)
-app.run(host='0.0.0.0')
+if WSGIServer is None:
+    app.run(host='0.0.0.0', threaded=True)
+else:
+    WSGIServer(('0.0.0.0', 5000), app).serve_forever()
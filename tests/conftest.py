@@ -0,0 +1,25 @@
+"""settings of the tests importing configdb
+
+configdb reads its settings and prepares the database at import time,
+the tests in this process share a temporary sqlite database.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+DIRECTORY = tempfile.mkdtemp(prefix='configdb-tests-')
+SETTINGS = os.path.join(DIRECTORY, 'configdb.cfg')
+
+with open(SETTINGS, 'w') as f:
+    f.write('DEBUG = False\n')
+    f.write('SQLALCHEMY_DATABASE_URI = %r\n' % ('sqlite:///' + os.path.join(DIRECTORY, 'configdb.db')))
+    f.write('SQLALCHEMY_TRACK_MODIFICATIONS = False\n')
+    f.write('CONFIGDB_BACKEND = %r\n' % 'sqlite')
+    f.write('BLOB_DIR = %r\n' % os.path.join(DIRECTORY, 'blobs'))
+os.environ['CONFIGDB_SETTINGS'] = SETTINGS
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DIRECTORY, True)
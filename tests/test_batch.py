@@ -0,0 +1,29 @@
+"""several paths in one request, /batch/v1/"""
+import json
+
+import yaml
+
+from configdb import app
+
+client = app.test_client()
+
+
+def setup_module():
+    data = {'a': {'x': 1}, 'b': [1, 2], 'c': 'text'}
+    response = client.put('/api/v1/batched', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+
+
+def test_get_and_post():
+    response = client.get('/batch/v1/?path=batched/a&path=batched/b/1&path=batched/missing&format=json')
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'batched/a': {'x': 1}, 'batched/b/1': 2}
+    paths = ['batched/c', 'batched/a/x']
+    response = client.post('/batch/v1/?format=yaml', data=json.dumps(paths))
+    assert yaml.safe_load(response.data) == {'batched/c': 'text', 'batched/a/x': 1}
+
+
+def test_invalid_requests():
+    assert client.post('/batch/v1/?format=json', data='{"a": 1}').status_code == 400
+    assert client.post('/batch/v1/?format=json', data='[1]').status_code == 400
+    assert client.get('/batch/v1/?path=batched/a', headers={'Accept': 'text/html'}).status_code == 406
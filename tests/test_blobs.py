@@ -0,0 +1,28 @@
+"""blob leaves stored with their content in the rows are upgraded"""
+from configdb.meta import db
+from configdb.blobs import BLOBS
+from configdb import schema
+
+LABELS = ['raw', 'reference']
+
+
+def test_upgrade_moves_raw_blobs():
+    content = b'\x00keystore'
+    stored = BLOBS.put(b'stored')
+    rows = [{
+        'path': schema.child_path('/', label), 'label': label, 'nodetype': schema.C_BLOB.id, 'blobval': value,
+    } for label, value in zip(LABELS, [content, stored.reference])]
+    db.session.bulk_insert_mappings(schema.Node, [dict(x, parent_id=schema.Node.root().id) for x in rows])
+    db.session.bulk_insert_mappings(
+        schema.History, [dict(x, parent='/', rev=schema.current_revision()) for x in rows])
+    db.session.commit()
+    try:
+        schema.upgrade()
+        for model in (schema.Node, schema.History):
+            values = dict((x.label, schema.column_value(x)) for x in model.query.filter(model.label.in_(LABELS)))
+            assert values['raw'].read() == content
+            assert values['reference'] == stored
+    finally:
+        for model in (schema.Node, schema.History):
+            model.query.filter(model.label.in_(LABELS)).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,40 @@
+"""size limit of PUT and PATCH bodies"""
+import io
+import json
+
+import pytest
+
+from configdb import app
+from configdb.node import Node
+from configdb.errors import BodyTooLarge
+from configdb.formatter import Formatter
+
+client = app.test_client()
+
+
+@pytest.fixture
+def limit(monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_BODY_SIZE', 64)
+
+
+def test_large_put_rejected(limit):
+    small = json.dumps({'a': 1})
+    large = json.dumps({'a': 'x' * 100})
+    assert client.put('/api/v1/bodies', data=small, content_type='application/json').status_code == 200
+    assert client.put('/api/v1/bodies', data=large, content_type='application/json').status_code == 413
+    response = client.patch('/api/v1/bodies', data=large, content_type='application/merge-patch+json')
+    assert response.status_code == 413
+    assert Node.by_path('bodies').unpickle() == {'a': 1}
+
+
+def test_blobs_not_limited(limit):
+    response = client.put('/api/v1/bodies/blob', data=b'x' * 100, content_type='application/octet-stream')
+    assert response.status_code == 200
+    assert Node.by_path('bodies/blob').val.size == 100
+
+
+def test_body_without_length_stopped_while_parsing():
+    large = json.dumps({'a': 'x' * 100}).encode('utf-8')
+    with pytest.raises(BodyTooLarge):
+        Formatter.parse('json', io.BytesIO(large), 64)
+    assert Formatter.parse('json', io.BytesIO(large), len(large)).unpickle() == {'a': 'x' * 100}
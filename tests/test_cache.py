@@ -0,0 +1,66 @@
+"""subtree versions and the response cache of GET"""
+import json
+
+from configdb import app
+from configdb.cache import CACHE, ResponseCache, SubtreeVersions
+
+client = app.test_client()
+
+
+def put(path, data):
+    response = client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+
+
+def get(path):
+    response = client.get('/api/v1/%s?format=json' % path)
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+
+def test_versions_of_subtrees():
+    versions = SubtreeVersions()
+    assert versions.touch('a/b') == 1
+    assert versions.touch('a/c/') == 2
+    assert (versions.version('a'), versions.version('a/b'), versions.version('a/b/x')) == (2, 1, 1)
+    # replacing an ancestor changes everything below it
+    versions.touch('a')
+    assert versions.version('a/b/x') == 3 and versions.version('x') == 0
+    assert versions.touch('y', revision=7) == 7 and versions.revision == 7
+
+
+def test_cache_entries():
+    cache = ResponseCache(10, 6)
+    cache.put('a', 'json', 1, 'aaaa')
+    assert cache.get('/a/', 'json', 1) == b'aaaa'
+    assert cache.get('a', 'json', 2) is None
+    assert cache.get('a', 'json', 1) is None
+    cache.put('a', 'json', 1, b'aaaa')
+    cache.put('b', 'json', 1, b'bbbb')
+    cache.get('a', 'json', 1)
+    cache.put('c', 'json', 1, b'cccc')
+    # the least recently used entry is evicted
+    assert cache.get('b', 'json', 1) is None and cache.get('a', 'json', 1) == b'aaaa'
+    assert cache.put('d', 'json', 1, b'x' * 11) == b'x' * 11 and cache.get('d', 'json', 1) is None
+    assert list(cache.collect('e', 'json', 1, [b'eee', b'eeee'])) == [b'eee', b'eeee']
+    assert cache.get('e', 'json', 1) is None
+    assert b''.join(cache.collect('f', 'json', 1, [b'ff', b'ff'])) == b'ffff'
+    assert cache.get('f', 'json', 1) == b'ffff'
+    stats = cache.stats()
+    assert stats['size'] <= stats['budget'] == 10 and stats['evictions'] >= 1
+
+
+def test_get_served_from_cache():
+    put('cached', {'a': {'x': 1}, 'b': {'y': 2}})
+    assert get('cached/a') == {'x': 1}
+    hits = CACHE.hits
+    assert get('cached/a') == {'x': 1}
+    assert CACHE.hits == hits + 1
+    # a write to a sibling keeps the entry, a write below renders again
+    put('cached/b/y', 3)
+    assert get('cached/a') == {'x': 1}
+    assert CACHE.hits == hits + 2
+    put('cached/a/x', 4)
+    assert get('cached/a') == {'x': 4}
+    assert get('cached') == {'a': {'x': 4}, 'b': {'y': 3}}
+    assert CACHE.hits == hits + 2
@@ -0,0 +1,41 @@
+"""entity tags and conditional GET"""
+import json
+
+from configdb import app
+
+client = app.test_client()
+
+
+def put(path, data):
+    response = client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+
+
+def get(path, fmt='json', **headers):
+    return client.get('/api/v1/%s?format=%s' % (path, fmt), headers=headers)
+
+
+def test_not_modified_until_written():
+    put('tagged', {'a': 1, 'b': 2})
+    response = get('tagged/a')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag.endswith('-json"')
+    response = get('tagged/a', **{'If-None-Match': etag})
+    assert response.status_code == 304 and response.headers['ETag'] == etag and response.data == b''
+    assert get('tagged/a', **{'If-None-Match': '"other", %s' % etag}).status_code == 304
+    # a sibling write keeps the tag, a write to the path changes it
+    put('tagged/b', 3)
+    assert get('tagged/a', **{'If-None-Match': etag}).status_code == 304
+    put('tagged/a', 4)
+    response = get('tagged/a', **{'If-None-Match': etag})
+    assert response.status_code == 200 and response.data == b'4'
+    assert response.headers['ETag'] != etag
+
+
+def test_tags_differ_by_format():
+    put('formats', {'a': 1})
+    json_tag = get('formats').headers['ETag']
+    yaml_tag = get('formats', 'yaml').headers['ETag']
+    assert json_tag != yaml_tag
+    assert get('formats', 'yaml', **{'If-None-Match': json_tag}).status_code == 200
+    assert get('formats', 'yaml', **{'If-None-Match': yaml_tag}).status_code == 304
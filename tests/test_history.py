@@ -0,0 +1,62 @@
+"""reads of old revisions and diffs between revisions"""
+import json
+
+from configdb import app, history
+from configdb.backend import BACKEND
+from configdb.node import Node
+
+client = app.test_client()
+
+
+def put(path, data):
+    response = client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+    return BACKEND.revision()
+
+
+def test_memory_diff():
+    old = Node('top')
+    old.pickle({'a': 1, 'b': {'c': 2}, 'd': [1]})
+    new = Node('top')
+    new.pickle({'a': 3, 'b': {}, 'e': 'x', 'd': [1]})
+    assert history.diff(old, new, 'top') == [
+        {'path': 'top/a', 'op': 'replace', 'old': 1, 'new': 3},
+        {'path': 'top/b/c', 'op': 'remove', 'old': 2},
+        {'path': 'top/e', 'op': 'add', 'new': 'x'},
+    ]
+    assert history.diff(None, Node.by_path('a', root=new), 'a') == [{'path': 'a', 'op': 'add', 'new': 3}]
+    assert history.diff(old, old) == []
+
+
+def test_read_old_revision():
+    first = put('aged', {'x': 1, 'y': 2})
+    put('aged/x', 5)
+    response = client.get('/api/v1/aged?rev=%d&format=json' % first)
+    assert response.status_code == 200 and json.loads(response.data) == {'x': 1, 'y': 2}
+    assert json.loads(client.get('/api/v1/aged?format=json').data) == {'x': 5, 'y': 2}
+    # the path did not exist yet, the revision is not stored or no number
+    assert client.get('/api/v1/aged?rev=%d' % (first - 1)).status_code == 404
+    assert client.get('/api/v1/aged?rev=%d' % (BACKEND.revision() + 10)).status_code == 404
+    assert client.get('/api/v1/aged?rev=old').status_code == 400
+
+
+def test_diff_between_revisions():
+    first = put('changing', {'a': 1, 'b': {'c': 2}})
+    second = put('changing', {'a': 2, 'd': 'new'})
+    response = client.get('/diff/v1/changing?from=%d' % first)
+    assert response.status_code == 200
+    assert json.loads(response.data)['changes'] == [
+        {'path': 'changing/a', 'op': 'replace', 'old': 1, 'new': 2},
+        {'path': 'changing/b/c', 'op': 'remove', 'old': 2},
+        {'path': 'changing/d', 'op': 'add', 'new': 'new'},
+    ]
+    response = client.get('/diff/v1/changing?from=%d&to=%d' % (second, first))
+    assert [x['op'] for x in json.loads(response.data)['changes']] == ['replace', 'add', 'remove']
+    assert json.loads(client.get('/diff/v1/changing?from=%d&to=%d' % (first, first)).data)['changes'] == []
+
+
+def test_diff_arguments():
+    assert client.get('/diff/v1/').status_code == 400
+    assert client.get('/diff/v1/?from=x').status_code == 400
+    assert client.get('/diff/v1/?from=0&to=y').status_code == 400
+    assert client.get('/diff/v1/?from=%d' % (BACKEND.revision() + 10)).status_code == 404
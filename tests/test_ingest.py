@@ -0,0 +1,16 @@
+"""PUT bodies parsed into detached trees"""
+from configdb import app
+from configdb.node import Node
+
+client = app.test_client()
+
+
+def put(path, data, content_type):
+    return client.put('/api/v1/%s' % path, data=data, content_type=content_type)
+
+
+def test_properties_lists_and_labels():
+    body = 'a.1=second\na.0=first\nb.00=1\nb.0=2\nc.0=1\nc.k=2\n'
+    assert put('ingest/p', body, 'application/properties').status_code == 200
+    assert Node.by_path('ingest/p').unpickle() == {
+        'a': ['first', 'second'], 'b': {'00': 1, '0': 2}, 'c': {'0': 1, 'k': 2}}
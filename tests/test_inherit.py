@@ -0,0 +1,47 @@
+"""inheritance cycles and versions of the effective view"""
+import json
+
+from configdb import app
+from configdb.inherit import INHERITANCE
+
+client = app.test_client()
+
+
+def put(path, data):
+    return client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+
+
+def effective(path):
+    response = client.get('/api/v1/%s?format=json&view=effective' % path)
+    assert response.status_code == 200
+    return json.loads(response.data), response.headers['ETag']
+
+
+def test_write_adding_a_cycle_is_rejected():
+    put('cycle', {'a': {'x': 1}, 'b': {'_inherits': 'cycle/a', 'y': 2}})
+    response = put('cycle/a', {'_inherits': 'cycle/b', 'x': 1})
+    assert response.status_code == 409
+    assert b'cycle/a can not inherit from cycle/b' in response.data
+    response = client.patch(
+        '/api/v1/cycle/a', data=json.dumps({'_inherits': 'cycle/b'}), content_type='application/merge-patch+json')
+    assert response.status_code == 409
+    assert effective('cycle')[0] == {'a': {'x': 1}, 'b': {'x': 1, 'y': 2}}
+    # writes next to the cycle check are not affected
+    assert put('cycle/a/z', 3).status_code == 200
+    assert effective('cycle/b')[0] == {'x': 1, 'y': 2, 'z': 3}
+
+
+def test_effective_version_follows_layers():
+    put('layered', {'common': {'ntp': 'a'}, 'web': {'_inherits': 'layered/common'}, 'other': {}})
+    data, etag = effective('layered/web')
+    assert data == {'ntp': 'a'}
+    put('layered/other', {'v': 1})
+    assert effective('layered/web')[1] == etag
+    put('layered/common/ntp', 'b')
+    data, changed = effective('layered/web')
+    assert data == {'ntp': 'b'} and changed != etag
+
+
+def test_affected_only_dependents():
+    put('affected', {'l1': {}, 'l2': {}, 'u1': {'_inherits': 'affected/l1'}, 'u2': {'_inherits': 'affected/l2'}})
+    assert INHERITANCE.affected([('affected', 'l1', 'x')]) == {('affected', 'u1')}
@@ -0,0 +1,45 @@
+"""memoized path lookups and cached node paths"""
+import json
+
+from configdb import app
+from configdb.node import Node, PathIndex, PATHS, TREE
+
+client = app.test_client()
+
+
+def test_path_index_follows_the_root():
+    index = PathIndex()
+    first, second = Node(''), Node('')
+    index.put('a', 'node a', first)
+    assert index.get('a', first) == 'node a' and index.get('a', second) is None
+    index.put('b', 'node b', second)
+    assert index.get('a', first) is None and index.get('b', second) == 'node b'
+    index.max_entries = 2
+    index.put('c', 'node c', second)
+    index.put('d', 'node d', second)
+    assert index.get('b', second) is None and index.get('d', second) == 'node d'
+
+
+def test_lookups_of_the_current_tree():
+    response = client.put('/api/v1/memo', data=json.dumps({'a': {'b': 1}}), content_type='application/json')
+    assert response.status_code == 200
+    node = Node.by_path('memo/a/b')
+    assert PATHS.get('memo/a/b', TREE.root) is node
+    assert Node.by_path('memo/a/b') is node and node.val == 1
+    client.put('/api/v1/memo/a/b', data='2', content_type='application/json')
+    # a write publishes a new root, the old entries are not used
+    assert PATHS.get('memo/a/b', TREE.root) is None
+    assert Node.by_path('memo/a/b').val == 2 and node.val == 1
+    assert Node.by_path('memo/a/missing') is None
+
+
+def test_cached_path_follows_moves():
+    root = Node('')
+    root.pickle({'a': {'b': {'c': 1}}, 'l': [{'x': 1}, {'y': 2}]})
+    leaf = Node.by_path('a/b/c', root=root)
+    item = Node.by_path('l/1/y', root=root)
+    assert (leaf.path, item.path) == ('a/b/c', 'l/1/y')
+    root.child('a').label = 'moved'
+    root.child('l').child('0').parent = None
+    assert (leaf.path, item.path) == ('moved/b/c', 'l/0/y')
+    assert [x.label for x in leaf.xpath] == ['', 'moved', 'b', 'c']
@@ -0,0 +1,42 @@
+"""connection pools and sqlite pragmas of the engines"""
+import sqlalchemy
+import sqlalchemy.pool
+
+from configdb import meta
+from configdb.meta import app, db, read_engine
+
+
+def pragma(engine, name):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql('PRAGMA %s' % name).scalar()
+
+
+def test_engine_options():
+    memory = sqlalchemy.engine.make_url('sqlite://')
+    assert meta.in_memory(memory) and meta.engine_options(memory, {'echo': True}, 5) == {'echo': True}
+    options = meta.engine_options(sqlalchemy.engine.make_url('sqlite:////tmp/x.db'), {'pool_size': 2}, 5)
+    assert options['poolclass'] is sqlalchemy.pool.QueuePool and options['pool_size'] == 2
+    assert options['connect_args'] == {'check_same_thread': False}
+    assert options['max_overflow'] == app.config['DATABASE_MAX_OVERFLOW']
+
+
+def test_pooled_engines():
+    with app.app_context():
+        engine = db.engine
+    assert read_engine is not engine
+    assert isinstance(engine.pool, sqlalchemy.pool.QueuePool)
+    assert engine.pool.size() == app.config['DATABASE_POOL_SIZE']
+    assert read_engine.pool.size() == app.config['DATABASE_READ_POOL_SIZE']
+
+
+def test_sqlite_pragmas():
+    with app.app_context():
+        engine = db.engine
+    for checked in (engine, read_engine):
+        assert pragma(checked, 'journal_mode').lower() == app.config['SQLITE_JOURNAL_MODE'].lower()
+        assert pragma(checked, 'busy_timeout') == app.config['SQLITE_BUSY_TIMEOUT']
+        assert pragma(checked, 'cache_size') == app.config['SQLITE_CACHE_SIZE']
+        assert pragma(checked, 'synchronous') == 1
+        assert pragma(checked, 'foreign_keys') == 1
+    assert pragma(engine, 'query_only') == 0
+    assert pragma(read_engine, 'query_only') == 1
@@ -0,0 +1,53 @@
+"""request timing, Server-Timing and /metrics"""
+import json
+import logging
+
+from configdb import app
+from configdb.metrics import Metrics, RequestTimer, METRICS
+
+client = app.test_client()
+
+
+def timing(response):
+    """phase name -> entry of the Server-Timing header"""
+    return dict((x.split(';')[0], x) for x in response.headers['Server-Timing'].split(', '))
+
+
+def test_server_timing_header(monkeypatch):
+    response = client.put('/api/v1/timed', data=json.dumps({'a': 1}), content_type='application/json')
+    phases = timing(response)
+    assert {'parse', 'lookup', 'store', 'sql', 'total'} <= set(phases)
+    assert phases['sql'] != 'sql;desc="0 statements";dur=0.000'
+    assert {'cache', 'lookup', 'total'} <= set(timing(client.get('/api/v1/timed?format=yaml')))
+    monkeypatch.setitem(app.config, 'SERVER_TIMING', False)
+    assert 'Server-Timing' not in client.get('/api/v1/timed').headers
+
+
+def test_metrics_endpoint():
+    before = dict(METRICS.requests)
+    client.get('/api/v1/timed?format=json')
+    client.get('/api/v1/timed/missing?format=json')
+    key = ('GET', 'api_v1', 200)
+    assert METRICS.requests[key] == before.get(key, 0) + 1
+    assert METRICS.requests[('GET', 'api_v1', 404)] == before.get(('GET', 'api_v1', 404), 0) + 1
+    text = client.get('/metrics').data.decode('utf-8')
+    assert 'configdb_requests_total{endpoint="api_v1",method="GET",status="404"}' in text
+    assert 'configdb_request_duration_seconds_bucket{endpoint="api_v1",le="+Inf",method="GET"}' in text
+    assert 'configdb_cache_hits ' in text and 'configdb_writes_' in text
+
+
+def test_histogram_and_slow_log(monkeypatch, caplog):
+    metrics = Metrics(buckets=(0.1, 1.0))
+    timer = RequestTimer()
+    timer.add('lookup', 0.5)
+    timer.statements = 2
+    metrics.observe(timer, 'GET', 'api_v1', 200, slow=True)
+    text = metrics.render(extra={'value': 3, 'flag': True, 'name': 'x'})
+    assert 'configdb_request_duration_seconds_bucket{endpoint="api_v1",le="0.1",method="GET"} 1' in text
+    assert 'configdb_phase_total{phase="lookup"} 1' in text
+    assert 'configdb_sql_statements_total 2' in text and 'configdb_slow_requests_total 1' in text
+    assert 'configdb_extra_value 3' in text and 'configdb_extra_flag' not in text
+    monkeypatch.setitem(app.config, 'SLOW_REQUEST_SECONDS', 0)
+    with caplog.at_level(logging.WARNING):
+        client.get('/api/v1/timed?format=json')
+    assert any('slow request GET /api/v1/timed?format=json' in x.getMessage() for x in caplog.records)
@@ -0,0 +1,84 @@
+"""the msgpack reader and writer"""
+import pytest
+
+from configdb import app
+from configdb.errors import DecodeException
+from configdb.ingest import BINARY_PARSERS
+from configdb.node import Node
+from configdb.stream import WRITERS
+
+client = app.test_client()
+
+DATA = {
+    'small': [0, 127, -32, -33, 128, 65535, 65536, -129, 2 ** 40, -2 ** 40],
+    'floats': [0.5, -1e300],
+    'constants': [True, False],
+    'text': ['', 'é', 'x' * 31, 'y' * 32, 'z' * 70000],
+    'map': dict(('k%d' % i, i) for i in range(20)),
+    'list': list(range(20)),
+    'empty': {'map': {}, 'list': []},
+}
+
+
+def dump(data):
+    node = Node('')
+    node.pickle(data)
+    return b''.join(WRITERS['msgpack'](node))
+
+
+def load(*chunks):
+    return BINARY_PARSERS['msgpack'](chunks).unpickle()
+
+
+def test_encoding():
+    assert dump({'a': [1, -1, True]}) == b'\x81\xa1a\x93\x01\xff\xc3'
+    assert dump(300) == b'\xcd\x01\x2c'
+    assert dump(-200) == b'\xd1\xff\x38'
+    assert dump(1.5) == b'\xcb\x3f\xf8' + b'\x00' * 6
+    assert dump('x' * 32)[:2] == b'\xd9\x20'
+    assert dump(list(range(16)))[:3] == b'\xdc\x00\x10'
+
+
+def test_round_trip():
+    data = dump(DATA)
+    assert load(data) == DATA
+    # values split across chunks
+    assert load(*[data[i:i + 3] for i in range(0, len(data), 3)]) == DATA
+    # single precision floats and integer map keys are read as well, nil
+    # is an empty branch like null in json
+    assert load(b'\x82\x01\xca\x3f\xc0\x00\x00\xa1b\xc0') == {'1': 1.5, 'b': {}}
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\x92\x01',
+    b'\x01\x02',
+    b'\xc1',
+    b'\x81\xc0\x01',
+    b'\xa2\xff\xfe',
+])
+def test_invalid(data):
+    with pytest.raises(DecodeException):
+        load(data)
+
+
+def test_put_and_get():
+    body = dump({'port': 80, 'ratio': 0.25, 'up': False, 'name': 'web'})
+    response = client.put('/api/v1/packed', data=body, content_type='application/msgpack')
+    assert response.status_code == 200
+    response = client.get('/api/v1/packed', headers={'Accept': 'application/msgpack'})
+    assert response.status_code == 200 and response.mimetype == 'application/msgpack'
+    assert load(response.data) == {'port': 80, 'ratio': 0.25, 'up': False, 'name': 'web'}
+    assert client.get('/api/v1/packed/port?format=msgpack').data == b'\x50'
+    response = client.put('/api/v1/packed', data=b'\x92\x01', content_type='application/x-msgpack')
+    assert response.status_code == 400
+
+
+def test_bytes_leaves():
+    body = b'\x81\xa4cert\xc4\x03\x00\x01\xff'
+    response = client.put('/api/v1/packed/binary', data=body, content_type='application/msgpack')
+    assert response.status_code == 200
+    response = client.get('/api/v1/packed/binary?format=msgpack')
+    assert response.data == body
+    response = client.get('/api/v1/packed/binary/cert', headers={'Accept': 'application/octet-stream'})
+    assert response.data == b'\x00\x01\xff'
@@ -0,0 +1,48 @@
+"""the indexed in-memory node store"""
+import json
+
+import pytest
+
+from configdb import app
+from configdb.errors import InvalidPath
+from configdb.node import Node
+
+client = app.test_client()
+
+
+def test_list_children_are_indexed():
+    root = Node('')
+    root.pickle({'l': ['a', 'b', 'c'], 'd': {'x': 1}})
+    items = root.child('l')
+    assert [x.label for x in items.children] == ['0', '1', '2']
+    Node('1', parent=items).pickle('new')
+    assert items.unpickle() == ['a', 'new', 'b', 'c']
+    items.child('0').parent = None
+    assert [(x.label, x.val) for x in items.children] == [('0', 'new'), ('1', 'b'), ('2', 'c')]
+    assert items.child('01') is None and items.child('x') is None
+    assert items.child('3', create=True) is not None and items.child('5', create=True) is None
+    root.child('d').child('x').label = 'y'
+    assert root.unpickle() == {'l': ['new', 'b', 'c', {}], 'd': {'y': 1}}
+
+
+def test_by_path():
+    root = Node('')
+    root.pickle({'a': {'l': [{'b': 1}]}})
+    assert Node.by_path('a/l/0/b', root=root).val == 1
+    assert Node.by_path('a/x', root=root) is None
+    assert Node.by_path('a/x/y', create=True, root=root).path == 'a/x/y'
+    with pytest.raises(InvalidPath):
+        Node.by_path('a/l/0/b/c', root=root)
+
+
+def test_put_path_that_can_not_be_created():
+    def put(path, data):
+        return client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+
+    put('unplaced', {'b': [1, 2, 3, 4], 'leaf': 1})
+    assert put('unplaced/b/9', 1).status_code == 409
+    assert put('unplaced/b/x', 1).status_code == 409
+    assert put('unplaced/leaf/x', 1).status_code == 409
+    assert put('unplaced/b/4', 5).status_code == 200
+    assert client.get('/api/v1/unplaced/leaf/x').status_code == 404
+    assert Node.by_path('unplaced').unpickle() == {'b': [1, 2, 3, 4, 5], 'leaf': 1}
@@ -0,0 +1,89 @@
+"""PATCH with JSON merge patches and JSON patches"""
+import json
+
+from configdb import app
+from configdb.node import Node
+from configdb.backend import BACKEND
+
+client = app.test_client()
+
+
+def put(path, data):
+    response = client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+
+
+def patch(path, document, content_type='application/merge-patch+json'):
+    return client.patch('/api/v1/%s' % path, data=json.dumps(document), content_type=content_type)
+
+
+def stored(path):
+    data = Node.by_path(path).unpickle()
+    assert BACKEND.get(path) == data
+    return data
+
+
+def test_merge_patch_members():
+    put('merge', {'a': {'b': 1, 'c': 2}, 'd': 'x', 'l': [1, 2]})
+    response = patch('merge', {'a': {'b': None, 'e': 3}, 'd': {'f': 4}, 'l': [3], 'missing': None})
+    assert response.status_code == 200
+    assert json.loads(response.data)['revision'] == BACKEND.revision()
+    assert stored('merge') == {'a': {'c': 2, 'e': 3}, 'd': {'f': 4}, 'l': [3]}
+
+
+def test_merge_patch_nulls_in_new_members():
+    put('nulls', {'a': {}})
+    assert patch('nulls', {'n': {'x': None, 'y': 1}, 'a': {'c': [{'k': None, 'v': 1}]}, 'e': {}}).status_code == 200
+    assert stored('nulls') == {'n': {'y': 1}, 'a': {'c': [{'v': 1}]}, 'e': {}}
+    # a merge patch creates a missing target
+    assert patch('nulls/new', {'x': None, 'y': {'z': 1}}).status_code == 200
+    assert stored('nulls/new') == {'y': {'z': 1}}
+
+
+def test_json_patch_operations():
+    put('ops', {'a': {'b': 1}, 'l': [1, 2, 3]})
+    operations = [
+        {'op': 'add', 'path': '/a/c', 'value': {'d': 2}},
+        {'op': 'add', 'path': '/l/1', 'value': 9},
+        {'op': 'add', 'path': '/l/-', 'value': 4},
+        {'op': 'remove', 'path': '/l/0'},
+        {'op': 'replace', 'path': '/a/b', 'value': 'x'},
+        {'op': 'move', 'from': '/a/c', 'path': '/moved'},
+        {'op': 'copy', 'from': '/moved', 'path': '/copied'},
+        {'op': 'test', 'path': '/copied/d', 'value': 2},
+    ]
+    assert patch('ops', operations, 'application/json-patch+json').status_code == 200
+    assert stored('ops') == {'a': {'b': 'x'}, 'l': [9, 2, 3, 4], 'moved': {'d': 2}, 'copied': {'d': 2}}
+
+
+def test_json_patch_failed_test_rolls_back():
+    put('rollback', {'a': 1, 'l': [1, 2]})
+    revision = BACKEND.revision()
+    operations = [
+        {'op': 'replace', 'path': '/a', 'value': 2},
+        {'op': 'remove', 'path': '/l/0'},
+        {'op': 'add', 'path': '/b', 'value': 3},
+        {'op': 'test', 'path': '/a', 'value': 1},
+    ]
+    response = patch('rollback', operations, 'application/json-patch+json')
+    assert response.status_code == 409
+    assert b'test failed for /a' in response.data
+    assert BACKEND.revision() == revision
+    assert stored('rollback') == {'a': 1, 'l': [1, 2]}
+
+
+def test_json_patch_errors():
+    put('errors', {'a': 1})
+    assert patch('errors', [{'op': 'remove', 'path': '/b'}], 'application/json-patch+json').status_code == 409
+    assert patch('errors', [{'op': 'bogus', 'path': '/a'}], 'application/json-patch+json').status_code == 400
+    assert patch('errors', {'op': 'add'}, 'application/json-patch+json').status_code == 400
+    assert patch('errors/x', [], 'application/json-patch+json').status_code == 404
+    assert patch('errors', {}, 'text/plain').status_code == 415
+    assert stored('errors') == {'a': 1}
+
+
+def test_merge_patch_target_can_not_be_created():
+    put('unreachable', {'l': [1], 'leaf': 1})
+    assert patch('unreachable/l/5', {'a': 1}).status_code == 409
+    assert patch('unreachable/leaf/x', {'a': 1}).status_code == 409
+    assert stored('unreachable') == {'l': [1], 'leaf': 1}
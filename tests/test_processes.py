@@ -0,0 +1,151 @@
+"""several configdb processes sharing one database
+
+Every test runs against a temporary sqlite database and against the
+postgresql database in CONFIGDB_TEST_POSTGRES, by default a locally
+started server with a configdb_test database. Its tables are dropped
+first. The postgresql runs are skipped when psycopg2 is missing or no
+server answers.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import sqlalchemy
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+POSTGRES = os.environ.get('CONFIGDB_TEST_POSTGRES', 'postgresql://localhost/configdb_test')
+
+
+class Worker(object):
+    """a configdb process, see worker.py"""
+    def __init__(self, settings):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER, settings], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    def request(self, method, url, body=None, **headers):
+        self.process.stdin.write(json.dumps([method, url, body, headers]) + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        assert line, 'worker exited'
+        return json.loads(line)
+
+    def get(self, path, query=''):
+        response = self.request('GET', '/api/v1/%s?format=json%s' % (path, query))
+        assert response['status'] == 200, response
+        return json.loads(response['text']), response['etag']
+
+    def put(self, path, body):
+        response = self.request('PUT', '/api/v1/%s' % path, body)
+        assert response['status'] == 200, response
+        return response
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(timeout=30)
+
+
+def postgres_database():
+    """URI of the test database with empty tables, skips without a server"""
+    pytest.importorskip('psycopg2')
+    engine = sqlalchemy.create_engine(POSTGRES)
+    try:
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS history, revision, node CASCADE'))
+    except sqlalchemy.exc.OperationalError as e:
+        pytest.skip('no postgresql server at %s: %s' % (POSTGRES, e.orig))
+    finally:
+        engine.dispose()
+    return POSTGRES
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def database(request, tmp_path):
+    """settings of a database backend with an empty database"""
+    if request.param == 'sqlite':
+        uri = 'sqlite:///%s' % (tmp_path / 'configdb.db')
+    else:
+        uri = postgres_database()
+    return {
+        'DEBUG': False,
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'CONFIGDB_BACKEND': request.param,
+        'BLOB_DIR': str(tmp_path / 'blobs'),
+        'SYNC_INTERVAL': 0,
+    }
+
+
+@pytest.fixture
+def workers(database, tmp_path):
+    """start processes on the database, keyword arguments override its
+    settings"""
+    started = []
+
+    def start(**overrides):
+        settings = dict(database, **overrides)
+        path = tmp_path / ('configdb-%d.cfg' % len(started))
+        path.write_text(''.join('%s = %r\n' % x for x in sorted(settings.items())))
+        worker = Worker(str(path))
+        started.append(worker)
+        return worker
+    yield start
+    for worker in started:
+        worker.close()
+
+
+def test_reads_see_writes_of_other_processes(workers):
+    a, b = workers(), workers()
+    a.put('hosts/web1', {'port': 80})
+    data, etag = b.get('hosts')
+    assert data == {'web1': {'port': 80}}
+    assert a.get('hosts') == (data, etag)
+
+
+def test_write_on_top_of_another_process(workers):
+    a, b = workers(SYNC_INTERVAL=None), workers(SYNC_INTERVAL=None)
+    a.put('hosts/web1', {'port': 80})
+    # b only finds a's write when storing, its batch is applied again
+    b.put('hosts/web2', {'port': 81})
+    assert b.get('hosts')[0] == {'web1': {'port': 80}, 'web2': {'port': 81}}
+
+
+def test_patch_applies_to_the_stored_tree(workers):
+    a, b = workers(), workers(SYNC_INTERVAL=None)
+    a.put('app', {'a': 1})
+    a.put('app', {'a': 2, 'b': 1})
+    # b has not seen app yet, the patch is applied again on a's tree
+    response = b.request('PATCH', '/api/v1/app', {'c': 3}, **{'Content-Type': 'application/merge-patch+json'})
+    assert response['status'] == 200, response
+    assert a.get('app')[0] == {'a': 2, 'b': 1, 'c': 3}
+    assert b.get('app') == a.get('app')
+
+
+def test_history_after_restart(workers):
+    a = workers()
+    a.put('app', {'a': 1})
+    first = revision(a.get('app')[1])
+    a.put('app', {'a': 2})
+    a.close()
+    b = workers()
+    assert revision(b.get('app')[1]) == first + 1
+    assert b.get('app', '&rev=%d' % first)[0] == {'a': 1}
+    response = b.request('GET', '/diff/v1/app?from=%d' % first)
+    assert response['status'] == 200, response
+    assert json.loads(response['text'])['changes'] == [{'path': 'app/a', 'op': 'replace', 'old': 1, 'new': 2}]
+
+
+def revision(etag):
+    """the revision in an entity tag"""
+    return int(etag.strip('"').split('-')[1])
+
+
+def test_search(workers):
+    a = workers()
+    a.put('hosts', {'web1': {'port': 80}, 'web2': {'port': 8080}, 'db1': {'port': 5432}})
+    response = a.request('GET', '/search/v1/hosts?label=port&min=1024')
+    assert response['status'] == 200, response
+    results = json.loads(response['text'])
+    assert [x['path'] for x in results['results']] == ['hosts/db1/port', 'hosts/web2/port']
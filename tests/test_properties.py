@@ -0,0 +1,49 @@
+"""java properties parsing and the tree built from it"""
+from configdb.propertyparser import PropertyParser
+from configdb.ingest import load_prop
+
+
+def load(text):
+    return load_prop([text]).unpickle()
+
+
+def test_items_follow_java_rules():
+    text = '\n'.join([
+        '# comment',
+        '! comment',
+        'plain = value',
+        'colon:1',
+        'spaced key',
+        'escaped\\ key\\:x = a\\tb',
+        'unicode = \\u00e9',
+        'long = first, \\',
+        '    second',
+        'quoted = "12"',
+        'flag = yes',
+        'number = 2.5',
+    ])
+    assert list(PropertyParser.items(text.split('\n'))) == [
+        ('plain', 'value'), ('colon', 1), ('spaced', 'key'), ('escaped key:x', 'a\tb'),
+        ('unicode', 'é'), ('long', 'first, second'), ('quoted', '12'), ('flag', True), ('number', 2.5)]
+
+
+def test_lists_while_parsing():
+    assert load('a.0=x\na.1=z\na.1.b=1\nc.0.d=1\nc.1.d=2') == {'a': ['x', {'b': 1}], 'c': [{'d': 1}, {'d': 2}]}
+    # out of order indexes, gaps are closed
+    assert load('a.2=z\na.0=x') == {'a': ['x', 'z']}
+    assert load('a.0=x\na.2=z\na.b=1') == {'a': {'0': 'x', '2': 'z', 'b': 1}}
+    assert load('0=x\n1=z') == ['x', 'z']
+    assert load('') == {}
+
+
+def test_leaves_and_containers_replace_each_other():
+    assert load('a=1\na.b=2') == {'a': {'b': 2}}
+    assert load('a.b=2\na=1') == {'a': 1}
+    assert load('a.b.c=1\nd=1\na.b.e=2') == {'a': {'b': {'c': 1, 'e': 2}}, 'd': 1}
+
+
+def test_dump_and_load():
+    data = {'hosts': {'web1': {'ports': [80, 443], 'name': 'a b', 'up': True}}, 'ratio': 0.5}
+    parser = PropertyParser()
+    parser.load(PropertyParser(data).dump())
+    assert parser.data == data
@@ -0,0 +1,76 @@
+"""cached reverse lookups for HOSTNAME"""
+import socket
+import threading
+
+from configdb import app
+from configdb.resolver import HostResolver, RESOLVER
+from configdb.node import Node
+
+client = app.test_client()
+
+
+def test_cached_and_negative_lookups(monkeypatch):
+    queried = []
+
+    def gethostbyaddr(address):
+        queried.append(address)
+        if address == '10.0.0.2':
+            raise socket.herror('unknown')
+        return ('host-%s' % address, [], [address])
+
+    monkeypatch.setattr(socket, 'gethostbyaddr', gethostbyaddr)
+    resolver = HostResolver(300, 30, 2.0)
+    assert [resolver.resolve('10.0.0.1') for _ in range(3)] == ['host-10.0.0.1'] * 3
+    assert resolver.resolve('10.0.0.2') is None
+    assert resolver.resolve('10.0.0.2') is None
+    assert queried == ['10.0.0.1', '10.0.0.2']
+    stats = resolver.stats()
+    assert (stats['hits'], stats['misses'], stats['failures'], stats['lookups']) == (3, 2, 1, 2)
+
+
+def test_hosts_file_and_timeout(monkeypatch, tmp_path):
+    release = threading.Event()
+
+    def gethostbyaddr(address):
+        release.wait(5)
+        return ('slow', [], [address])
+
+    monkeypatch.setattr(socket, 'gethostbyaddr', gethostbyaddr)
+    hosts = tmp_path / 'hosts'
+    hosts.write_text('# comment\n10.0.0.1 static static.alias\n')
+    resolver = HostResolver(300, 30, 0.05, str(hosts))
+    assert resolver.resolve('10.0.0.1') == 'static'
+    assert resolver.resolve('10.0.0.3') is None
+    release.set()
+    resolver.executor.shutdown(wait=True)
+    # the lookup kept running and filled the cache
+    assert resolver.resolve('10.0.0.3') == 'slow'
+    stats = resolver.stats()
+    assert (stats['static'], stats['timeouts'], stats['hits']) == (1, 1, 1)
+
+
+def test_concurrent_counters(monkeypatch):
+    monkeypatch.setattr(socket, 'gethostbyaddr', lambda x: ('name', [], [x]))
+    resolver = HostResolver(300, 30, 2.0)
+
+    def resolve():
+        for index in range(500):
+            resolver.resolve('10.0.1.%d' % (index % 20))
+    threads = [threading.Thread(target=resolve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = resolver.stats()
+    assert stats['hits'] + stats['misses'] == 4000
+    assert stats['lookups'] == 20
+
+
+def test_hostname_in_path(monkeypatch):
+    monkeypatch.setattr(RESOLVER, 'resolve', lambda address: 'web1' if address == '127.0.0.1' else None)
+    response = client.put('/api/v1/hostname/HOSTNAME', data='{"port": 80}', content_type='application/json')
+    assert response.status_code == 200
+    assert Node.by_path('hostname/web1').unpickle() == {'port': 80}
+    assert client.get('/api/v1/hostname/HOSTNAME/port?format=json').data == b'80'
+    response = client.get('/api/v1/hostname/HOSTNAME', environ_base={'REMOTE_ADDR': '10.9.9.9'})
+    assert response.status_code == 400
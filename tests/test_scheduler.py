@@ -0,0 +1,158 @@
+"""path locks, group commits and retried stores of the write scheduler"""
+import threading
+import time
+
+import pytest
+
+from configdb.meta import db
+from configdb.node import Node
+from configdb.backend import BACKEND
+from configdb.metrics import RequestTimer, charged, phase
+from configdb.scheduler import PathLocks, WriteScheduler
+from configdb import schema
+
+
+def wait_for(condition, timeout=5):
+    """poll until condition() holds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    return thread
+
+
+def put(path, data):
+    """operation replacing path with data"""
+    def operation(root):
+        Node.by_path(path, create=True, root=root).pickle(data)
+        return [path]
+    return operation
+
+
+def stored(path):
+    """the structure at path in the tree and in the database, they agree"""
+    data = Node.by_path(path).unpickle()
+    assert BACKEND.get(path) == data
+    return data
+
+
+def test_ancestor_waits_for_descendant():
+    locks = PathLocks()
+    granted = []
+
+    def lock(path):
+        with locks.lock(path):
+            granted.append(path)
+
+    with locks.lock('a/b'):
+        ancestor = start(lock, 'a')
+        wait_for(lambda: len(locks.entries) == 2)
+        descendant = start(lock, 'a/b/c')
+        wait_for(lambda: len(locks.entries) == 3)
+        sibling = start(lock, 'x')
+        sibling.join(5)
+        assert granted == ['x']
+    ancestor.join(5)
+    descendant.join(5)
+    assert granted == ['x', 'a', 'a/b/c']
+
+
+def test_conflicting_writes_in_arrival_order():
+    scheduler = WriteScheduler(16, 0)
+    with scheduler.locks.lock('order'):
+        first = start(scheduler.submit, 'order/a', put('order/a', {'x': 1}))
+        wait_for(lambda: len(scheduler.locks.entries) == 2)
+        second = start(scheduler.submit, 'order', put('order', {'b': 2}))
+        wait_for(lambda: len(scheduler.locks.entries) == 3)
+    first.join(5)
+    second.join(5)
+    assert stored('order') == {'b': 2}
+
+
+def test_failing_write_leaves_its_batch():
+    scheduler = WriteScheduler(16, 0.2)
+    errors = {}
+
+    def failing(root):
+        Node.by_path('batch/b', create=True, root=root).pickle({'half': 'written'})
+        raise ValueError('invalid')
+
+    def submit(path, operation):
+        try:
+            scheduler.submit(path, operation)
+        except ValueError as e:
+            errors[path] = e
+
+    threads = [
+        start(submit, 'batch/a', put('batch/a', 1)),
+        start(submit, 'batch/b', failing),
+        start(submit, 'batch/c', put('batch/c', 3)),
+    ]
+    for thread in threads:
+        thread.join(5)
+    assert scheduler.batches == 1
+    assert list(errors) == ['batch/b']
+    assert stored('batch') == {'a': 1, 'c': 3}
+
+
+def test_operations_charged_to_their_request():
+    scheduler = WriteScheduler(16, 0.2)
+    timers = [RequestTimer(), RequestTimer()]
+
+    def slow(path, seconds):
+        def operation(root):
+            with phase('operation'):
+                time.sleep(seconds)
+            Node.by_path(path, create=True, root=root).pickle(seconds)
+            return [path]
+        return operation
+
+    def submit(timer, path, seconds):
+        with charged(timer):
+            scheduler.submit(path, slow(path, seconds))
+
+    threads = [start(submit, timers[0], 'timed/a', 0.01), start(submit, timers[1], 'timed/b', 0.1)]
+    for thread in threads:
+        thread.join(5)
+    assert scheduler.batches == 1
+    assert timers[0].phases['operation'] < 0.1 <= timers[1].phases['operation']
+    assert timers[0].phases['store'] == timers[1].phases['store']
+
+
+def test_store_retried_after_integrity_error(monkeypatch):
+    class Conflicting(schema.BulkPickle):
+        """a row at the same path appears before the first insert"""
+        conflicts = 1
+
+        def insert_rows(self, mappings, ids):
+            if Conflicting.conflicts:
+                Conflicting.conflicts -= 1
+                db.session.bulk_insert_mappings(schema.Node, mappings[:1], render_nulls=True)
+            super(Conflicting, self).insert_rows(mappings, ids)
+
+    monkeypatch.setattr(BACKEND, 'pickler', Conflicting)
+    before = BACKEND.revision()
+    revision = WriteScheduler(16, 0).submit('retried', put('retried', {'x': {'y': 1}}))
+    assert Conflicting.conflicts == 0
+    assert revision == before + 1 == BACKEND.revision()
+    assert stored('retried') == {'x': {'y': 1}}
+    history = schema.History.query.filter(schema.History.path.like('/retried/%')).all()
+    assert sorted(x.path for x in history) == ['/retried/', '/retried/x/', '/retried/x/y/']
+
+
+def test_store_gives_up_after_retries(monkeypatch):
+    class Conflicting(schema.BulkPickle):
+        def insert_rows(self, mappings, ids):
+            db.session.bulk_insert_mappings(schema.Node, mappings[:1], render_nulls=True)
+            super(Conflicting, self).insert_rows(mappings, ids)
+
+    monkeypatch.setattr(BACKEND, 'pickler', Conflicting)
+    with pytest.raises(Exception, match='UNIQUE'):
+        WriteScheduler(16, 0).submit('failed', put('failed', {'x': 1}))
+    assert Node.by_path('failed') is None
+    assert BACKEND.get('failed') is None
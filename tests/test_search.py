@@ -0,0 +1,95 @@
+"""search for leaves by label, value and type"""
+import json
+from urllib.parse import quote
+
+import pytest
+
+from configdb import app
+from configdb.errors import InvalidSearch
+from configdb.node import Node
+from configdb.search import Search
+
+client = app.test_client()
+
+DATA = {
+    'db1': {'port': 5432, 'name': 'db 1', 'ratio': 0.5, 'up': True},
+    'web1': {'port': 80, 'name': 'web 1', 'ratio': 1.5, 'up': False},
+    'web2': {'port': 8080, 'name': '80', 'ports': [80, 443]},
+    'a/b': {'port': 22},
+}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def inventory():
+    response = client.put('/api/v1/inventory', data=json.dumps(DATA), content_type='application/json')
+    assert response.status_code == 200
+
+
+def search(query):
+    response = client.get('/search/v1/inventory?%s' % query)
+    assert response.status_code == 200, response.data
+    return json.loads(response.data)
+
+
+def paths(query):
+    return [x['path'] for x in search(query)['results']]
+
+
+def test_filters():
+    assert paths('label=port') == ['inventory/a/b/port', 'inventory/db1/port', 'inventory/web1/port',
+                                   'inventory/web2/port']
+    assert paths('label=port&min=100&max=6000') == ['inventory/db1/port']
+    assert paths('label=po*&max=80') == ['inventory/a/b/port', 'inventory/web1/port']
+    # list items are labeled by their index
+    assert paths('label=1') == ['inventory/web2/ports/1']
+    # a value stands for every type it can be read as
+    assert paths('value=80') == ['inventory/web1/port', 'inventory/web2/name', 'inventory/web2/ports/0']
+    assert paths('value=80&type=str') == ['inventory/web2/name']
+    assert paths('value=true') == ['inventory/db1/up']
+    assert paths('type=float') == ['inventory/db1/ratio', 'inventory/web1/ratio']
+    assert paths('label=n?me&value=web 1') == ['inventory/web1/name']
+    assert search('label=up&value=false')['results'] == [{'path': 'inventory/web1/up', 'value': False}]
+    assert paths('label=missing') == []
+
+
+def test_pages():
+    expected = paths('type=int&limit=1000')
+    found = []
+    cursor = ''
+    while True:
+        page = search('type=int&limit=2' + ('&after=%s' % quote(cursor) if cursor else ''))
+        found.extend(x['path'] for x in page['results'])
+        cursor = page['next']
+        if cursor is None:
+            break
+        assert len(page['results']) == 2
+    assert found == expected and len(found) == 6
+
+
+@pytest.mark.parametrize('query, message', [
+    ('limit=0', 'limit must be between 1 and 1000'),
+    ('limit=1001', 'limit must be between 1 and 1000'),
+    ('limit=x', 'limit must be a number'),
+    ('min=low', 'min must be a number'),
+    ('max=nan', 'max must be a number'),
+    ('type=int,list', 'unknown type list'),
+])
+def test_invalid_arguments(query, message):
+    response = client.get('/search/v1/inventory?%s' % query)
+    assert response.status_code == 400 and message in response.get_data(as_text=True)
+
+
+def test_memory_walk():
+    root = Node('')
+    root.pickle({'inventory': DATA})
+    query = Search.from_args('inventory', {'label': 'port', 'limit': '3'}, 1000)
+    results = query.walk(root)
+    assert [labels for labels, value in results] == [
+        ('inventory', 'a/b', 'port'), ('inventory', 'db1', 'port'), ('inventory', 'web1', 'port')]
+    page = query.page(results)
+    assert page['next'] == 'inventory/web1/port'
+    query = Search.from_args('inventory', {'label': 'port', 'after': page['next']}, 1000)
+    assert query.walk(root) == [(('inventory', 'web2', 'port'), 8080)]
+    assert Search('nowhere').walk(root) == []
+    with pytest.raises(InvalidSearch):
+        Search.from_args('', {'limit': '5'}, 4)
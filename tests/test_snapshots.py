@@ -0,0 +1,50 @@
+"""copy-on-write versions of the in-memory tree"""
+import pytest
+
+from configdb.node import Node, Tree
+
+
+def write(tree, path, data, revision):
+    """replace path with data in a transaction of tree, publish revision"""
+    with tree.write() as transaction:
+        Node.by_path(path, create=True, root=transaction.root).pickle(data)
+        return transaction.commit(lambda *paths: revision, path)
+
+
+def test_published_trees_do_not_change():
+    tree = Tree(10)
+    write(tree, 'a', {'x': 1, 'y': {'z': 2}}, 1)
+    first = tree.root
+    write(tree, 'a/x', 3, 2)
+    assert first.unpickle() == {'a': {'x': 1, 'y': {'z': 2}}}
+    assert tree.root.unpickle() == {'a': {'x': 3, 'y': {'z': 2}}}
+    # unchanged subtrees are shared
+    assert Node.by_path('a/y', root=first) is Node.by_path('a/y', root=tree.root)
+
+
+def test_uncommitted_and_failed_writes():
+    tree = Tree(10)
+    write(tree, 'a', {'x': 1}, 1)
+    root = tree.root
+    with tree.write() as transaction:
+        Node.by_path('a/x', root=transaction.root).pickle(2)
+    assert tree.root is root and root.unpickle() == {'a': {'x': 1}}
+    with tree.write() as transaction:
+        Node.by_path('b', create=True, root=transaction.root).pickle(1)
+        with pytest.raises(ValueError):
+            with transaction.savepoint():
+                Node.by_path('a/x', root=transaction.root).pickle(5)
+                raise ValueError()
+        transaction.commit(lambda *paths: 2, 'b')
+    assert tree.root.unpickle() == {'a': {'x': 1}, 'b': 1}
+
+
+def test_snapshots_of_revisions():
+    tree = Tree(3)
+    for revision in range(1, 6):
+        write(tree, 'v', revision, revision * 2)
+    assert tree.snapshot(10).unpickle() == {'v': 5}
+    assert tree.snapshot(7).unpickle() == {'v': 3}
+    assert tree.snapshot(6).unpickle() == {'v': 3}
+    assert tree.snapshot(5) is None
+    assert list(tree.snapshots) == [6, 8, 10]
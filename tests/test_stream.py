@@ -0,0 +1,54 @@
+"""streaming serializers, the same output as the whole structure dumped"""
+import json
+
+import yaml
+
+from configdb import app
+from configdb.node import Node
+from configdb.propertyparser import PropertyParser
+from configdb.stream import WRITERS, buffered
+
+client = app.test_client()
+
+DATA = {
+    'hosts': {
+        'web1': {'port': 80, 'ratio': 0.5, 'up': True, 'name': 'web 1', 'tags': ['a', 'b'], 'empty': {}},
+        'db': {'port': 5432, 'quoted': 'yes', 'number': '12', 'multi': 'line\nbreak', 'list': []},
+    },
+    'unicode': 'é',
+    'nested': [[1, 2], {'k': None}],
+}
+
+
+def tree(data):
+    node = Node('')
+    node.pickle(data)
+    return node
+
+
+def render(fmt, data):
+    return ''.join(WRITERS[fmt](tree(data)))
+
+
+def test_same_output_as_dumps():
+    for data in (DATA, DATA['hosts']['web1'], [1, 'x'], {}, 'leaf', 1.5):
+        data = tree(data).unpickle()
+        assert render('json', data) == json.dumps(data, indent=2)
+        assert render('yaml', data) == yaml.dump(data)
+        assert render('prop', data) == PropertyParser(data).dump()
+
+
+def test_buffered_chunks():
+    assert list(buffered(['ab', 'c', 'de', 'f'], 3)) == ['abc', 'def']
+    assert list(buffered([b'ab', b'c', b'd'], 3)) == [b'abc', b'd']
+    assert list(buffered([])) == []
+
+
+def test_streamed_get():
+    response = client.put('/api/v1/streamed', data=json.dumps(DATA), content_type='application/json')
+    assert response.status_code == 200
+    expected = tree(DATA).unpickle()
+    response = client.get('/api/v1/streamed?format=json')
+    assert response.is_streamed and json.loads(response.data) == expected
+    assert yaml.safe_load(client.get('/api/v1/streamed?format=yaml').data) == expected
+    assert client.get('/api/v1/streamed?format=prop').data.decode('utf-8') == PropertyParser(expected).dump()
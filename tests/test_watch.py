@@ -0,0 +1,71 @@
+"""long poll watches of ?watch=1"""
+import json
+import threading
+import time
+
+from configdb import app
+from configdb.cache import VERSIONS
+from configdb.watch import ChangeHub
+
+client = app.test_client()
+
+
+def put(path, data):
+    response = client.put('/api/v1/%s' % path, data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 200
+
+
+def watch(path, query=''):
+    response = client.get('/api/v1/%s?watch=1%s' % (path, query))
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+
+def test_watch_returns_on_write():
+    put('watched', {'a': 1, 'b': 2})
+    since = VERSIONS.version('watched')
+    writer = threading.Timer(0.2, put, ('watched/a', 3))
+    writer.start()
+    start = time.monotonic()
+    result = watch('watched', '&since=%d&timeout=5' % since)
+    writer.join()
+    assert time.monotonic() - start < 5
+    assert result == {'revision': VERSIONS.version('watched'), 'changed': ['watched/a']}
+
+
+def test_watch_past_revision_and_timeout():
+    put('polled', {'a': 1})
+    since = VERSIONS.version('polled')
+    put('polled/a', 2)
+    # a change after since is reported without waiting
+    assert watch('polled', '&since=%d' % since)['changed'] == ['polled/a']
+    start = time.monotonic()
+    assert watch('polled', '&timeout=0.1')['changed'] == []
+    assert time.monotonic() - start >= 0.1
+    assert client.get('/api/v1/polled?watch=1&since=x').status_code == 400
+
+
+def test_only_related_waiters_wake():
+    hub = ChangeHub(10)
+    woken = []
+
+    def wait(path):
+        hub.wait(path, VERSIONS.version(path), 5)
+        woken.append(path)
+    threads = dict((x, threading.Thread(target=wait, args=(x, ))) for x in ('hub/a/b', 'hub/a/c', 'hub/d'))
+    for thread in threads.values():
+        thread.start()
+    deadline = time.monotonic() + 5
+    while hub.stats()['watchers'] < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    hub.publish(1, 'hub/a/b/x')
+    threads['hub/a/b'].join(1)
+    assert woken == ['hub/a/b']
+    hub.publish(2, 'hub/a')
+    threads['hub/a/c'].join(1)
+    assert woken == ['hub/a/b', 'hub/a/c']
+    hub.publish(3, 'hub')
+    threads['hub/d'].join(1)
+    assert hub.stats()['watchers'] == 0
+    assert hub.changes('hub/a/c', 0) == ['hub/a', 'hub'] and hub.changes('hub/d', 2) == ['hub']
@@ -0,0 +1,35 @@
+"""a configdb process driven over stdin and stdout
+
+Started with the settings file as only argument. Every input line is a
+json list [method, url, body, headers], body a json structure or None.
+The answer is a json object with status, etag and the response text.
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ['CONFIGDB_SETTINGS'] = os.path.abspath(sys.argv[1])
+
+from configdb import app  # noqa: E402
+
+
+def main():
+    client = app.test_client()
+    for line in sys.stdin:
+        method, url, body, headers = json.loads(line)
+        kwargs = {'headers': headers or {}}
+        if body is not None:
+            kwargs['data'] = json.dumps(body)
+            kwargs['content_type'] = kwargs['headers'].pop('Content-Type', 'application/json')
+        response = client.open(url, method=method, **kwargs)
+        sys.stdout.write(json.dumps({
+            'status': response.status_code,
+            'etag': response.headers.get('ETag'),
+            'text': response.get_data(as_text=True),
+        }) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()